@@ -1,30 +1,264 @@
-from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask import Flask, Response, request, jsonify
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.serving import is_running_from_reloader
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime, timedelta
+from functools import wraps
+import click
+import ipaddress
+import json
 import os
+import time
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///freelance_platform.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///freelance_platform.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'your-secret-key-change-in-production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
+app.config['SKILL_INDEX_REFRESH_SECONDS'] = int(os.environ.get('SKILL_INDEX_REFRESH_SECONDS', 300))
+app.config['QUERY_AUDIT'] = os.environ.get('QUERY_AUDIT', '0') == '1'
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+app.config['IDENTITY_CACHE_TTL_SECONDS'] = int(os.environ.get('IDENTITY_CACHE_TTL_SECONDS', 60))
+app.config['REVOCATION_REFRESH_SECONDS'] = int(os.environ.get('REVOCATION_REFRESH_SECONDS', 60))
+app.config['PAYMENT_WORKERS'] = int(os.environ.get('PAYMENT_WORKERS', 2))
+app.config['PAYMENT_MAX_ATTEMPTS'] = int(os.environ.get('PAYMENT_MAX_ATTEMPTS', 5))
+app.config['PAYMENT_RETRY_BACKOFF_SECONDS'] = float(os.environ.get('PAYMENT_RETRY_BACKOFF_SECONDS', 2.0))
+app.config['PAYMENT_GATEWAY_LATENCY_MS'] = float(os.environ.get('PAYMENT_GATEWAY_LATENCY_MS', 0))
+app.config['PAYMENT_GATEWAY_ERROR_RATE'] = float(os.environ.get('PAYMENT_GATEWAY_ERROR_RATE', 0.0))
+app.config['PAYMENT_GATEWAY_TIMEOUT_RATE'] = float(os.environ.get('PAYMENT_GATEWAY_TIMEOUT_RATE', 0.0))
+app.config['PAYMENT_GATEWAY_DECLINE_RATE'] = float(os.environ.get('PAYMENT_GATEWAY_DECLINE_RATE', 0.05))
+app.config['PAYMENT_GATEWAY_SIMULATOR'] = json.loads(os.environ.get('PAYMENT_GATEWAY_SIMULATOR', '{}'))
+app.config['PAYMENT_GATEWAY_URLS'] = dict(
+    item.split('=', 1) for item in os.environ.get('PAYMENT_GATEWAY_URLS', '').split(',') if '=' in item
+)
+app.config['PAYMENT_GATEWAY_TIMEOUT_SECONDS'] = float(os.environ.get('PAYMENT_GATEWAY_TIMEOUT_SECONDS', 10))
+app.config['PAYMENT_GATEWAY_POOL_SIZE'] = int(os.environ.get('PAYMENT_GATEWAY_POOL_SIZE', 4))
+app.config['TXN_NODE_LEASE_SECONDS'] = float(os.environ.get('TXN_NODE_LEASE_SECONDS', 60))
+app.config['IDEMPOTENCY_TTL_SECONDS'] = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+app.config['IDEMPOTENCY_LOCK_SECONDS'] = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 60))
+app.config['PAYOUT_OUTPUT_DIR'] = os.environ.get('PAYOUT_OUTPUT_DIR', os.path.join(app.instance_path, 'payouts'))
+app.config['PAYOUT_CHUNK_SIZE'] = int(os.environ.get('PAYOUT_CHUNK_SIZE', 500))
+app.config['PAYMENT_WEBHOOK_SECRETS'] = dict(
+    item.split('=', 1) for item in os.environ.get('PAYMENT_WEBHOOK_SECRETS', '').split(',') if '=' in item
+)
+app.config['PAYMENT_WEBHOOK_TOLERANCE_SECONDS'] = int(os.environ.get('PAYMENT_WEBHOOK_TOLERANCE_SECONDS', 300))
+app.config['ESCROW_AUTO_RELEASE_DAYS'] = float(os.environ.get('ESCROW_AUTO_RELEASE_DAYS', 14))
+app.config['ESCROW_RELEASE_BATCH_SIZE'] = int(os.environ.get('ESCROW_RELEASE_BATCH_SIZE', 200))
+app.config['RECONCILIATION_WORK_DIR'] = os.environ.get('RECONCILIATION_WORK_DIR') or None
+app.config['RECONCILIATION_PARTITION_ROWS'] = int(os.environ.get('RECONCILIATION_PARTITION_ROWS', 500000))
+app.config['METRICS_ALLOWED_NETWORKS'] = [
+    ipaddress.ip_network(item.strip(), strict=False)
+    for item in os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.1,::1').split(',') if item.strip()
+]
 
-db = SQLAlchemy(app)
 jwt = JWTManager(app)
 
 # Import models and services after app initialization
-from models import User, FreelancerProfile, Job, Application, Payment
+from models import db, Fieldset, User, FreelancerProfile, Job, Application, Payment, PaymentTask, RevokedToken
 from matching_service import MatchingService
-from payment_service import PaymentService
+from payment_service import PaymentService, GatewayUnavailable
+from gateways import build_gateways
+from id_generator import TransactionIdGenerator
+from node_lease_service import NodeLeaseService, NodeIdUnavailable
+from payment_queue import PaymentQueue
+from escrow_scheduler import EscrowScheduler
+from ledger_service import LedgerService
+from money import to_paise, to_rupees, parse_amount, convert_legacy_amounts
+from payout_service import PayoutService
+from reconciliation_service import ReconciliationService
+from webhook_service import WebhookService, SIGNATURE_HEADER, TIMESTAMP_HEADER
+from skill_service import SkillService
+from facet_service import FacetService
+from query_audit import QueryAuditService, ensure_indexes
+from migrations import ensure_columns, drop_superseded_indexes, drop_duplicates
+from http_cache import make_etag, not_modified, cacheable
+from streaming import wants_stream, stream_json_list
+from fragment_cache import FragmentCache, join_fragments, with_fragment
+from pagination import keyset_page, InvalidCursor
+from password_service import PasswordService, HashingUnavailable
+from identity_service import IdentityService
+from revocation_service import RevocationService
+from idempotency import IdempotencyService
+
+db.init_app(app)
 
 matching_service = MatchingService()
-payment_service = PaymentService()
+ledger_service = LedgerService()
+node_lease_service = NodeLeaseService(ttl_seconds=app.config['TXN_NODE_LEASE_SECONDS'])
+payment_service = PaymentService(
+    gateways=build_gateways(
+        ['razorpay', 'paytm', 'phonepe', 'cashfree', 'instamojo'],
+        simulator_defaults={
+            'latency_ms': app.config['PAYMENT_GATEWAY_LATENCY_MS'],
+            'error_rate': app.config['PAYMENT_GATEWAY_ERROR_RATE'],
+            'timeout_rate': app.config['PAYMENT_GATEWAY_TIMEOUT_RATE'],
+            'decline_rate': app.config['PAYMENT_GATEWAY_DECLINE_RATE']
+        },
+        simulator_overrides=app.config['PAYMENT_GATEWAY_SIMULATOR'],
+        urls=app.config['PAYMENT_GATEWAY_URLS'],
+        api_keys={'razorpay': os.environ.get('RAZORPAY_KEY_SECRET'), 'paytm': os.environ.get('PAYTM_MERCHANT_KEY')},
+        pool_size=app.config['PAYMENT_GATEWAY_POOL_SIZE'],
+        timeout_seconds=app.config['PAYMENT_GATEWAY_TIMEOUT_SECONDS']
+    ),
+    on_transition=ledger_service.post,
+    id_generator=TransactionIdGenerator(node_id=node_lease_service.node_id)
+)
+payout_service = PayoutService(
+    payment_service,
+    output_dir=app.config['PAYOUT_OUTPUT_DIR'],
+    chunk_size=app.config['PAYOUT_CHUNK_SIZE']
+)
+reconciliation_service = ReconciliationService(
+    work_dir=app.config['RECONCILIATION_WORK_DIR'],
+    partition_rows=app.config['RECONCILIATION_PARTITION_ROWS']
+)
+payment_queue = PaymentQueue(
+    workers=app.config['PAYMENT_WORKERS'],
+    max_attempts=app.config['PAYMENT_MAX_ATTEMPTS'],
+    backoff_seconds=app.config['PAYMENT_RETRY_BACKOFF_SECONDS']
+)
+webhook_service = WebhookService(
+    app.config['PAYMENT_WEBHOOK_SECRETS'],
+    payment_service.apply_gateway_status,
+    batch=ledger_service.batch,
+    tolerance_seconds=app.config['PAYMENT_WEBHOOK_TOLERANCE_SECONDS']
+)
+escrow_scheduler = EscrowScheduler(
+    release_after_days=app.config['ESCROW_AUTO_RELEASE_DAYS'],
+    batch_size=app.config['ESCROW_RELEASE_BATCH_SIZE']
+)
+skill_service = SkillService(refresh_seconds=app.config['SKILL_INDEX_REFRESH_SECONDS'])
+query_audit = QueryAuditService()
+facet_service = FacetService()
+fragment_cache = FragmentCache(max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'])
+fragment_cache.init_session_events()
+password_service = PasswordService(
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_queue=app.config['PASSWORD_HASH_QUEUE'],
+    method=app.config['PASSWORD_HASH_METHOD']
+)
+identity_service = IdentityService(ttl_seconds=app.config['IDENTITY_CACHE_TTL_SECONDS'])
+revocation_service = RevocationService(refresh_seconds=app.config['REVOCATION_REFRESH_SECONDS'])
+idempotency_service = IdempotencyService(ttl_seconds=app.config['IDEMPOTENCY_TTL_SECONDS'],
+                                         lock_seconds=app.config['IDEMPOTENCY_LOCK_SECONDS'])
+
+@jwt.user_identity_loader
+def user_identity_lookup(user_id):
+    # The JWT spec (and PyJWT >= 2.10) requires a string subject
+    return str(user_id)
+
+def _load_identity(user_id):
+    row = db.session.query(User.version, User.user_type).filter_by(id=user_id).first()
+    return (row.version, row.user_type) if row else None
+
+@jwt.token_verification_loader
+def verify_token_claims(jwt_header, jwt_data):
+    """Reject tokens issued before the user's version was bumped"""
+    try:
+        user_id = int(jwt_data['sub'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return identity_service.is_current(user_id, jwt_data, _load_identity)
+
+@jwt.token_verification_failed_loader
+def token_verification_failed(jwt_header, jwt_data):
+    return jsonify({'error': 'Token is no longer valid, please log in again'}), 401
+
+def _iter_revoked_jtis():
+    """Stream the JTIs of revoked tokens that have not expired yet"""
+    query = db.session.query(RevokedToken.jti).filter(RevokedToken.expires_at > datetime.utcnow())
+    for (jti,) in query.yield_per(1000):
+        yield jti
+
+def _is_jti_revoked(jti):
+    return db.session.query(RevokedToken.id).filter_by(jti=jti).first() is not None
+
+@jwt.token_in_blocklist_loader
+def check_token_revoked(jwt_header, jwt_data):
+    """Bloom filter first, the revoked_tokens table only on a filter hit"""
+    if revocation_service.needs_refresh():
+        revocation_service.rebuild(_iter_revoked_jtis())
+    return revocation_service.is_revoked(jwt_data['jti'], _is_jti_revoked)
+
+@jwt.revoked_token_loader
+def revoked_token(jwt_header, jwt_data):
+    return jsonify({'error': 'Token has been revoked, please log in again'}), 401
+
+def current_user_id() -> int:
+    """Id of the authenticated user"""
+    return int(get_jwt_identity())
+
+def current_user_type() -> str:
+    """Type of the authenticated user, read from the token claims"""
+    return get_jwt()['user_type']
+
+with app.app_context():
+    query_audit.init_app(app, db.engine)
+node_lease_service.init_app(app)
+payment_queue.init_app(app, payment_service.process_payment, payment_service.fail_payment,
+                       retryable=(GatewayUnavailable,))
+
+def start_workers():
+    """
+    Start the payment workers and the escrow scheduler in this process
+    Only run by python app.py and flask run-workers, never on import, so
+    other commands, tests and the reloader's watcher process stay idle
+    """
+    with app.app_context():
+        # Refuse to start without a node id of our own
+        node_lease_service.acquire()
+    payment_queue.start()
+    if app.config['ESCROW_AUTO_RELEASE_DAYS'] > 0:
+        escrow_scheduler.init_app(app, payment_service.release_payments)
+
+def _is_unique_violation(error: IntegrityError, *markers) -> bool:
+    """Whether an IntegrityError comes from the unique index/columns named by markers"""
+    message = str(error.orig).lower()
+    return ('unique' in message or 'duplicate' in message) and any(m in message for m in markers)
+
+def internal_only(view):
+    """Answer only clients in METRICS_ALLOWED_NETWORKS, everyone else gets 403"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            address = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            address = None
+        if address is None or not any(address in network for network in app.config['METRICS_ALLOWED_NETWORKS']):
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def idempotent(view):
+    """Run the view once per Idempotency-Key of the current user, replay it afterwards"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return idempotency_service.run(current_user_id(), lambda: view(*args, **kwargs))
+    return wrapper
+
+def _fieldset():
+    """Sparse fieldset and expansion requested through ?fields= and ?expand="""
+    return Fieldset.parse(request.args.get('fields'), request.args.get('expand'))
+
+@app.errorhandler(NodeIdUnavailable)
+def handle_node_id_unavailable(error):
+    """No transaction ID node id could be leased for this process"""
+    return jsonify({'error': 'Server is not ready, please retry shortly'}), 503
+
+@app.errorhandler(HashingUnavailable)
+def handle_hashing_unavailable(error):
+    """Shed load instead of queueing logins without bound"""
+    response = jsonify({'error': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # ============= AUTHENTICATION ROUTES =============
 @app.route('/', methods=['GET'])
@@ -44,14 +278,10 @@ def register():
     if data['user_type'] not in ['freelancer', 'employer']:
         return jsonify({'error': 'Invalid user type'}), 400
     
-    # Check if user exists
-    if User.query.filter_by(email=data['email']).first():
-        return jsonify({'error': 'Email already registered'}), 409
-    
-    # Create user
+    # Create user, the unique index on email rejects duplicates
     user = User(
         email=data['email'],
-        password_hash=generate_password_hash(data['password']),
+        password_hash=password_service.hash(data['password']),
         name=data['name'],
         user_type=data['user_type'],
         phone=data.get('phone'),
@@ -59,15 +289,26 @@ def register():
     )
     
     db.session.add(user)
+    try:
+        db.session.flush()
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_unique_violation(e, 'email'):
+            return jsonify({'error': 'Email already registered'}), 409
+        raise
+    
+    # Serialize from the flushed state, commit would expire it
+    user_data = user.to_dict()
+    claims = identity_service.claims_for(user)
     db.session.commit()
     
     # Create access token
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user_data['id'], additional_claims=claims)
     
     return jsonify({
         'message': 'User registered successfully',
         'access_token': access_token,
-        'user': user.to_dict()
+        'user': user_data
     }), 201
 
 @app.route('/api/login', methods=['POST'])
@@ -80,10 +321,10 @@ def login():
     
     user = User.query.filter_by(email=data['email']).first()
     
-    if not user or not check_password_hash(user.password_hash, data['password']):
+    if not user or not password_service.verify(user.password_hash, data['password']):
         return jsonify({'error': 'Invalid credentials'}), 401
     
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user.id, additional_claims=identity_service.claims_for(user))
     
     return jsonify({
         'access_token': access_token,
@@ -94,13 +335,49 @@ def login():
 @jwt_required()
 def get_profile():
     """Get current user profile"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     user = User.query.get(user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    return jsonify(user.to_dict()), 200
+    return jsonify(user.to_dict(_fieldset())), 200
+
+@app.route('/api/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """Revoke the access token used for this request"""
+    token = get_jwt()
+    
+    # Expired revocations are never checked again
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    db.session.add(RevokedToken(
+        jti=token['jti'],
+        user_id=current_user_id(),
+        expires_at=datetime.utcfromtimestamp(token['exp'])
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Revoked concurrently by another request with the same token
+        db.session.rollback()
+    revocation_service.add(token['jti'])
+    
+    return jsonify({'message': 'Logged out'}), 200
+
+@app.route('/api/logout-all', methods=['POST'])
+@jwt_required()
+def logout_all():
+    """Revoke every access token issued to the current user"""
+    user = User.query.get(current_user_id())
+    
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    identity_service.bump(user)
+    db.session.commit()
+    
+    return jsonify({'message': 'Logged out from all sessions'}), 200
 
 # ============= FREELANCER PROFILE ROUTES =============
 
@@ -108,15 +385,15 @@ def get_profile():
 @jwt_required()
 def create_update_freelancer_profile():
     """Create or update freelancer profile"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user_id = current_user_id()
     
-    if user.user_type != 'freelancer':
+    if current_user_type() != 'freelancer':
         return jsonify({'error': 'Only freelancers can create profiles'}), 403
     
     data = request.get_json()
     
     profile = FreelancerProfile.query.filter_by(user_id=user_id).first()
+    old_skills = profile.skills if profile else None
     
     if profile:
         # Update existing profile
@@ -143,7 +420,18 @@ def create_update_freelancer_profile():
         )
         db.session.add(profile)
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Updated by a concurrent request since it was read
+        db.session.rollback()
+        return jsonify({'error': 'Profile was changed concurrently'}), 409
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_unique_violation(e, 'user_id'):
+            return jsonify({'error': 'Profile was changed concurrently'}), 409
+        raise
+    skill_service.update(old_skills, profile.skills)
     
     return jsonify({
         'message': 'Profile saved successfully',
@@ -158,7 +446,18 @@ def get_freelancer_profile(user_id):
     if not profile:
         return jsonify({'error': 'Profile not found'}), 404
     
-    return jsonify(profile.to_dict()), 200
+    # The payload embeds the user, so its timestamp is part of the version
+    user_updated_at = profile.user.updated_at if profile.user else None
+    last_modified = max(filter(None, [profile.updated_at, user_updated_at]), default=None)
+    etag = make_etag('profile', request.query_string, profile.id, profile.version,
+                     profile.updated_at, user_updated_at)
+    
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    response = Response(fragment_cache.fragment(profile, _fieldset()), mimetype='application/json')
+    return cacheable(response, etag, last_modified), 200
 
 # ============= JOB ROUTES =============
 
@@ -166,10 +465,9 @@ def get_freelancer_profile(user_id):
 @jwt_required()
 def create_job():
     """Create a new job posting"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user_id = current_user_id()
     
-    if user.user_type != 'employer':
+    if current_user_type() != 'employer':
         return jsonify({'error': 'Only employers can post jobs'}), 403
     
     data = request.get_json()
@@ -179,12 +477,17 @@ def create_job():
     if not all(k in data for k in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
     
+    try:
+        budget = parse_amount(data['budget'])
+    except ValueError:
+        return jsonify({'error': 'budget must be a number'}), 400
+    
     job = Job(
         employer_id=user_id,
         title=data['title'],
         description=data['description'],
         required_skills=data['required_skills'],
-        budget=data['budget'],
+        budget=budget,
         duration=data.get('duration'),
         experience_level=data.get('experience_level', 'intermediate'),
         job_type=data.get('job_type', 'project'),
@@ -194,53 +497,110 @@ def create_job():
     
     db.session.add(job)
     db.session.commit()
+    skill_service.update(None, job.required_skills)
+    facet_service.invalidate()
     
     return jsonify({
         'message': 'Job created successfully',
         'job': job.to_dict()
     }), 201
 
-@app.route('/api/jobs', methods=['GET'])
-def get_jobs():
-    """Get all jobs with optional filtering"""
+def _filtered_jobs_query(exclude=()):
+    """
+    Build the job board query from the request's filter parameters
+    Filters named in exclude ('skills', 'job_type', 'experience_level',
+    'budget') are skipped, facet counts need that
+    """
     # Query parameters
     skills = request.args.get('skills')
     job_type = request.args.get('job_type')
     experience_level = request.args.get('experience_level')
-    min_budget = request.args.get('min_budget', type=float)
-    max_budget = request.args.get('max_budget', type=float)
+    min_budget = request.args.get('min_budget', type=parse_amount)
+    max_budget = request.args.get('max_budget', type=parse_amount)
     location = request.args.get('location')
     status = request.args.get('status', 'open')
     
     query = Job.query.filter_by(status=status)
     
     # Apply filters
-    if skills:
+    if skills and 'skills' not in exclude:
         skill_list = skills.split(',')
         for skill in skill_list:
             query = query.filter(Job.required_skills.contains([skill.strip()]))
     
-    if job_type:
+    if job_type and 'job_type' not in exclude:
         query = query.filter_by(job_type=job_type)
     
-    if experience_level:
+    if experience_level and 'experience_level' not in exclude:
         query = query.filter_by(experience_level=experience_level)
     
-    if min_budget:
+    if min_budget and 'budget' not in exclude:
         query = query.filter(Job.budget >= min_budget)
     
-    if max_budget:
+    if max_budget and 'budget' not in exclude:
         query = query.filter(Job.budget <= max_budget)
     
     if location:
         query = query.filter(Job.location.ilike(f'%{location}%'))
     
-    jobs = query.order_by(Job.created_at.desc()).all()
+    return query
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """Get all jobs with optional filtering"""
+    query = _filtered_jobs_query()
+    
+    # Cheap aggregate version of the filter set. The newest job timestamp is
+    # taken over all jobs so a job leaving the set (e.g. closed) still moves
+    # it; the count catches deletions, the newest application catches
+    # applications_count and the newest employer timestamp the embedded
+    # employers. Last-Modified is the newest of the same timestamps
+    count, employers_updated_at = query.join(User, User.id == Job.employer_id).with_entities(
+        db.func.count(Job.id), db.func.max(User.updated_at)
+    ).one()
+    jobs_updated_at = db.session.query(db.func.max(Job.updated_at)).scalar()
+    # By max(id), which the query audit sees as a primary key lookup, not a scan
+    last_application = db.session.query(Application.id, Application.created_at).filter(
+        Application.id == db.session.query(db.func.max(Application.id)).scalar_subquery()
+    ).first()
+    last_applied_at = last_application.created_at if last_application else None
+    last_modified = max(filter(None, [jobs_updated_at, last_applied_at, employers_updated_at]), default=None)
+    etag = make_etag('jobs', request.query_string, count, jobs_updated_at,
+                     last_application.id if last_application else None, employers_updated_at)
     
-    return jsonify({
-        'jobs': [job.to_dict() for job in jobs],
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    fieldset = _fieldset()
+    query = query.options(*fieldset.load_options(Job)).order_by(Job.created_at.desc())
+    
+    if wants_stream():
+        response = stream_json_list('jobs', query, lambda job: fragment_cache.fragment(job, fieldset))
+        return cacheable(response, etag, last_modified), 200
+    
+    jobs = query.all()
+    
+    response = join_fragments('jobs', [fragment_cache.fragment(job, fieldset) for job in jobs], {
         'count': len(jobs)
-    }), 200
+    })
+    return cacheable(response, etag, last_modified), 200
+
+@app.route('/api/jobs/facets', methods=['GET'])
+def get_job_facets():
+    """Get job counts per type, experience level, budget band and skill for the current filters"""
+    key = facet_service.cache_key(request.args)
+    
+    # Any job insert or update moves one of these, so stale entries are never served
+    version = db.session.query(db.func.max(Job.id), db.func.max(Job.updated_at)).one()
+    version = tuple(str(v) for v in version)
+    
+    facets = facet_service.get(key, version)
+    if facets is None:
+        facets = facet_service.compute(Job, _filtered_jobs_query)
+        facet_service.put(key, version, facets)
+    
+    return jsonify(facets), 200
 
 @app.route('/api/jobs/<int:job_id>', methods=['GET'])
 def get_job(job_id):
@@ -250,13 +610,28 @@ def get_job(job_id):
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    return jsonify(job.to_dict()), 200
+    # applications_count and the embedded employer are in the payload but do
+    # not touch the job row, so their timestamps are part of the version
+    applications_count, last_applied_at = db.session.query(
+        db.func.count(Application.id), db.func.max(Application.created_at)
+    ).filter(Application.job_id == job_id).one()
+    employer_updated_at = job.employer.updated_at if job.employer else None
+    last_modified = max(filter(None, [job.updated_at, last_applied_at, employer_updated_at]), default=None)
+    etag = make_etag('job', request.query_string, job.id, job.version, job.updated_at, applications_count,
+                     employer_updated_at)
+    
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    response = Response(fragment_cache.fragment(job, _fieldset()), mimetype='application/json')
+    return cacheable(response, etag, last_modified), 200
 
 @app.route('/api/jobs/<int:job_id>', methods=['PUT'])
 @jwt_required()
 def update_job(job_id):
     """Update a job posting"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     job = Job.query.get(job_id)
     
     if not job:
@@ -266,16 +641,29 @@ def update_job(job_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     data = request.get_json()
+    old_skills = job.required_skills
+    
+    try:
+        budget = parse_amount(data['budget']) if 'budget' in data else job.budget
+    except ValueError:
+        return jsonify({'error': 'budget must be a number'}), 400
     
     # Update fields
     job.title = data.get('title', job.title)
     job.description = data.get('description', job.description)
     job.required_skills = data.get('required_skills', job.required_skills)
-    job.budget = data.get('budget', job.budget)
+    job.budget = budget
     job.duration = data.get('duration', job.duration)
     job.status = data.get('status', job.status)
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Updated by a concurrent request since it was read
+        db.session.rollback()
+        return jsonify({'error': 'Job was changed concurrently'}), 409
+    skill_service.update(old_skills, job.required_skills)
+    facet_service.invalidate()
     
     return jsonify({
         'message': 'Job updated successfully',
@@ -288,7 +676,7 @@ def update_job(job_id):
 @jwt_required()
 def get_job_recommendations(job_id):
     """Get AI-recommended freelancers for a job"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     job = Job.query.get(job_id)
     
     if not job:
@@ -298,35 +686,42 @@ def get_job_recommendations(job_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     # Get all freelancer profiles
+    fieldset = _fieldset()
     freelancers = FreelancerProfile.query.all()
     
     # Get recommendations using AI matching
-    recommendations = matching_service.match_freelancers_to_job(job, freelancers)
+    recommendations = matching_service.match_freelancers_to_job(
+        job, freelancers, lambda freelancer: fragment_cache.fragment(freelancer, fieldset)
+    )
     
-    return jsonify({
-        'job': job.to_dict(),
-        'recommendations': recommendations
-    }), 200
+    items = [with_fragment('freelancer', rec.pop('freelancer'), rec) for rec in recommendations]
+    body = b''.join([
+        b'{"job": ', fragment_cache.fragment(job),
+        b', "recommendations": [', b','.join(items), b']}'
+    ])
+    return Response(body, mimetype='application/json'), 200
 
 @app.route('/api/freelancer/job-recommendations', methods=['GET'])
 @jwt_required()
 def get_freelancer_job_recommendations():
     """Get AI-recommended jobs for a freelancer"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     profile = FreelancerProfile.query.filter_by(user_id=user_id).first()
     
     if not profile:
         return jsonify({'error': 'Freelancer profile not found'}), 404
     
     # Get open jobs
-    jobs = Job.query.filter_by(status='open').all()
+    fieldset = _fieldset()
+    jobs = Job.query.filter_by(status='open').options(*fieldset.load_options(Job)).all()
     
     # Get recommendations using AI matching
-    recommendations = matching_service.match_jobs_to_freelancer(profile, jobs)
+    recommendations = matching_service.match_jobs_to_freelancer(
+        profile, jobs, lambda job: fragment_cache.fragment(job, fieldset)
+    )
     
-    return jsonify({
-        'recommendations': recommendations
-    }), 200
+    items = [with_fragment('job', rec.pop('job'), rec) for rec in recommendations]
+    return join_fragments('recommendations', items), 200
 
 # ============= APPLICATION ROUTES =============
 
@@ -334,10 +729,9 @@ def get_freelancer_job_recommendations():
 @jwt_required()
 def apply_to_job(job_id):
     """Apply to a job"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user_id = current_user_id()
     
-    if user.user_type != 'freelancer':
+    if current_user_type() != 'freelancer':
         return jsonify({'error': 'Only freelancers can apply to jobs'}), 403
     
     job = Job.query.get(job_id)
@@ -347,34 +741,55 @@ def apply_to_job(job_id):
     if job.status != 'open':
         return jsonify({'error': 'Job is not open for applications'}), 400
     
-    # Check if already applied
-    existing = Application.query.filter_by(job_id=job_id, freelancer_id=user_id).first()
-    if existing:
-        return jsonify({'error': 'Already applied to this job'}), 409
-    
     data = request.get_json()
     
+    # Score once now so employers can rank applicants with an indexed sort
+    match_score, match_breakdown = 0.0, None
+    profile = FreelancerProfile.query.filter_by(user_id=user_id).first()
+    if profile:
+        match_data = matching_service.calculate_overall_match_score(job, profile)
+        match_score, match_breakdown = match_data['match_percentage'], match_data['breakdown']
+    
     application = Application(
         job_id=job_id,
         freelancer_id=user_id,
         cover_letter=data.get('cover_letter'),
         proposed_rate=data.get('proposed_rate'),
-        estimated_duration=data.get('estimated_duration')
+        estimated_duration=data.get('estimated_duration'),
+        match_score=match_score,
+        match_breakdown=match_breakdown
     )
     
     db.session.add(application)
+    try:
+        db.session.flush()
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_unique_violation(e, 'uq_applications_job_freelancer', 'freelancer_id'):
+            return jsonify({'error': 'Already applied to this job'}), 409
+        raise
+    
+    # Serialize from the flushed state, commit would expire it
+    application_data = application.to_dict()
     db.session.commit()
     
     return jsonify({
         'message': 'Application submitted successfully',
-        'application': application.to_dict()
+        'application': application_data
     }), 201
 
+# Sort orders for job applications: (key columns, descending, nulls last)
+APPLICATION_SORTS = {
+    'match': ([Application.match_score, Application.id], True, False),
+    'recent': ([Application.created_at, Application.id], True, False),
+    'rate': ([Application.proposed_rate, Application.id], False, True)
+}
+
 @app.route('/api/jobs/<int:job_id>/applications', methods=['GET'])
 @jwt_required()
 def get_job_applications(job_id):
-    """Get all applications for a job"""
-    user_id = get_jwt_identity()
+    """Get applications for a job, sorted and optionally paginated"""
+    user_id = current_user_id()
     job = Job.query.get(job_id)
     
     if not job:
@@ -383,18 +798,42 @@ def get_job_applications(job_id):
     if job.employer_id != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    applications = Application.query.filter_by(job_id=job_id).all()
+    sort = request.args.get('sort', 'recent')
+    if sort not in APPLICATION_SORTS:
+        return jsonify({'error': 'Invalid sort, use match, recent or rate'}), 400
+    columns, descending, nulls_last = APPLICATION_SORTS[sort]
     
-    return jsonify({
-        'applications': [app.to_dict() for app in applications],
-        'count': len(applications)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= 200:
+        return jsonify({'error': 'limit must be between 1 and 200'}), 400
+    
+    fieldset = _fieldset()
+    query = Application.query.filter_by(job_id=job_id).options(*fieldset.load_options(Application))
+    
+    if wants_stream():
+        order = [c.desc() if descending else c.asc() for c in columns]
+        if nulls_last:
+            order[0] = order[0].nullslast()
+        query = query.order_by(*order)
+        return stream_json_list('applications', query, lambda app: fragment_cache.fragment(app, fieldset)), 200
+    
+    try:
+        applications, next_cursor = keyset_page(
+            query, columns, descending, request.args.get('cursor'), limit, nulls_last
+        )
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return join_fragments('applications', [fragment_cache.fragment(app, fieldset) for app in applications], {
+        'count': len(applications),
+        'next_cursor': next_cursor
     }), 200
 
 @app.route('/api/applications/<int:application_id>/status', methods=['PUT'])
 @jwt_required()
 def update_application_status(application_id):
     """Update application status (accept/reject)"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     application = Application.query.get(application_id)
     
     if not application:
@@ -415,20 +854,100 @@ def update_application_status(application_id):
     if new_status == 'accepted':
         job.status = 'in_progress'
     
-    db.session.commit()
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Job was changed concurrently'}), 409
     
     return jsonify({
         'message': 'Application status updated',
         'application': application.to_dict()
     }), 200
 
+@app.route('/api/applications/status', methods=['PUT'])
+@jwt_required()
+def bulk_update_application_status():
+    """Accept or reject many applications at once, optionally rejecting the rest of each job"""
+    user_id = current_user_id()
+    data = request.get_json()
+    
+    new_status = data.get('status')
+    reject_others = bool(data.get('reject_others', False))
+    application_ids = data.get('application_ids')
+    
+    if new_status not in ['accepted', 'rejected']:
+        return jsonify({'error': 'Invalid status'}), 400
+    
+    if not isinstance(application_ids, list) or not application_ids or len(application_ids) > 1000:
+        return jsonify({'error': 'application_ids must be a list of 1 to 1000 ids'}), 400
+    
+    try:
+        application_ids = sorted({int(i) for i in application_ids})
+    except (TypeError, ValueError):
+        return jsonify({'error': 'application_ids must be integers'}), 400
+    
+    if reject_others and new_status != 'accepted':
+        return jsonify({'error': 'reject_others only applies when accepting'}), 400
+    
+    # One query validates existence and ownership for every job involved
+    rows = db.session.query(Application.id, Application.job_id, Job.employer_id).join(
+        Job, Job.id == Application.job_id
+    ).filter(Application.id.in_(application_ids)).all()
+    
+    found = {row.id for row in rows}
+    missing = [i for i in application_ids if i not in found]
+    if missing:
+        return jsonify({'error': 'Application not found', 'application_ids': missing}), 404
+    
+    if any(row.employer_id != user_id for row in rows):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    job_ids = sorted({row.job_id for row in rows})
+    if reject_others and len(job_ids) != len(rows):
+        return jsonify({'error': 'reject_others accepts one application per job'}), 400
+    
+    now = datetime.utcnow()
+    updated = Application.query.filter(Application.id.in_(application_ids)).update(
+        {'status': new_status, 'updated_at': now}, synchronize_session=False
+    )
+    
+    auto_rejected = 0
+    if reject_others:
+        auto_rejected = Application.query.filter(
+            Application.job_id.in_(job_ids),
+            Application.id.notin_(application_ids),
+            Application.status != 'rejected'
+        ).update({'status': 'rejected', 'updated_at': now}, synchronize_session=False)
+    
+    if new_status == 'accepted':
+        # Bulk updates skip version_id_col, bump it by hand for the ETags
+        Job.query.filter(Job.id.in_(job_ids)).update({
+            'status': 'in_progress',
+            'updated_at': now,
+            'version': Job.version + 1
+        }, synchronize_session=False)
+    
+    db.session.commit()
+    if new_status == 'accepted':
+        facet_service.invalidate()
+    
+    return jsonify({
+        'message': 'Application statuses updated',
+        'status': new_status,
+        'updated': updated,
+        'auto_rejected': auto_rejected,
+        'job_ids': job_ids
+    }), 200
+
 # ============= PAYMENT ROUTES =============
 
 @app.route('/api/payments/create', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_payment():
     """Create a payment for a job"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     data = request.get_json()
     
     job_id = data.get('job_id')
@@ -449,33 +968,68 @@ def create_payment():
     if not application:
         return jsonify({'error': 'No accepted application found'}), 404
     
+    try:
+        amount = parse_amount(data['amount']) if 'amount' in data else job.budget
+    except ValueError:
+        return jsonify({'error': 'amount must be a number'}), 400
+    
+    # Rejected here, a method no gateway accepts would only fail in the worker
+    payment_method = data.get('payment_method', 'upi')
+    if not isinstance(payment_method, str) or not payment_service.supports_method(payment_method):
+        return jsonify({'error': 'Unsupported payment method, use upi, netbanking, card or wallet'}), 400
+    
     # Create payment
     payment = Payment(
         job_id=job_id,
         employer_id=user_id,
         freelancer_id=application.freelancer_id,
-        amount=data.get('amount', job.budget),
-        payment_method=data.get('payment_method', 'upi'),
+        amount=amount,
+        payment_method=payment_method,
         currency='INR'
     )
     
+    # Processed by the payment workers, the task commits with the payment
     db.session.add(payment)
+    task = payment_queue.enqueue(payment)
     db.session.commit()
+    payment_queue.notify()
+    
+    status_url = f'/api/payments/{payment.id}'
+    response = jsonify({
+        'message': 'Payment accepted for processing',
+        'payment': payment.to_dict(),
+        'processing': task.to_status(),
+        'status_url': status_url
+    })
+    response.headers['Location'] = status_url
+    return response, 202
+
+@app.route('/api/payments/<int:payment_id>', methods=['GET'])
+@jwt_required()
+def get_payment(payment_id):
+    """Get a payment and the state of its processing"""
+    user_id = current_user_id()
+    payment = Payment.query.get(payment_id)
+    
+    if not payment:
+        return jsonify({'error': 'Payment not found'}), 404
     
-    # Process payment (mock integration)
-    result = payment_service.process_payment(payment)
+    if user_id not in (payment.employer_id, payment.freelancer_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    task = PaymentTask.query.filter_by(payment_id=payment_id).first()
     
     return jsonify({
-        'message': 'Payment created',
-        'payment': payment.to_dict(),
-        'payment_result': result
-    }), 201
+        'payment': payment.to_dict(_fieldset()),
+        'processing': task.to_status() if task else None
+    }), 200
 
 @app.route('/api/payments/<int:payment_id>/release', methods=['POST'])
 @jwt_required()
+@idempotent
 def release_payment(payment_id):
     """Release payment to freelancer"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     payment = Payment.query.get(payment_id)
     
     if not payment:
@@ -487,48 +1041,273 @@ def release_payment(payment_id):
     if payment.status != 'held':
         return jsonify({'error': 'Payment cannot be released'}), 400
     
-    payment.status = 'completed'
-    payment.released_at = datetime.utcnow()
-    
-    db.session.commit()
+    try:
+        # Posts the release to the ledger in the same transaction
+        payment_service.release_payment_to_freelancer(payment)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Payment was changed concurrently'}), 409
+    except IntegrityError as e:
+        db.session.rollback()
+        # Released by another request, its ledger entry is already posted
+        if _is_unique_violation(e, 'uq_journal_entries_payment_event', 'journal_entries.payment_id'):
+            return jsonify({'error': 'Payment was changed concurrently'}), 409
+        raise
     
     return jsonify({
         'message': 'Payment released successfully',
         'payment': payment.to_dict()
     }), 200
 
-@app.route('/api/payments/history', methods=['GET'])
+@app.route('/api/payments/<int:payment_id>/dispute', methods=['POST'])
 @jwt_required()
-def get_payment_history():
-    """Get payment history for current user"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+def dispute_payment(payment_id):
+    """Dispute a held payment, it stays in escrow until released or refunded by hand"""
+    user_id = current_user_id()
+    payment = Payment.query.get(payment_id)
+    
+    if not payment:
+        return jsonify({'error': 'Payment not found'}), 404
+    
+    if payment.employer_id != user_id:
+        return jsonify({'error': 'Unauthorized'}), 403
     
-    if user.user_type == 'employer':
-        payments = Payment.query.filter_by(employer_id=user_id).all()
+    if payment.status != 'held':
+        return jsonify({'error': 'Only held payments can be disputed'}), 400
+    
+    if payment.disputed_at is None:
+        payment.disputed_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return jsonify({'error': 'Payment was changed concurrently'}), 409
+    
+    return jsonify({
+        'message': 'Payment disputed, it will not be released automatically',
+        'payment': payment.to_dict()
+    }), 200
+
+# Statuses each side of a payment may move out of, per bulk operation
+BULK_ESCROW_ACTIONS = {
+    'release': {'employer': ('held',)},
+    'refund': {'employer': ('held',), 'freelancer': ('held', 'completed')}
+}
+
+def _bulk_escrow(action: str):
+    """
+    Validate and apply a release or refund to many payments in one transaction
+    Payments that cannot take part get a per-item error, the rest are
+    applied. A payment changed concurrently makes the whole batch start over
+    with fresh state, so it is reported per item instead of applied twice
+    """
+    user_id = current_user_id()
+    data = request.get_json(silent=True) or {}
+    payment_ids = data.get('payment_ids')
+    
+    if not isinstance(payment_ids, list) or not payment_ids or len(payment_ids) > 500:
+        return jsonify({'error': 'payment_ids must be a list of 1 to 500 ids'}), 400
+    
+    try:
+        payment_ids = list(dict.fromkeys(int(i) for i in payment_ids))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'payment_ids must be integers'}), 400
+    
+    allowed = BULK_ESCROW_ACTIONS[action]
+    apply = payment_service.release_payments if action == 'release' else payment_service.refund_payments
+    
+    for _ in range(3):
+        # One query validates existence, ownership and state, rows are locked
+        # in id order where the database supports it
+        payments = {
+            payment.id: payment for payment in
+            Payment.query.filter(Payment.id.in_(payment_ids)).order_by(Payment.id).with_for_update()
+        }
+        
+        results, eligible = {}, []
+        for payment_id in payment_ids:
+            payment = payments.get(payment_id)
+            role = None
+            if payment is not None:
+                role = 'employer' if payment.employer_id == user_id else \
+                    'freelancer' if payment.freelancer_id == user_id else None
+            
+            if payment is None:
+                error = 'Payment not found'
+            elif role not in allowed:
+                error = 'Unauthorized'
+            elif payment.status not in allowed[role] or payment.payout_id is not None:
+                error = 'Payment cannot be released' if action == 'release' else 'Payment cannot be refunded'
+            else:
+                eligible.append(payment)
+                continue
+            results[payment_id] = {'payment_id': payment_id, 'success': False, 'message': error}
+            if role in allowed:
+                results[payment_id]['status'] = payment.status
+        
+        try:
+            for result in apply(eligible):
+                result['status'] = payments[result['payment_id']].status
+                results[result['payment_id']] = result
+            db.session.commit()
+            break
+        except (StaleDataError, IntegrityError):
+            db.session.rollback()
     else:
-        payments = Payment.query.filter_by(freelancer_id=user_id).all()
+        response = jsonify({'error': 'Payments are being changed concurrently, try again'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     
+    succeeded = sum(1 for result in results.values() if result['success'])
     return jsonify({
-        'payments': [p.to_dict() for p in payments],
-        'count': len(payments)
+        'results': [results[payment_id] for payment_id in payment_ids],
+        'succeeded': succeeded,
+        'failed': len(payment_ids) - succeeded
     }), 200
 
+@app.route('/api/payments/release', methods=['POST'])
+@jwt_required()
+@idempotent
+def bulk_release_payments():
+    """Release many held payments to their freelancers at once"""
+    return _bulk_escrow('release')
+
+@app.route('/api/payments/refund', methods=['POST'])
+@jwt_required()
+@idempotent
+def bulk_refund_payments():
+    """Refund many payments at once, employers can refund held payments and freelancers held or released ones"""
+    return _bulk_escrow('refund')
+
+PAYMENT_STATUSES = ('pending', 'held', 'completed', 'failed', 'refunded')
+
+def _parse_date_arg(name: str, end_of_day: bool = False):
+    """ISO date or datetime query parameter, a bare date as 'to' covers the whole day"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def _payment_history_summary(query) -> dict:
+    """
+    Count and amount per status and per month over the whole filtered
+    history, one GROUP BY over the covering (user, created_at, id, status,
+    amount) index. The month groups still go through a temp B-tree, but
+    only index entries are read, never table rows
+    """
+    year = db.extract('year', Payment.created_at)
+    month = db.extract('month', Payment.created_at)
+    rows = query.order_by(None).with_entities(
+        year, month, Payment.status, db.func.count(Payment.id), db.func.sum(Payment.amount)
+    ).group_by(year, month, Payment.status)
+    
+    by_status, by_month = {}, {}
+    for row_year, row_month, status, count, amount in rows:
+        paise = to_paise(amount or 0)
+        key = f'{int(row_year):04d}-{int(row_month):02d}'
+        for totals in (by_status.setdefault(status, [0, 0]), by_month.setdefault(key, [0, 0])):
+            totals[0] += count
+            totals[1] += paise
+    
+    return {
+        'by_status': {status: {'count': c, 'amount': to_rupees(p)} for status, (c, p) in by_status.items()},
+        'by_month': [
+            {'month': key, 'count': c, 'amount': to_rupees(p)}
+            for key, (c, p) in sorted(by_month.items(), reverse=True)
+        ]
+    }
+
+@app.route('/api/payments/history', methods=['GET'])
+@jwt_required()
+def get_payment_history():
+    """Get payment history for current user, newest first, one page at a time"""
+    user_id = current_user_id()
+    
+    if current_user_type() == 'employer':
+        query = Payment.query.filter_by(employer_id=user_id)
+    else:
+        query = Payment.query.filter_by(freelancer_id=user_id)
+    
+    statuses = [s.strip() for s in request.args.get('status', '').split(',') if s.strip()]
+    if any(s not in PAYMENT_STATUSES for s in statuses):
+        return jsonify({'error': f"Invalid status, use {', '.join(PAYMENT_STATUSES)}"}), 400
+    if statuses:
+        query = query.filter(Payment.status.in_(statuses))
+    
+    try:
+        created_from = _parse_date_arg('from')
+        created_to = _parse_date_arg('to', end_of_day=True)
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates'}), 400
+    if created_from:
+        query = query.filter(Payment.created_at >= created_from)
+    if created_to:
+        query = query.filter(Payment.created_at < created_to)
+    
+    limit = request.args.get('limit', 50, type=int)
+    if not 1 <= limit <= 200:
+        return jsonify({'error': 'limit must be between 1 and 200'}), 400
+    
+    fieldset = _fieldset()
+    page_query = query.options(*fieldset.load_options(Payment))
+    columns = [Payment.created_at, Payment.id]
+    
+    if wants_stream():
+        page_query = page_query.order_by(Payment.created_at.desc(), Payment.id.desc())
+        return stream_json_list('payments', page_query, lambda p: p.to_dict(fieldset)), 200
+    
+    cursor = request.args.get('cursor')
+    try:
+        payments, next_cursor = keyset_page(page_query, columns, True, cursor, limit)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    response = {
+        'payments': [p.to_dict(fieldset) for p in payments],
+        'count': len(payments),
+        'next_cursor': next_cursor
+    }
+    if not cursor:
+        # Once per listing, later pages only carry rows
+        response['summary'] = _payment_history_summary(query)
+    return jsonify(response), 200
+
+# ============= WEBHOOK ROUTES =============
+
+@app.route('/api/webhooks/<gateway>', methods=['POST'])
+def receive_webhook(gateway):
+    """Batch of payment events pushed by a gateway, signed with its webhook secret"""
+    if not webhook_service.accepts(gateway):
+        return jsonify({'error': 'Unknown gateway'}), 404
+    
+    body = request.get_data()
+    if not webhook_service.verify(gateway, body, request.headers.get(TIMESTAMP_HEADER),
+                                  request.headers.get(SIGNATURE_HEADER)):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    try:
+        events = webhook_service.parse(body)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(webhook_service.ingest(gateway, events)), 200
+
 # ============= DASHBOARD ROUTES =============
 
 @app.route('/api/dashboard/stats', methods=['GET'])
 @jwt_required()
 def get_dashboard_stats():
     """Get dashboard statistics"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user_id = current_user_id()
     
-    if user.user_type == 'employer':
+    if current_user_type() == 'employer':
         jobs_posted = Job.query.filter_by(employer_id=user_id).count()
         active_jobs = Job.query.filter_by(employer_id=user_id, status='open').count()
-        total_spent = db.session.query(db.func.sum(Payment.amount)).filter_by(
-            employer_id=user_id, status='completed'
-        ).scalar() or 0
+        total_spent = ledger_service.total_spent(user_id)
         
         return jsonify({
             'jobs_posted': jobs_posted,
@@ -538,9 +1317,7 @@ def get_dashboard_stats():
     else:
         applications = Application.query.filter_by(freelancer_id=user_id).count()
         accepted = Application.query.filter_by(freelancer_id=user_id, status='accepted').count()
-        total_earned = db.session.query(db.func.sum(Payment.amount)).filter_by(
-            freelancer_id=user_id, status='completed'
-        ).scalar() or 0
+        total_earned = ledger_service.total_earned(user_id)
         
         return jsonify({
             'applications_sent': applications,
@@ -548,6 +1325,34 @@ def get_dashboard_stats():
             'total_earned': total_earned
         }), 200
 
+# ============= SKILL ROUTES =============
+
+def _iter_skill_lists():
+    """Stream every skill list used by jobs and freelancer profiles"""
+    for (skills,) in db.session.query(Job.required_skills).yield_per(1000):
+        yield skills
+    for (skills,) in db.session.query(FreelancerProfile.skills).yield_per(1000):
+        yield skills
+
+@app.route('/api/skills/suggest', methods=['GET'])
+def suggest_skills():
+    """Autocomplete skills by prefix, most used first"""
+    prefix = request.args.get('prefix', '')
+    limit = request.args.get('limit', skill_service.max_suggestions, type=int)
+    
+    if skill_service.needs_refresh():
+        skill_service.rebuild(_iter_skill_lists())
+    
+    suggestions = skill_service.suggest(prefix, limit)
+    
+    response = jsonify({
+        'prefix': prefix,
+        'suggestions': suggestions
+    })
+    response.set_etag(skill_service.etag(suggestions))
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response.make_conditional(request)
+
 # ============= SEARCH ROUTES =============
 
 @app.route('/api/search/freelancers', methods=['GET'])
@@ -578,14 +1383,133 @@ def search_freelancers():
     if location:
         query = query.join(User).filter(User.location.ilike(f'%{location}%'))
     
+    fieldset = _fieldset()
+    query = query.options(*fieldset.load_options(FreelancerProfile))
+    
+    if wants_stream():
+        return stream_json_list('freelancers', query, lambda p: fragment_cache.fragment(p, fieldset)), 200
+    
     profiles = query.all()
     
-    return jsonify({
-        'freelancers': [p.to_dict() for p in profiles],
+    return join_fragments('freelancers', [fragment_cache.fragment(p, fieldset) for p in profiles], {
         'count': len(profiles)
     }), 200
 
+# ============= DEBUG ROUTES =============
+
+@app.route('/api/metrics', methods=['GET'])
+@internal_only
+def get_metrics():
+    """Runtime metrics of the worker pools"""
+    return jsonify({
+        'password_hashing': password_service.metrics(),
+        'token_revocation': revocation_service.metrics(),
+        'payment_queue': payment_queue.metrics(),
+        'escrow_release': escrow_scheduler.metrics(),
+        'webhooks': webhook_service.metrics(),
+        'txn_node_lease': node_lease_service.metrics(),
+        'payment_gateways': payment_service.router.metrics()
+    }), 200
+
+@app.route('/api/debug/query-audit', methods=['GET', 'DELETE'])
+@internal_only
+def get_query_audit():
+    """Per-route query plan report, only available when QUERY_AUDIT=1"""
+    if not query_audit.enabled:
+        return jsonify({'error': 'Query audit is disabled'}), 404
+    
+    if request.method == 'DELETE':
+        query_audit.reset()
+        return jsonify({'message': 'Query audit reset'}), 200
+    
+    return jsonify(query_audit.report()), 200
+
+# ============= COMMANDS =============
+
+def upgrade_database() -> dict:
+    """
+    Create missing tables, add missing columns and indexes, drop superseded
+    indexes, convert legacy amounts and backfill the ledger
+    Duplicates a new unique index would reject are deleted before it is created
+    """
+    db.create_all()
+    added = ensure_columns(db.engine, db.metadata)
+    convert_legacy_amounts(db.engine, [('jobs', 'budget'), ('payments', 'amount')])
+    duplicates = drop_duplicates(db.engine)
+    ensure_indexes(db.engine, db.metadata)
+    dropped = drop_superseded_indexes(db.engine)
+    ledger_service.backfill()
+    return {'added_columns': added, 'dropped_indexes': dropped, 'deleted_duplicates': duplicates}
+
+@app.cli.command('run-workers')
+def run_workers():
+    """Drain the payment queue and auto-release escrow until interrupted"""
+    start_workers()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        payment_queue.stop()
+        escrow_scheduler.stop()
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Bring an existing database up to the current models"""
+    print(json.dumps(upgrade_database(), indent=2))
+
+@app.cli.command('verify-ledger')
+def verify_ledger():
+    """Re-sum the journal and report unbalanced entries and balance drift"""
+    result = ledger_service.verify()
+    print(json.dumps(result, indent=2))
+    if not result['ok']:
+        raise SystemExit(1)
+
+@app.cli.command('run-payouts')
+@click.option('--new', 'new_run', is_flag=True, help='Start a new run instead of resuming an unfinished one')
+def run_payouts(new_run):
+    """Pay out every released payment not paid out yet and write the bank file"""
+    payout_run = payout_service.run(resume=not new_run)
+    print(json.dumps({
+        'run_id': payout_run.id,
+        'payouts': payout_run.payouts_count,
+        'payments': payout_run.payments_count,
+        'gross_amount': to_rupees(payout_run.gross_amount),
+        'fee_amount': to_rupees(payout_run.fee_amount),
+        'net_amount': to_rupees(payout_run.net_amount),
+        'bank_file': payout_run.bank_file
+    }, indent=2))
+
+@app.cli.command('reconcile')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--from', 'window_start', required=True, type=click.DateTime(),
+              help='Start of the settlement window, payments created from then on are expected')
+@click.option('--to', 'window_end', required=True, type=click.DateTime(),
+              help='End of the settlement window, exclusive')
+@click.option('--gateway', help='Only expect this gateway\'s payments in the file')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension')
+def reconcile(path, window_start, window_end, gateway, file_format):
+    """Compare a gateway settlement file with the payments of its window and record the mismatches"""
+    try:
+        reconciliation_run = reconciliation_service.run(path, window_start, window_end, gateway, file_format)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(json.dumps({
+        'run_id': reconciliation_run.id,
+        'rows_read': reconciliation_run.rows_read,
+        'matched': reconciliation_run.matched,
+        'mismatches': reconciliation_run.mismatches,
+        'mismatch_counts': reconciliation_run.mismatch_counts
+    }, indent=2))
+    if reconciliation_run.mismatches:
+        raise SystemExit(1)
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_database()
+    # With the reloader, this process only watches files, the server runs in its child
+    if is_running_from_reloader():
+        start_workers()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,148 @@
+"""
+Escrow auto-release
+Held payments that were not disputed are released to the freelancer once
+they have been in escrow for release_after_days. The scheduler keeps only
+the payments coming due within the next horizon in an in-process timer heap,
+loaded from the (status, completed_at) index, and reloads it from there
+periodically and after every restart. Due payments are revalidated and
+released in batches, one transaction per batch
+"""
+
+from typing import Callable, Dict
+from datetime import datetime, timedelta
+from sqlalchemy.orm.exc import StaleDataError
+import heapq
+import logging
+import threading
+import time
+
+from models import db, Payment
+
+logger = logging.getLogger(__name__)
+
+
+class EscrowScheduler:
+    """Timer heap of upcoming escrow releases, backed by the payments index"""
+
+    def __init__(self, release_after_days: float = 14, batch_size: int = 200, horizon_seconds: float = 3600,
+                 max_scheduled: int = 10000):
+        self.release_after = timedelta(days=release_after_days)
+        self.batch_size = batch_size
+        self.horizon_seconds = horizon_seconds  # How far ahead the heap looks, reloaded twice per horizon
+        self.max_scheduled = max_scheduled  # Heap size cap, the rest is loaded once the heap drains
+
+        self._app = None
+        self._release = None
+        self._heap = []  # (due_at, payment_id)
+        self._truncated = False
+        self._reload_at = 0.0  # time.monotonic() of the next reload
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = {'released': 0, 'batches': 0, 'conflicts': 0}
+
+    def init_app(self, app, release: Callable):
+        """
+        Start the scheduler thread
+        release(payments) transitions the payments and returns one result
+        dict per payment, the scheduler commits them
+        """
+        self._app = app
+        self._release = release
+        self._thread = threading.Thread(target=self._run, name='escrow-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            next_due = self._heap[0][0].isoformat() if self._heap else None
+            return dict(self._counts, release_after_days=self.release_after.total_seconds() / 86400,
+                        scheduled=len(self._heap), next_due_at=next_due)
+
+    def _run(self):
+        # First load shortly after start
+        timeout = 1.0
+        while not self._stopping.is_set():
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                with self._app.app_context():
+                    self._tick()
+            except Exception:
+                logger.exception('Escrow scheduler failed')
+                self._reload_at = time.monotonic() + self.horizon_seconds / 2
+            timeout = self._seconds_until_next()
+
+    def _tick(self):
+        if time.monotonic() >= self._reload_at or (self._truncated and not self._heap):
+            self._load()
+        while self._release_due():
+            pass
+
+    def _load(self):
+        """Rebuild the heap from the index, only payments due within the horizon"""
+        cutoff = datetime.utcnow() - self.release_after + timedelta(seconds=self.horizon_seconds)
+        rows = db.session.query(Payment.completed_at, Payment.id).filter(
+            Payment.status == 'held',
+            Payment.completed_at <= cutoff,
+            Payment.disputed_at.is_(None)
+        ).order_by(Payment.completed_at).limit(self.max_scheduled + 1).all()
+        db.session.rollback()
+
+        with self._lock:
+            # Ordered by completed_at, so the list already is a heap
+            self._heap = [(completed_at + self.release_after, payment_id) for completed_at, payment_id in rows]
+            self._truncated = len(self._heap) > self.max_scheduled
+            del self._heap[self.max_scheduled:]
+        self._reload_at = time.monotonic() + self.horizon_seconds / 2
+
+    def _release_due(self) -> bool:
+        """Release the next batch of due payments, False once none are due"""
+        now = datetime.utcnow()
+        with self._lock:
+            payment_ids = []
+            while self._heap and self._heap[0][0] <= now and len(payment_ids) < self.batch_size:
+                payment_ids.append(heapq.heappop(self._heap)[1])
+        if not payment_ids:
+            return False
+
+        # Revalidate, a payment may have been released, refunded or disputed since it was loaded
+        payments = Payment.query.filter(
+            Payment.id.in_(payment_ids),
+            Payment.status == 'held',
+            Payment.completed_at <= now - self.release_after,
+            Payment.disputed_at.is_(None)
+        ).order_by(Payment.id).with_for_update().all()
+        try:
+            results = self._release(payments)
+            db.session.commit()
+        except StaleDataError:
+            # Changed concurrently, whatever is still held is picked up by the next reload
+            db.session.rollback()
+            with self._lock:
+                self._counts['conflicts'] += 1
+            self._reload_at = 0.0
+            return False
+
+        with self._lock:
+            self._counts['batches'] += 1
+            self._counts['released'] += sum(1 for result in results if result['success'])
+        return True
+
+    def _seconds_until_next(self) -> float:
+        """Sleep until the earliest due payment or the next reload"""
+        until_reload = max(0.0, self._reload_at - time.monotonic())
+        with self._lock:
+            if not self._heap:
+                return 0.0 if self._truncated else until_reload
+            until_due = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+        return max(0.0, min(until_due, until_reload))
@@ -0,0 +1,127 @@
+"""
+Facet counting service for the jobs board
+Counts jobs per job type, experience level, skill and budget band for the
+current filter set, with a small cache keyed by the normalized filters
+"""
+
+from typing import Callable, Dict, List
+from collections import Counter, OrderedDict
+from sqlalchemy import and_, func, case
+import threading
+
+from skill_service import SkillService
+
+
+class FacetService:
+    """Service to compute and cache job board facet counts"""
+
+    # Budget bands in INR, lower bound inclusive, upper bound exclusive
+    BUDGET_BANDS = [
+        ('under_10k', 0, 10000),
+        ('10k_50k', 10000, 50000),
+        ('50k_1l', 50000, 100000),
+        ('1l_5l', 100000, 500000),
+        ('5l_plus', 500000, None)
+    ]
+
+    # Request parameters that change the facet counts
+    FILTER_PARAMS = ('skills', 'job_type', 'experience_level', 'min_budget',
+                     'max_budget', 'location', 'status')
+
+    def __init__(self, max_entries: int = 256, top_skills: int = 20):
+        self.max_entries = max_entries
+        self.top_skills = top_skills
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cache_key(self, args) -> tuple:
+        """Normalize filter parameters so equivalent requests share an entry"""
+        key = []
+        for name in self.FILTER_PARAMS:
+            value = (args.get(name) or '').strip()
+            if name == 'skills':
+                skills = {SkillService.normalize(s) for s in value.split(',')}
+                value = ','.join(sorted(s for s in skills if s))
+            elif name == 'location':
+                value = value.lower()
+            if value:
+                key.append((name, value))
+        return tuple(key)
+
+    def get(self, key: tuple, version: tuple):
+        """Cached facets for a filter set, None if missing or built from older data"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, version: tuple, facets: Dict):
+        with self._lock:
+            self._cache[key] = (version, facets)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every cached entry, called when jobs change"""
+        with self._lock:
+            self._cache.clear()
+
+    def compute(self, model, build_query: Callable) -> Dict:
+        """
+        Count facets with one query each
+        build_query(exclude) must return the filtered query without the
+        filters named in exclude, so each facet shows the alternatives to its
+        own current selection
+        """
+        total = build_query(()).with_entities(func.count(model.id)).scalar()
+
+        return {
+            'total': total,
+            'facets': {
+                'job_type': self._group_counts(build_query(('job_type',)), model.job_type, model),
+                'experience_level': self._group_counts(
+                    build_query(('experience_level',)), model.experience_level, model
+                ),
+                'budget': self._budget_counts(build_query(('budget',)), model),
+                'skills': self._skill_counts(build_query(('skills',)), model)
+            }
+        }
+
+    def _group_counts(self, query, column, model) -> List[Dict]:
+        rows = query.with_entities(column, func.count(model.id)).group_by(column).all()
+        rows.sort(key=lambda row: (-row[1], row[0] or ''))
+        return [{'value': value, 'count': count} for value, count in rows if value]
+
+    def _budget_counts(self, query, model) -> List[Dict]:
+        # One conditional count per band instead of a GROUP BY on a CASE,
+        # which would sort every row through a temp B-tree
+        bands = []
+        for name, lower, upper in self.BUDGET_BANDS:
+            bounds = [model.budget >= lower] if lower else []
+            bounds += [model.budget < upper] if upper else []
+            bands.append(func.count(case((and_(*bounds), 1))))
+        counts = query.with_entities(*bands).one()
+        return [
+            {'value': name, 'min': lower, 'max': upper, 'count': count}
+            for (name, lower, upper), count in zip(self.BUDGET_BANDS, counts)
+        ]
+
+    def _skill_counts(self, query, model) -> List[Dict]:
+        # Skills live in a JSON array, so they are counted while streaming
+        # just that column instead of with a dialect specific json_each join
+        counts = Counter()
+        labels = {}
+        for (skills,) in query.with_entities(model.required_skills).yield_per(1000):
+            job_skills = {SkillService.normalize(skill): skill for skill in skills or []}
+            for key, skill in job_skills.items():
+                if key:
+                    counts[key] += 1
+                    labels.setdefault(key, skill.strip())
+
+        return [
+            {'value': labels[key], 'count': count}
+            for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:self.top_skills]
+        ]
@@ -0,0 +1,228 @@
+"""
+Serialized JSON fragment cache
+Keeps the encoded to_dict output of each entity, keyed by the fieldset and
+everything the fragment is rendered from: the entity's id, updated_at and
+version, its derived columns and the same for every nested entity. Listings
+are assembled by joining ready-made bytes instead of re-serializing the same
+rows on every request, and a write made by another process changes the key
+Entries are evicted LRU within a byte budget and invalidated on writes
+through SQLAlchemy session events
+"""
+
+from typing import Dict, List
+from collections import OrderedDict
+from flask import Response, current_app
+from sqlalchemy import event, inspect, select, util
+from sqlalchemy.orm import Session
+import threading
+import time
+
+from models import db, Fieldset
+
+
+class FragmentCache:
+    """Cache of pre-encoded JSON bytes per entity and fieldset"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl_seconds: int = 60):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (fragment, dependencies, expires_at)
+        self._dependents = {}  # (model, id) -> set of keys rendered from it
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def init_session_events(self):
+        """Invalidate entries of every entity a session writes"""
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+        event.listen(Session, 'do_orm_execute', self._do_orm_execute)
+
+    def fragment(self, obj, fieldset=None) -> bytes:
+        """Encoded obj.to_dict(fieldset), rendered once per entity version"""
+        fieldset = fieldset or Fieldset()
+        key = (self._version(obj, fieldset), fieldset.key())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                self._drop(key)
+
+        data = current_app.json.dumps(obj.to_dict(fieldset)).encode('utf-8')
+        dependencies = self._dependencies(obj, fieldset)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (data, dependencies, now + self.ttl_seconds)
+                self._size += len(data)
+                for dependency in dependencies:
+                    self._dependents.setdefault(dependency, set()).add(key)
+                self._evict()
+        return data
+
+    def invalidate(self, model: str, entity_id):
+        """Drop every fragment rendered from the given entity"""
+        with self._lock:
+            for key in self._dependents.pop((model, entity_id), ()):
+                self._drop(key)
+
+    def invalidate_model(self, model: str):
+        """Drop every fragment rendered from any entity of the given model"""
+        with self._lock:
+            for dependency in [dependency for dependency in self._dependents if dependency[0] == model]:
+                for key in self._dependents.pop(dependency, ()):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+            self._size = 0
+
+    def _version(self, obj, fieldset) -> tuple:
+        """Everything the fragment is rendered from, the same inputs as the listing ETags"""
+        version = (
+            type(obj).__name__, obj.id,
+            getattr(obj, 'updated_at', None), getattr(obj, 'version', None),
+            tuple(getattr(obj, name) for name in obj._derived if fieldset.wants(name))
+        )
+        for name, child in fieldset.relations(type(obj)).items():
+            related = getattr(obj, name)
+            version += (name, self._version(related, child) if related is not None else None)
+        return version
+
+    def _dependencies(self, obj, fieldset) -> frozenset:
+        # Mirror the relation walk of to_dict: a fragment depends on every
+        # entity nested in it, so an employer rename evicts their jobs
+        dependencies = {(type(obj).__name__, obj.id)}
+        for name, child in fieldset.relations(type(obj)).items():
+            related = getattr(obj, name)
+            if related is not None:
+                dependencies |= self._dependencies(related, child)
+        return frozenset(dependencies)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= len(entry[0])
+        for dependency in entry[1]:
+            keys = self._dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[dependency]
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+
+    def _touched(self, obj) -> List[tuple]:
+        """The entity itself plus the parents its foreign keys point to"""
+        touched = [(type(obj).__name__, obj.id)]
+        # Parents embed derived data such as Job.applications_count
+        for relationship in inspect(obj).mapper.relationships:
+            if relationship.direction.name != 'MANYTOONE':
+                continue
+            for column in relationship.local_columns:
+                value = getattr(obj, column.key, None)
+                if value is not None:
+                    touched.append((relationship.mapper.class_.__name__, value))
+        return touched
+
+    def _after_flush(self, session, flush_context):
+        touched = session.info.setdefault('fragment_cache_touched', set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if hasattr(obj, 'to_dict'):
+                touched.update(self._touched(obj))
+        for model, entity_id in touched:
+            self.invalidate(model, entity_id)
+
+    def _after_commit(self, session):
+        # Again after commit: a concurrent reader may have cached the old
+        # committed state between our flush and our commit
+        for model, entity_id in session.info.pop('fragment_cache_touched', ()):
+            self.invalidate(model, entity_id)
+
+    def _after_rollback(self, session):
+        session.info.pop('fragment_cache_touched', None)
+
+    def _do_orm_execute(self, orm_execute_state):
+        if orm_execute_state.is_relationship_load:
+            # With any do_orm_execute hook registered, SQLAlchemy passes the
+            # parent query's yield_per on to its selectin loads, which then
+            # fail on unique(), drop it as the unhooked path does
+            orm_execute_state.local_execution_options = util.immutabledict({
+                name: value for name, value in orm_execute_state.local_execution_options.items()
+                if name != 'yield_per'
+            })
+            return
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        # Set-based UPDATE/DELETE statements bypass the unit of work, so look
+        # up the rows they are about to touch and evict those. Parents need
+        # nothing, their derived columns are part of their fragment keys
+        statement = orm_execute_state.statement
+        mapper = self._table_mapper(getattr(statement, 'table', None))
+        if mapper is None:
+            self.clear()
+            return
+        model = mapper.class_.__name__
+        if not hasattr(mapper.class_, 'to_dict') or not self._has_fragments(model):
+            return
+
+        primary_key = mapper.primary_key[0]
+        if isinstance(orm_execute_state.parameters, list):
+            # Bulk UPDATE by primary key, one parameter set per row
+            ids = [parameters.get(primary_key.key) for parameters in orm_execute_state.parameters]
+        elif statement.whereclause is None:
+            self.invalidate_model(model)
+            return
+        else:
+            ids = orm_execute_state.session.execute(
+                select(primary_key).where(statement.whereclause), orm_execute_state.parameters or {}
+            ).scalars().all()
+        touched = orm_execute_state.session.info.setdefault('fragment_cache_touched', set())
+        for entity_id in ids:
+            touched.add((model, entity_id))
+            self.invalidate(model, entity_id)
+
+    def _has_fragments(self, model: str) -> bool:
+        """Whether any cached fragment was rendered from an entity of model"""
+        with self._lock:
+            return any(dependency[0] == model for dependency in self._dependents)
+
+    def _table_mapper(self, table):
+        """Mapper of the model on table, None when the table is not mapped"""
+        if table is None or not hasattr(table, 'fullname'):
+            return None
+        # Matched by name, ORM statements carry annotated copies of the table
+        for mapper in db.Model.registry.mappers:
+            if mapper.local_table.fullname == table.fullname:
+                return mapper
+        return None
+
+
+def join_fragments(key: str, fragments: List[bytes], extra: Dict = None) -> Response:
+    """Build {"<key>": [fragments...], **extra} without decoding the fragments"""
+    tail = current_app.json.dumps(extra)[1:] if extra else '}'
+    body = b''.join([
+        b'{', current_app.json.dumps(key).encode('utf-8'), b': [',
+        b','.join(fragments),
+        b']', b', ' if extra else b'', tail.encode('utf-8')
+    ])
+    return Response(body, mimetype='application/json')
+
+
+def with_fragment(name: str, fragment: bytes, rest: Dict) -> bytes:
+    """Encode rest as a JSON object with fragment spliced in under name"""
+    body = current_app.json.dumps(rest)
+    if body == '{}':
+        return b''.join([b'{', current_app.json.dumps(name).encode('utf-8'), b': ', fragment, b'}'])
+    return b''.join([
+        b'{', current_app.json.dumps(name).encode('utf-8'), b': ', fragment, b', ',
+        body[1:].encode('utf-8')
+    ])
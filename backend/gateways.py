@@ -0,0 +1,305 @@
+"""
+Payment gateway clients and routing
+GatewaySimulator stands in for a real gateway locally, with configurable
+latency, transient errors, timeouts and declines. HttpGateway talks to a
+gateway over a small pool of keep-alive connections. GatewayRouter keeps a
+rolling window of outcomes per gateway and sends each payment to the
+cheapest healthy gateway that supports its method, with a circuit breaker
+per gateway so one that keeps failing is skipped until it recovers
+"""
+
+from typing import Dict, Iterable, List
+from collections import deque
+from urllib.parse import urlsplit
+import http.client
+import json
+import math
+import queue
+import random
+import threading
+import time
+import uuid
+
+
+class GatewayUnavailable(Exception):
+    """Transient gateway error (timeout, 5xx), the payment can be retried"""
+
+
+class UnsupportedPaymentMethod(ValueError):
+    """No gateway accepts the payment method, retrying cannot help"""
+
+
+class GatewaySimulator:
+    """Local gateway with configurable latency and failure modes"""
+
+    def __init__(self, name: str, latency_ms: float = 0, latency_sigma: float = 0.5,
+                 error_rate: float = 0.0, timeout_rate: float = 0.0, decline_rate: float = 0.05,
+                 timeout_seconds: float = 10.0):
+        self.name = name
+        self.latency_ms = latency_ms  # Median, latencies are log-normal
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate  # Immediate 5xx
+        self.timeout_rate = timeout_rate  # No answer within timeout_seconds
+        self.decline_rate = decline_rate  # Final declines
+        self.timeout_seconds = timeout_seconds
+
+    def charge(self, payment) -> bool:
+        """Whether the gateway approved the payment, raises GatewayUnavailable on transient errors"""
+        roll = random.random()
+        if roll < self.timeout_rate:
+            time.sleep(self.timeout_seconds)
+            raise GatewayUnavailable(f'{self.name} timed out')
+        if roll < self.timeout_rate + self.error_rate:
+            raise GatewayUnavailable(f'{self.name} returned a server error')
+
+        if self.latency_ms:
+            latency = random.lognormvariate(math.log(self.latency_ms), self.latency_sigma) / 1000
+            if latency >= self.timeout_seconds:
+                time.sleep(self.timeout_seconds)
+                raise GatewayUnavailable(f'{self.name} timed out')
+            time.sleep(latency)
+        return random.random() >= self.decline_rate
+
+    def webhook_event(self, payment, event_type: str = None) -> Dict:
+        """
+        Event this gateway would post about the payment, for exercising the
+        webhook endpoint locally. Captured or failed at the decline rate unless
+        event_type is given
+        """
+        if event_type is None:
+            event_type = 'payment.failed' if random.random() < self.decline_rate else 'payment.captured'
+        return {
+            'id': f'evt_{uuid.uuid4().hex}',
+            'type': event_type,
+            'transaction_id': payment.transaction_id,
+            'amount': payment.amount,
+            'currency': payment.currency
+        }
+
+
+class HttpGateway:
+    """
+    Gateway reached over HTTP, with pooled keep-alive connections
+    POST <url>/charges with the payment as JSON, answered with
+    {"status": "approved"} or {"status": "declined"}
+    """
+
+    def __init__(self, name: str, url: str, api_key: str = None, pool_size: int = 4,
+                 timeout_seconds: float = 10.0):
+        self.name = name
+        parts = urlsplit(url)
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._host = parts.netloc
+        self._path = parts.path.rstrip('/') + '/charges'
+        self._api_key = api_key
+        self.timeout_seconds = timeout_seconds
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def charge(self, payment) -> bool:
+        body = json.dumps({
+            'transaction_id': payment.transaction_id,
+            'amount': payment.amount,
+            'currency': payment.currency,
+            'payment_method': payment.payment_method
+        })
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        if self._api_key:
+            headers['Authorization'] = f'Bearer {self._api_key}'
+
+        connection = self._acquire()
+        try:
+            connection.request('POST', self._path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except BaseException as e:
+            # The connection may hold a half-sent request or half-read response, never pool it
+            connection.close()
+            if isinstance(e, (OSError, http.client.HTTPException)):
+                raise GatewayUnavailable(f'{self.name}: {e}')
+            raise
+        self._release(connection)
+
+        if response.status >= 500 or response.status == 429:
+            raise GatewayUnavailable(f'{self.name} returned {response.status}')
+        if response.status >= 400:
+            return False
+        try:
+            return json.loads(data).get('status') == 'approved'
+        except ValueError:
+            raise GatewayUnavailable(f'{self.name} returned an invalid response')
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connection_class(self._host, timeout=self.timeout_seconds)
+
+    def _release(self, connection):
+        if connection is None:
+            return
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures, lets one probe through after a cooldown"""
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'  # 'closed', 'open', 'half_open'
+        self.failures = 0
+        self.opened_at = None
+
+    def available(self, now: float) -> bool:
+        """Whether a call could be let through, without claiming it"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            return now - self.opened_at >= self.cooldown_seconds
+        return False  # half_open, the probe is in flight
+
+    def acquire(self, now: float) -> bool:
+        """Claim a call, an open breaker past its cooldown lets one probe through"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and now - self.opened_at >= self.cooldown_seconds:
+            self.state = 'half_open'
+            return True
+        return False
+
+    def release(self):
+        """Give back a claim that never made a call, the next call probes instead"""
+        if self.state == 'half_open':
+            self.state = 'open'
+
+    def record(self, success: bool, now: float):
+        if success:
+            self.state = 'closed'
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = now
+
+
+class GatewayRouter:
+    """Pick the cheapest healthy gateway per payment and track how gateways perform"""
+
+    def __init__(self, gateways: Dict, fees: Dict[str, float], methods: Dict[str, Iterable[str]],
+                 window: int = 200, min_samples: int = 20, min_success_rate: float = 0.9,
+                 max_p95_ms: float = 3000, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.gateways = gateways  # name -> client with charge(payment)
+        self.fees = fees  # name -> fee percentage
+        self.methods = {name: set(supported) for name, supported in methods.items()}
+        self.min_samples = min_samples  # Below this a gateway counts as healthy
+        self.min_success_rate = min_success_rate
+        self.max_p95_ms = max_p95_ms
+
+        self._outcomes = {name: deque(maxlen=window) for name in gateways}  # (ok, latency_ms)
+        self._breakers = {name: CircuitBreaker(failure_threshold, cooldown_seconds) for name in gateways}
+        self._lock = threading.Lock()
+
+    def supports(self, payment_method: str) -> bool:
+        """Whether any gateway accepts the method, whatever its health"""
+        method = (payment_method or '').lower()
+        return any(method in self.methods.get(name, ()) for name in self.gateways)
+
+    def select(self, payment_method: str) -> str:
+        """
+        Choose a gateway for the method and claim a call on its breaker
+        Raises UnsupportedPaymentMethod when no gateway accepts the method and
+        GatewayUnavailable when every supporting gateway is open. A claim
+        that is not followed by charge() must be given back with release()
+        """
+        if not self.supports(payment_method):
+            raise UnsupportedPaymentMethod(f'No gateway accepts {payment_method!r}')
+        method = payment_method.lower()
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                name for name in self.gateways
+                if method in self.methods.get(name, ()) and self._breakers[name].available(now)
+            ]
+            for name in sorted(candidates, key=self._rank):
+                if self._breakers[name].acquire(now):
+                    return name
+        raise GatewayUnavailable(f'No gateway available for {method}')
+
+    def charge(self, gateway: str, payment) -> bool:
+        """Call the gateway and record the outcome, declines count as healthy answers"""
+        started = time.perf_counter()
+        try:
+            approved = self.gateways[gateway].charge(payment)
+        except Exception:
+            self._record(gateway, False, started)
+            raise
+        self._record(gateway, True, started)
+        return approved
+
+    def release(self, gateway: str):
+        """Give back the breaker claim of select() when charge() was never called"""
+        with self._lock:
+            self._breakers[gateway].release()
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            report = {}
+            for name in self.gateways:
+                stats = self._stats(name)
+                report[name] = {
+                    'fee_percentage': self.fees.get(name),
+                    'circuit': self._breakers[name].state,
+                    'samples': stats['samples'],
+                    'success_rate': round(stats['success_rate'], 4) if stats['samples'] else None,
+                    'latency_ms_p50': stats['p50'],
+                    'latency_ms_p95': stats['p95']
+                }
+            return report
+
+    def _rank(self, name: str):
+        stats = self._stats(name)
+        return (not self._healthy(stats), self.fees.get(name, math.inf), -stats['success_rate'])
+
+    def _healthy(self, stats: Dict) -> bool:
+        if stats['samples'] < self.min_samples:
+            return True
+        return stats['success_rate'] >= self.min_success_rate and stats['p95'] <= self.max_p95_ms
+
+    def _stats(self, name: str) -> Dict:
+        outcomes = self._outcomes[name]
+        if not outcomes:
+            return {'samples': 0, 'success_rate': 1.0, 'p50': None, 'p95': None}
+        latencies = sorted(latency for _, latency in outcomes)
+        return {
+            'samples': len(outcomes),
+            'success_rate': sum(1 for ok, _ in outcomes if ok) / len(outcomes),
+            'p50': round(latencies[len(latencies) // 2], 1),
+            'p95': round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1)
+        }
+
+    def _record(self, gateway: str, ok: bool, started: float):
+        latency_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._outcomes[gateway].append((ok, latency_ms))
+            self._breakers[gateway].record(ok, time.monotonic())
+
+
+def build_gateways(names: List[str], simulator_defaults: Dict, simulator_overrides: Dict = None,
+                   urls: Dict[str, str] = None, api_keys: Dict[str, str] = None, pool_size: int = 4,
+                   timeout_seconds: float = 10.0) -> Dict:
+    """HttpGateway for every gateway with a URL, a GatewaySimulator for the rest"""
+    gateways = {}
+    for name in names:
+        url = (urls or {}).get(name)
+        if url:
+            gateways[name] = HttpGateway(name, url, api_key=(api_keys or {}).get(name),
+                                         pool_size=pool_size, timeout_seconds=timeout_seconds)
+        else:
+            options = dict(simulator_defaults, timeout_seconds=timeout_seconds)
+            options.update((simulator_overrides or {}).get(name, {}))
+            gateways[name] = GatewaySimulator(name, **options)
+    return gateways
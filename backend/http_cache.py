@@ -0,0 +1,53 @@
+"""
+HTTP conditional request helpers
+Lets read endpoints answer If-None-Match / If-Modified-Since with 304
+from a cheap version lookup, before any serialization happens
+"""
+
+from datetime import datetime, timezone
+from flask import request, make_response
+import hashlib
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from the values that determine a representation"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, datetime):
+            part = part.isoformat()
+        digest.update(f"{part}\x00".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def not_modified(etag: str, last_modified: datetime = None):
+    """
+    Return a 304 response if the client's cached copy is still current, else None
+    If-None-Match wins over If-Modified-Since when both are sent (RFC 9110)
+    """
+    if request.if_none_match:
+        if not request.if_none_match.contains(etag):
+            return None
+    elif request.if_modified_since and last_modified:
+        if _http_time(last_modified) > request.if_modified_since:
+            return None
+    else:
+        return None
+
+    response = make_response('', 304)
+    return cacheable(response, etag, last_modified)
+
+
+def cacheable(response, etag: str, last_modified: datetime = None):
+    """Attach validators so clients revalidate instead of refetching"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _http_time(last_modified)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+def _http_time(value: datetime) -> datetime:
+    # Stored timestamps are naive UTC, HTTP dates have second resolution
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
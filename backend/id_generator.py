@@ -0,0 +1,90 @@
+"""
+Time-ordered transaction IDs
+Snowflake layout in 63 bits: 41 bits of milliseconds since EPOCH_MS,
+10 bits of node id and 12 bits of per-millisecond sequence. IDs from one
+node are strictly increasing, IDs from different nodes never collide as
+long as every process has its own node id, see node_lease_service. The
+string form is a prefix plus 13 Crockford base32 characters, fixed width,
+so it sorts the same way as the integer and new rows land at the right edge
+of the index
+"""
+
+from typing import Callable, Union
+import threading
+import time
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_CLOCK_SKEW_MS = 1000  # Wait out a clock that stepped back by less than this
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+WIDTH = 13  # base32 digits of a 63-bit id
+
+
+class ClockMovedBackwards(RuntimeError):
+    """The system clock went back further than MAX_CLOCK_SKEW_MS"""
+
+
+class TransactionIdGenerator:
+    """Monotonic, sortable, collision-free ids for one node"""
+
+    def __init__(self, node_id: Union[int, Callable[[], int]] = 0, prefix: str = 'TXN'):
+        """
+        node_id is a fixed id for a single process, or a callable asked
+        before every id, e.g. NodeLeaseService.node_id
+        """
+        if not callable(node_id) and not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f'node_id must be between 0 and {MAX_NODE_ID}')
+        self._node_id = node_id if callable(node_id) else (lambda: node_id)
+        self.prefix = prefix
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def node_id(self) -> int:
+        return self._node_id()
+
+    def next_int(self) -> int:
+        node_id = self._node_id()
+        with self._lock:
+            now = self._now_ms()
+            if now < self._last_ms:
+                if self._last_ms - now > MAX_CLOCK_SKEW_MS:
+                    raise ClockMovedBackwards(f'Clock moved back {self._last_ms - now} ms')
+                now = self._wait_until(self._last_ms)
+
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 4096 ids this millisecond, borrow the next one
+                    now = self._wait_until(self._last_ms + 1)
+            else:
+                self._sequence = 0
+
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (NODE_BITS + SEQUENCE_BITS)) | (node_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self, prefix: str = None) -> str:
+        return self.encode(self.next_int(), prefix)
+
+    def encode(self, value: int, prefix: str = None) -> str:
+        digits = []
+        for _ in range(WIDTH):
+            value, remainder = divmod(value, 32)
+            digits.append(ALPHABET[remainder])
+        return (self.prefix if prefix is None else prefix) + ''.join(reversed(digits))
+
+    @staticmethod
+    def _now_ms() -> int:
+        return time.time_ns() // 1_000_000
+
+    def _wait_until(self, target_ms: int) -> int:
+        now = self._now_ms()
+        while now < target_ms:
+            time.sleep((target_ms - now) / 1000)
+            now = self._now_ms()
+        return now
@@ -0,0 +1,168 @@
+"""
+Idempotency keys for unsafe requests
+A request sent with an Idempotency-Key header runs once per user and key.
+The response is stored with a fingerprint of the request, and a retry with
+the same key replays it with a single read, no writes and no gateway work.
+Concurrent duplicates are serialized on the key: in-process by a per-key
+lock, across processes by the unique (user_id, key) row claimed up front.
+The claim is held for lock_seconds, so a key whose process died mid-request
+can be taken over by a retry after that instead of answering 409 until it
+expires
+"""
+
+from typing import Callable
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import Response, request, jsonify, make_response
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import threading
+
+from models import db, IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+class IdempotencyService:
+    """Service to run a view at most once per idempotency key"""
+
+    def __init__(self, ttl_seconds: int = 24 * 3600, lock_seconds: int = 60):
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds  # Must exceed the slowest request
+        self._locks = {}  # (user_id, key) -> [lock, waiters]
+        self._locks_guard = threading.Lock()
+
+    def run(self, user_id: int, view: Callable) -> Response:
+        """Call view() unless this user already sent the request's key"""
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return make_response(view())
+        if len(key) > 255:
+            return make_response(jsonify({'error': f'{IDEMPOTENCY_HEADER} is too long'}), 400)
+
+        fingerprint = self._fingerprint()
+        with self._key_lock((user_id, key)):
+            record_id, replay = self._begin(user_id, key, fingerprint)
+            if replay is not None:
+                return replay
+
+            try:
+                response = make_response(view())
+            except Exception:
+                self._release(record_id)
+                raise
+
+            if response.status_code >= 500 or response.is_streamed:
+                # Let the client retry with the same key
+                self._release(record_id)
+            else:
+                self._complete(record_id, response)
+            return response
+
+    def _begin(self, user_id: int, key: str, fingerprint: str):
+        """Claim the key, returns (record_id, None) or (None, response to send instead)"""
+        now = datetime.utcnow()
+        record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if record is not None and record.expires_at > now:
+            if record.fingerprint == fingerprint and self._take_over(record, now):
+                return record.id, None
+            return None, self._existing(record, fingerprint)
+
+        # Expired keys can be reused, purge them all while we are here
+        IdempotencyKey.query.filter(IdempotencyKey.expires_at <= now).delete(synchronize_session=False)
+        record = IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            fingerprint=fingerprint,
+            state='in_progress',
+            locked_until=now + timedelta(seconds=self.lock_seconds),
+            expires_at=now + timedelta(seconds=self.ttl_seconds)
+        )
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Claimed by another process between our read and our insert
+            db.session.rollback()
+            record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+            if record is None:
+                return None, self._in_progress()
+            return None, self._existing(record, fingerprint)
+        return record.id, None
+
+    def _take_over(self, record, now: datetime) -> bool:
+        """Claim an in_progress key whose claim ran out, its request died without finishing"""
+        if record.state != 'in_progress':
+            return False
+        # Rows claimed before locked_until existed are held from created_at
+        locked_until = record.locked_until or record.created_at + timedelta(seconds=self.lock_seconds)
+        if locked_until > now:
+            return False
+        # Only if no other retry took it over since it was read
+        if record.locked_until is None:
+            held = IdempotencyKey.locked_until.is_(None)
+        else:
+            held = IdempotencyKey.locked_until == record.locked_until
+        claimed = IdempotencyKey.query.filter(
+            IdempotencyKey.id == record.id, IdempotencyKey.state == 'in_progress', held
+        ).update({IdempotencyKey.locked_until: now + timedelta(seconds=self.lock_seconds)},
+                 synchronize_session=False)
+        db.session.commit()
+        return bool(claimed)
+
+    def _existing(self, record, fingerprint: str) -> Response:
+        if record.fingerprint != fingerprint:
+            return make_response(jsonify({
+                'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'
+            }), 422)
+        if record.state != 'done':
+            return self._in_progress()
+
+        response = Response(record.response_body, status=record.status_code)
+        for name, value in (record.response_headers or {}).items():
+            response.headers[name] = value
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def _in_progress(self) -> Response:
+        response = make_response(jsonify({'error': 'A request with this idempotency key is in progress'}), 409)
+        response.headers['Retry-After'] = '1'
+        return response
+
+    def _complete(self, record_id: int, response: Response):
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(id=record_id).update({
+            IdempotencyKey.state: 'done',
+            IdempotencyKey.status_code: response.status_code,
+            IdempotencyKey.response_body: response.get_data(),
+            IdempotencyKey.response_headers: {
+                name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers
+            }
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def _release(self, record_id: int):
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(id=record_id).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(f'{request.method} {request.path}\x00'.encode('utf-8'))
+        digest.update(request.get_data())
+        return digest.hexdigest()
+
+    @contextmanager
+    def _key_lock(self, scope):
+        with self._locks_guard:
+            entry = self._locks.setdefault(scope, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[scope]
@@ -0,0 +1,77 @@
+"""
+Identity service for authenticated requests
+Access tokens carry the user's type and a user-version claim, and a small
+TTL cache of the current version per user lets every request validate its
+token without a database round trip. Bumping a user's version invalidates
+all of their tokens and their cache entry
+"""
+
+from typing import Callable, Dict, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+import threading
+import time
+
+
+class IdentityService:
+    """Service to build token claims and validate them against cached user versions"""
+
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache = {}  # user_id -> (version, user_type, expires_at)
+        self._lock = threading.Lock()
+
+    def claims_for(self, user) -> Dict:
+        """Extra claims embedded in the access token"""
+        return {'user_type': user.user_type, 'uv': user.version}
+
+    def is_current(self, user_id: int, claims: Dict, loader: Callable) -> bool:
+        """
+        Whether a token's claims match the user's current version and type
+        loader(user_id) returns (version, user_type) or None for unknown users
+        and is only called on a cache miss
+        """
+        identity = self._get(user_id, loader)
+        if identity is None:
+            return False
+        version, user_type = identity
+        return claims.get('uv') == version and claims.get('user_type') == user_type
+
+    def bump(self, user):
+        """
+        Invalidate every token issued to the user so far, once the caller
+        commits. Dropping the cache entry earlier would let a request in
+        between cache the old version again until the TTL runs out
+        """
+        user.version = (user.version or 1) + 1
+        session = object_session(user)
+        if session is None:
+            self.invalidate(user.id)
+            return
+        user_id = user.id
+        event.listen(session, 'after_commit', lambda session: self.invalidate(user_id), once=True)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def _get(self, user_id: int, loader: Callable) -> Optional[tuple]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and entry[2] > now:
+                return entry[0], entry[1]
+
+        identity = loader(user_id)
+        if identity is None:
+            return None
+
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                # Expired entries first, then the oldest if still full
+                self._cache = {k: v for k, v in self._cache.items() if v[2] > now}
+                if len(self._cache) >= self.max_entries:
+                    self._cache.pop(next(iter(self._cache)))
+            self._cache[user_id] = (identity[0], identity[1], now + self.ttl_seconds)
+        return identity
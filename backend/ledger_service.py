@@ -0,0 +1,226 @@
+"""
+Double-entry ledger for payments
+Every payment state transition is posted as a balanced journal entry in
+integer paise, in the same transaction as the transition, and each account
+keeps a running balance updated with the entry. Dashboard totals are then a
+single row read instead of a SUM over the user's payments, and verify()
+re-sums the journal to detect drift between entries and balances
+"""
+
+from typing import Dict, List, Tuple
+from contextlib import contextmanager
+from sqlalchemy import bindparam, exists, insert
+from sqlalchemy.exc import IntegrityError
+import threading
+
+from models import db, Payment, LedgerAccount, JournalEntry, JournalLine
+from money import to_paise, to_rupees
+
+PLATFORM = 0  # owner_id of platform accounts
+
+EMPLOYER_ESCROW = 'employer_escrow'  # Held for the employer's jobs
+EMPLOYER_FUNDING = 'employer_funding'  # Money paid in by the employer, negative
+EMPLOYER_SPENT = 'employer_spent'  # Released to freelancers
+FREELANCER_EARNINGS = 'freelancer_earnings'  # Released to the freelancer
+PLATFORM_PAYOUTS = 'platform_payouts'  # Owed to freelancers by the platform, negative
+
+
+class LedgerService:
+    """Service to post payment transitions and read account balances"""
+
+    def __init__(self):
+        self._local = threading.local()  # Posts collected by batch() on this thread
+
+    def post(self, payment, old_status: str, new_status: str):
+        """
+        Add the journal entry for a transition to the current session
+        Commit it together with the payment, transitions that move no money
+        (pending, failed) post nothing
+        """
+        lines = self._lines(payment, old_status, new_status)
+        if not lines:
+            return
+
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append((payment.id, new_status, lines))
+            return
+
+        entry = JournalEntry(payment_id=payment.id, event=new_status)
+        for (owner_id, kind), amount in lines:
+            account_id = self._account_id(owner_id, kind)
+            entry.lines.append(JournalLine(account_id=account_id, amount=amount))
+            LedgerAccount.query.filter_by(id=account_id).update(
+                {LedgerAccount.balance: LedgerAccount.balance + amount},
+                synchronize_session=False
+            )
+        db.session.add(entry)
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the posts made inside the block and write them together on
+        exit: one query for the accounts, the entries in one insert and one
+        balance update per account, instead of several queries per entry
+        """
+        self._local.pending = []
+        try:
+            yield
+            pending = self._local.pending
+        finally:
+            self._local.pending = None
+        self._post_many(pending)
+
+    def balance(self, owner_id: int, kind: str) -> int:
+        """Running balance of an account in paise, 0 if it has no postings yet"""
+        value = db.session.query(LedgerAccount.balance).filter_by(owner_id=owner_id, kind=kind).scalar()
+        return value or 0
+
+    def total_spent(self, employer_id: int) -> float:
+        return to_rupees(self.balance(employer_id, EMPLOYER_SPENT))
+
+    def total_earned(self, freelancer_id: int) -> float:
+        return to_rupees(self.balance(freelancer_id, FREELANCER_EARNINGS))
+
+    def backfill(self, batch_size: int = 1000) -> int:
+        """Post entries for payments that moved money before the ledger existed"""
+        posted = 0
+        unposted = ~exists().where(JournalEntry.payment_id == Payment.id)
+        query = Payment.query.filter(Payment.status.in_(('held', 'completed', 'refunded')), unposted)
+        while True:
+            payments = query.order_by(Payment.id).limit(batch_size).all()
+            if not payments:
+                return posted
+            for payment in payments:
+                released = payment.released_at is not None or payment.status == 'completed'
+                self.post(payment, 'pending', 'held')
+                if released:
+                    self.post(payment, 'held', 'completed')
+                if payment.status == 'refunded':
+                    self.post(payment, 'completed' if released else 'held', 'refunded')
+                posted += 1
+            db.session.commit()
+
+    def verify(self, batch_size: int = 5000, max_reported: int = 100) -> Dict:
+        """
+        Stream the journal in entry order, check every entry sums to zero and
+        every account balance equals the sum of its lines
+        Memory is bounded by the number of accounts, not journal lines
+        """
+        sums = {}
+        entries = 0
+        unbalanced = []
+        current_entry, current_total = None, 0
+
+        query = db.session.query(JournalLine.entry_id, JournalLine.account_id, JournalLine.amount) \
+            .order_by(JournalLine.entry_id)
+        for entry_id, account_id, amount in query.yield_per(batch_size):
+            if entry_id != current_entry:
+                if current_entry is not None and current_total != 0 and len(unbalanced) < max_reported:
+                    unbalanced.append(current_entry)
+                current_entry, current_total = entry_id, 0
+                entries += 1
+            current_total += amount
+            sums[account_id] = sums.get(account_id, 0) + amount
+        if current_entry is not None and current_total != 0 and len(unbalanced) < max_reported:
+            unbalanced.append(current_entry)
+
+        drift = []
+        accounts = 0
+        for account in LedgerAccount.query.yield_per(batch_size):
+            accounts += 1
+            journal_sum = sums.get(account.id, 0)
+            if journal_sum != account.balance and len(drift) < max_reported:
+                drift.append({
+                    'account_id': account.id,
+                    'owner_id': account.owner_id,
+                    'kind': account.kind,
+                    'balance': account.balance,
+                    'journal_sum': journal_sum
+                })
+
+        return {
+            'ok': not unbalanced and not drift,
+            'entries': entries,
+            'accounts': accounts,
+            'unbalanced_entries': unbalanced,
+            'drift': drift
+        }
+
+    def _post_many(self, pending: List):
+        if not pending:
+            return
+        owners = {owner_id for _, _, lines in pending for (owner_id, _), _ in lines}
+        accounts = {
+            (owner_id, kind): account_id for account_id, owner_id, kind in
+            db.session.query(LedgerAccount.id, LedgerAccount.owner_id, LedgerAccount.kind)
+            .filter(LedgerAccount.owner_id.in_(owners))
+        }
+
+        for _, _, lines in pending:
+            for key, _ in lines:
+                if key not in accounts:
+                    accounts[key] = self._account_id(*key)
+
+        # Entries without RETURNING so they go in one statement, read back
+        # by their unique (payment_id, event) for the lines
+        db.session.execute(insert(JournalEntry), [
+            {'payment_id': payment_id, 'event': event} for payment_id, event, _ in pending
+        ])
+        entry_ids = {
+            (payment_id, event): entry_id for entry_id, payment_id, event in
+            db.session.query(JournalEntry.id, JournalEntry.payment_id, JournalEntry.event)
+            .filter(JournalEntry.payment_id.in_({payment_id for payment_id, _, _ in pending}))
+        }
+
+        journal_lines, deltas = [], {}
+        for payment_id, event, lines in pending:
+            for key, amount in lines:
+                journal_lines.append({
+                    'entry_id': entry_ids[(payment_id, event)],
+                    'account_id': accounts[key],
+                    'amount': amount
+                })
+                deltas[accounts[key]] = deltas.get(accounts[key], 0) + amount
+        db.session.execute(insert(JournalLine), journal_lines)
+
+        table = LedgerAccount.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('account_id'))
+            .values(balance=table.c.balance + bindparam('delta')),
+            [{'account_id': account_id, 'delta': delta} for account_id, delta in deltas.items()]
+        )
+
+    def _lines(self, payment, old_status: str, new_status: str) -> List[Tuple[Tuple[int, str], int]]:
+        amount = to_paise(payment.amount)
+        employer, freelancer = payment.employer_id, payment.freelancer_id
+
+        if new_status == 'held':
+            return [((employer, EMPLOYER_ESCROW), amount), ((employer, EMPLOYER_FUNDING), -amount)]
+        if new_status == 'completed':
+            return [
+                ((employer, EMPLOYER_ESCROW), -amount), ((employer, EMPLOYER_SPENT), amount),
+                ((freelancer, FREELANCER_EARNINGS), amount), ((PLATFORM, PLATFORM_PAYOUTS), -amount)
+            ]
+        if new_status == 'refunded' and old_status == 'held':
+            return [((employer, EMPLOYER_ESCROW), -amount), ((employer, EMPLOYER_FUNDING), amount)]
+        if new_status == 'refunded' and old_status == 'completed':
+            return [
+                ((employer, EMPLOYER_SPENT), -amount), ((employer, EMPLOYER_FUNDING), amount),
+                ((freelancer, FREELANCER_EARNINGS), -amount), ((PLATFORM, PLATFORM_PAYOUTS), amount)
+            ]
+        return []
+
+    def _account_id(self, owner_id: int, kind: str) -> int:
+        """Id of the account, opened on its first posting"""
+        account_id = db.session.query(LedgerAccount.id).filter_by(owner_id=owner_id, kind=kind).scalar()
+        if account_id is not None:
+            return account_id
+        try:
+            with db.session.begin_nested():
+                account = LedgerAccount(owner_id=owner_id, kind=kind, balance=0)
+                db.session.add(account)
+            return account.id
+        except IntegrityError:
+            # Opened concurrently by another transaction
+            return db.session.query(LedgerAccount.id).filter_by(owner_id=owner_id, kind=kind).scalar()
@@ -213,10 +213,12 @@ class MatchingService:
             }
         }
     
-    def match_freelancers_to_job(self, job, freelancers: List) -> List[Dict]:
+    def match_freelancers_to_job(self, job, freelancers: List, serialize=None) -> List[Dict]:
         """
         Find and rank the best freelancers for a job
+        serialize(freelancer) renders each match, to_dict() by default
         """
+        serialize = serialize or (lambda freelancer: freelancer.to_dict())
         matches = []
         
         for freelancer in freelancers:
@@ -224,24 +226,29 @@ class MatchingService:
             
             # Only include matches above a threshold
             if match_data['match_percentage'] >= 30:
-                matches.append({
-                    'freelancer': freelancer.to_dict(),
-                    'match_score': match_data['match_percentage'],
-                    'match_level': match_data['match_level'],
-                    'score_breakdown': match_data['breakdown'],
-                    'recommendation': self._generate_recommendation(match_data, job, freelancer)
-                })
+                matches.append((freelancer, match_data))
         
         # Sort by match score (highest first)
-        matches.sort(key=lambda x: x['match_score'], reverse=True)
-        
-        # Return top 10 matches
-        return matches[:10]
+        matches.sort(key=lambda x: x[1]['match_percentage'], reverse=True)
+        
+        # Return top 10 matches, only those get serialized
+        return [
+            {
+                'freelancer': serialize(freelancer),
+                'match_score': match_data['match_percentage'],
+                'match_level': match_data['match_level'],
+                'score_breakdown': match_data['breakdown'],
+                'recommendation': self._generate_recommendation(match_data, job, freelancer)
+            }
+            for freelancer, match_data in matches[:10]
+        ]
     
-    def match_jobs_to_freelancer(self, freelancer_profile, jobs: List) -> List[Dict]:
+    def match_jobs_to_freelancer(self, freelancer_profile, jobs: List, serialize=None) -> List[Dict]:
         """
         Find and rank the best jobs for a freelancer
+        serialize(job) renders each match, to_dict() by default
         """
+        serialize = serialize or (lambda job: job.to_dict())
         matches = []
         
         for job in jobs:
@@ -249,19 +256,22 @@ class MatchingService:
             
             # Only include matches above a threshold
             if match_data['match_percentage'] >= 30:
-                matches.append({
-                    'job': job.to_dict(),
-                    'match_score': match_data['match_percentage'],
-                    'match_level': match_data['match_level'],
-                    'score_breakdown': match_data['breakdown'],
-                    'recommendation': self._generate_recommendation(match_data, job, freelancer_profile)
-                })
+                matches.append((job, match_data))
         
         # Sort by match score (highest first)
-        matches.sort(key=lambda x: x['match_score'], reverse=True)
-        
-        # Return top 10 matches
-        return matches[:10]
+        matches.sort(key=lambda x: x[1]['match_percentage'], reverse=True)
+        
+        # Return top 10 matches, only those get serialized
+        return [
+            {
+                'job': serialize(job),
+                'match_score': match_data['match_percentage'],
+                'match_level': match_data['match_level'],
+                'score_breakdown': match_data['breakdown'],
+                'recommendation': self._generate_recommendation(match_data, job, freelancer_profile)
+            }
+            for job, match_data in matches[:10]
+        ]
     
     def _generate_recommendation(self, match_data: Dict, job, freelancer) -> str:
         """
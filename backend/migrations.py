@@ -0,0 +1,103 @@
+"""
+Schema upgrades for existing databases
+create_all() creates missing tables but never changes existing ones, so a
+column added to a model after the database was created is added here with
+ALTER TABLE ... ADD COLUMN. A NOT NULL column gets its scalar model default
+as the column default, which also fills the existing rows. Indexes replaced
+by wider ones are dropped so writes stop maintaining both, and rows that
+would break a new unique index are removed before it is created
+"""
+
+from typing import Dict, List
+from sqlalchemy import inspect, literal, text
+
+
+# Table -> indexes the models no longer declare
+SUPERSEDED_INDEXES = {
+    'payments': ('ix_payments_employer_created', 'ix_payments_freelancer_created')
+}
+
+# Unique index -> (table, columns) it covers, added after the app had let duplicates in
+UNIQUE_INDEXES = {
+    'uq_applications_job_freelancer': ('applications', ('job_id', 'freelancer_id'))
+}
+
+
+class MigrationError(RuntimeError):
+    """A model change that cannot be applied to an existing table automatically"""
+
+
+def ensure_columns(engine, metadata) -> List[str]:
+    """Add every column declared on the models but missing from its existing table, returns table.column names"""
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    added = []
+
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+
+                ddl = (f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} '
+                       f'{column.type.compile(dialect=engine.dialect)}')
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    value = literal(default).compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+                    ddl += f' DEFAULT {value}'
+                if not column.nullable:
+                    if default is None:
+                        raise MigrationError(f'{table.name}.{column.name} is NOT NULL without a scalar default, '
+                                             'add it by hand')
+                    ddl += ' NOT NULL'
+                connection.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def drop_superseded_indexes(engine) -> List[str]:
+    """Drop the indexes in SUPERSEDED_INDEXES still present, returns their names"""
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    dropped = []
+
+    with engine.begin() as connection:
+        for table, names in SUPERSEDED_INDEXES.items():
+            if table not in tables:
+                continue
+            present = {index['name'] for index in inspector.get_indexes(table)}
+            for name in names:
+                if name in present:
+                    connection.execute(text(f'DROP INDEX {preparer.quote(name)}'))
+                    dropped.append(name)
+    return dropped
+
+
+def drop_duplicates(engine) -> Dict[str, int]:
+    """
+    Delete the rows a missing index in UNIQUE_INDEXES would reject, keeping
+    the oldest (lowest id) row of each group, returns deleted rows per index
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    deleted = {}
+
+    with engine.begin() as connection:
+        for name, (table, columns) in UNIQUE_INDEXES.items():
+            if table not in tables or name in {index['name'] for index in inspector.get_indexes(table)}:
+                continue
+            quoted = preparer.quote(table)
+            same = ' AND '.join(f'older.{preparer.quote(c)} = {quoted}.{preparer.quote(c)}' for c in columns)
+            result = connection.execute(text(
+                f'DELETE FROM {quoted} WHERE EXISTS (SELECT 1 FROM {quoted} AS older '
+                f'WHERE {same} AND older.id < {quoted}.id)'
+            ))
+            if result.rowcount:
+                deleted[name] = result.rowcount
+    return deleted
@@ -1,10 +1,130 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload, undefer
 from datetime import datetime
 import json
 
+from money import Paise
+
 db = SQLAlchemy()
 
-class User(db.Model):
+class Fieldset:
+    """
+    Sparse fieldset and expansion spec for to_dict
+    fields=None emits every column, expand=None nests the model's default relations
+    """
+    
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields  # set of names, or None for all
+        self.expand = expand  # relation name -> Fieldset, or None for defaults
+    
+    @classmethod
+    def parse(cls, fields: str = None, expand: str = None) -> 'Fieldset':
+        """
+        Build from query parameters, nested names use dots:
+        fields=id,status,job.title&expand=job,freelancer
+        """
+        field_paths = [f.strip() for f in fields.split(',') if f.strip()] if fields is not None else None
+        expand_paths = [e.strip() for e in expand.split(',') if e.strip()] if expand is not None else None
+        return cls._build(field_paths, expand_paths)
+    
+    @classmethod
+    def _build(cls, field_paths, expand_paths) -> 'Fieldset':
+        fields = None
+        nested_fields = {}
+        if field_paths is not None:
+            fields = set()
+            for path in field_paths:
+                head, _, rest = path.partition('.')
+                if rest:
+                    nested_fields.setdefault(head, []).append(rest)
+                else:
+                    fields.add(head)
+        
+        if expand_paths is None and not nested_fields:
+            return cls(fields, None)
+        
+        nested_expand = {}
+        for path in expand_paths or []:
+            head, _, rest = path.partition('.')
+            nested_expand.setdefault(head, [])
+            if rest:
+                nested_expand[head].append(rest)
+        # Asking for a nested field implies expanding its relation
+        for head in nested_fields:
+            nested_expand.setdefault(head, [])
+        
+        expand = {}
+        for head, rest in nested_expand.items():
+            # Without an explicit expand, nested objects keep their defaults
+            child_expand = rest if expand_paths is not None else None
+            expand[head] = cls._build(nested_fields.get(head), child_expand)
+        return cls(fields, expand)
+    
+    def key(self) -> tuple:
+        """Hashable canonical form, equal specs give equal keys"""
+        fields = tuple(sorted(self.fields)) if self.fields is not None else None
+        expand = None
+        if self.expand is not None:
+            expand = tuple(sorted((name, child.key()) for name, child in self.expand.items()))
+        return (fields, expand)
+    
+    def wants(self, name: str) -> bool:
+        return self.fields is None or name in self.fields
+    
+    def relations(self, model) -> dict:
+        """Relations to nest for a model class, mapped to their child fieldsets"""
+        if self.expand is None:
+            # Default nesting still respects a sparse fields= list
+            return {name: Fieldset() for name in model._default_expand if self.wants(name)}
+        return {name: child for name, child in self.expand.items() if name in model._expandable}
+    
+    def load_options(self, model) -> list:
+        """
+        selectinload options fetching exactly the relations that will be
+        nested, plus the derived columns the fieldset asks for
+        """
+        options = [undefer(getattr(model, name)) for name in model._derived if self.wants(name)]
+        relationships = inspect(model).relationships
+        for name, child in self.relations(model).items():
+            target = relationships[name].mapper.class_
+            loader = selectinload(relationships[name].class_attribute)
+            child_options = child.load_options(target)
+            if child_options:
+                loader = loader.options(*child_options)
+            options.append(loader)
+        return options
+
+def _iso(name):
+    return lambda obj: getattr(obj, name).isoformat() if getattr(obj, name) else None
+
+def _list(name):
+    return lambda obj: getattr(obj, name) or []
+
+def _attr(name):
+    return lambda obj: getattr(obj, name)
+
+class SerializerMixin:
+    """to_dict driven by a per-model field table, honoring a Fieldset"""
+    
+    _serializers = {}  # field name -> getter
+    _expandable = ()  # relations that may be nested
+    _default_expand = ()  # relations nested when no expand is requested
+    _derived = ()  # deferred columns computed in SQL from other tables' rows
+    
+    def to_dict(self, fieldset: Fieldset = None):
+        fieldset = fieldset or Fieldset()
+        data = {
+            name: getter(self)
+            for name, getter in self._serializers.items()
+            if fieldset.wants(name)
+        }
+        for name, child in fieldset.relations(type(self)).items():
+            related = getattr(self, name)
+            data[name] = related.to_dict(child) if related else None
+        return data
+
+class User(SerializerMixin, db.Model):
     """User model for both freelancers and employers"""
     __tablename__ = 'users'
     
@@ -20,6 +140,7 @@ class User(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_verified = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Token version, bumped to revoke every session
     
     # Relationships
     freelancer_profile = db.relationship('FreelancerProfile', backref='user', uselist=False, cascade='all, delete-orphan')
@@ -28,22 +149,25 @@ class User(db.Model):
     payments_made = db.relationship('Payment', backref='employer', foreign_keys='Payment.employer_id', cascade='all, delete-orphan')
     payments_received = db.relationship('Payment', backref='freelancer', foreign_keys='Payment.freelancer_id')
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'email': self.email,
-            'name': self.name,
-            'user_type': self.user_type,
-            'phone': self.phone,
-            'location': self.location,
-            'profile_image': self.profile_image,
-            'is_verified': self.is_verified,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    _serializers = {
+        'id': _attr('id'),
+        'email': _attr('email'),
+        'name': _attr('name'),
+        'user_type': _attr('user_type'),
+        'phone': _attr('phone'),
+        'location': _attr('location'),
+        'profile_image': _attr('profile_image'),
+        'is_verified': _attr('is_verified'),
+        'created_at': _iso('created_at')
+    }
+    _expandable = ('freelancer_profile',)
 
-class FreelancerProfile(db.Model):
+class FreelancerProfile(SerializerMixin, db.Model):
     """Freelancer profile with skills and portfolio"""
     __tablename__ = 'freelancer_profiles'
+    __table_args__ = (
+        db.Index('ix_freelancer_profiles_availability_rate', 'availability', 'hourly_rate'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
@@ -60,36 +184,46 @@ class FreelancerProfile(db.Model):
     total_earnings = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every update, used for ETags
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'user': self.user.to_dict() if self.user else None,
-            'title': self.title,
-            'bio': self.bio,
-            'skills': self.skills or [],
-            'experience_years': self.experience_years,
-            'hourly_rate': self.hourly_rate,
-            'availability': self.availability,
-            'portfolio_url': self.portfolio_url,
-            'languages': self.languages or [],
-            'rating': self.rating,
-            'total_jobs_completed': self.total_jobs_completed,
-            'total_earnings': self.total_earnings,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    __mapper_args__ = {'version_id_col': version}
+    
+    _serializers = {
+        'id': _attr('id'),
+        'user_id': _attr('user_id'),
+        'title': _attr('title'),
+        'bio': _attr('bio'),
+        'skills': _list('skills'),
+        'experience_years': _attr('experience_years'),
+        'hourly_rate': _attr('hourly_rate'),
+        'availability': _attr('availability'),
+        'portfolio_url': _attr('portfolio_url'),
+        'languages': _list('languages'),
+        'rating': _attr('rating'),
+        'total_jobs_completed': _attr('total_jobs_completed'),
+        'total_earnings': _attr('total_earnings'),
+        'created_at': _iso('created_at')
+    }
+    _expandable = ('user',)
+    _default_expand = ('user',)
 
-class Job(db.Model):
+class Job(SerializerMixin, db.Model):
     """Job posting model"""
     __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_created_at', 'status', 'created_at'),
+        db.Index('ix_jobs_employer_status', 'employer_id', 'status'),
+        # Facet counts group within the open jobs without a sort
+        db.Index('ix_jobs_status_job_type', 'status', 'job_type'),
+        db.Index('ix_jobs_status_experience_level', 'status', 'experience_level'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     required_skills = db.Column(db.JSON, nullable=False)  # List of required skills
-    budget = db.Column(db.Float, nullable=False)  # in INR
+    budget = db.Column(Paise, nullable=False)  # in INR, stored as paise
     duration = db.Column(db.String(100))  # e.g., "2 weeks", "1 month"
     experience_level = db.Column(db.String(50))  # 'entry', 'intermediate', 'expert'
     job_type = db.Column(db.String(50))  # 'project', 'hourly', 'contract'
@@ -97,36 +231,50 @@ class Job(db.Model):
     payment_type = db.Column(db.String(50))  # 'fixed', 'hourly', 'milestone'
     status = db.Column(db.String(50), default='open')  # 'open', 'in_progress', 'completed', 'cancelled'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     deadline = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every update, used for ETags
+    
+    __mapper_args__ = {'version_id_col': version}
     
     # Relationships
     applications = db.relationship('Application', backref='job', cascade='all, delete-orphan')
     payments = db.relationship('Payment', backref='job', cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'employer_id': self.employer_id,
-            'employer': self.employer.to_dict() if self.employer else None,
-            'title': self.title,
-            'description': self.description,
-            'required_skills': self.required_skills or [],
-            'budget': self.budget,
-            'duration': self.duration,
-            'experience_level': self.experience_level,
-            'job_type': self.job_type,
-            'location': self.location,
-            'payment_type': self.payment_type,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'deadline': self.deadline.isoformat() if self.deadline else None,
-            'applications_count': len(self.applications) if self.applications else 0
-        }
+    _serializers = {
+        'id': _attr('id'),
+        'employer_id': _attr('employer_id'),
+        'title': _attr('title'),
+        'description': _attr('description'),
+        'required_skills': _list('required_skills'),
+        'budget': _attr('budget'),
+        'duration': _attr('duration'),
+        'experience_level': _attr('experience_level'),
+        'job_type': _attr('job_type'),
+        'location': _attr('location'),
+        'payment_type': _attr('payment_type'),
+        'status': _attr('status'),
+        'created_at': _iso('created_at'),
+        'deadline': _iso('deadline'),
+        'applications_count': lambda job: job.applications_count or 0
+    }
+    _expandable = ('employer',)
+    _default_expand = ('employer',)
+    _derived = ('applications_count',)
 
-class Application(db.Model):
+class Application(SerializerMixin, db.Model):
     """Job application model"""
     __tablename__ = 'applications'
+    __table_args__ = (
+        db.Index('ix_applications_job_status', 'job_id', 'status'),
+        db.Index('ix_applications_freelancer_status', 'freelancer_id', 'status'),
+        # One application per freelancer and job, enforced by the database
+        db.Index('uq_applications_job_freelancer', 'job_id', 'freelancer_id', unique=True),
+        # Ranked triage orderings for /api/jobs/<id>/applications
+        db.Index('ix_applications_job_match', 'job_id', 'match_score', 'id'),
+        db.Index('ix_applications_job_created', 'job_id', 'created_at', 'id'),
+        db.Index('ix_applications_job_rate', 'job_id', 'proposed_rate', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False)
@@ -135,32 +283,59 @@ class Application(db.Model):
     proposed_rate = db.Column(db.Float)  # Freelancer's proposed rate
     estimated_duration = db.Column(db.String(100))
     status = db.Column(db.String(50), default='pending')  # 'pending', 'accepted', 'rejected'
+    match_score = db.Column(db.Float, nullable=False, default=0.0)  # Match percentage at apply time
+    match_breakdown = db.Column(db.JSON)  # MatchingService score breakdown at apply time
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'job_id': self.job_id,
-            'job': self.job.to_dict() if self.job else None,
-            'freelancer_id': self.freelancer_id,
-            'freelancer': self.freelancer.to_dict() if self.freelancer else None,
-            'cover_letter': self.cover_letter,
-            'proposed_rate': self.proposed_rate,
-            'estimated_duration': self.estimated_duration,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    _serializers = {
+        'id': _attr('id'),
+        'job_id': _attr('job_id'),
+        'freelancer_id': _attr('freelancer_id'),
+        'cover_letter': _attr('cover_letter'),
+        'proposed_rate': _attr('proposed_rate'),
+        'estimated_duration': _attr('estimated_duration'),
+        'status': _attr('status'),
+        'match_score': _attr('match_score'),
+        'match_breakdown': _attr('match_breakdown'),
+        'created_at': _iso('created_at')
+    }
+    _expandable = ('job', 'freelancer')
+    _default_expand = ('job', 'freelancer')
 
-class Payment(db.Model):
+# Counted in SQL from the (job_id, status) index, listings load it with the
+# jobs instead of every job's applications
+Job.applications_count = db.column_property(
+    db.select(db.func.count(Application.id)).where(Application.job_id == Job.id)
+    .correlate_except(Application).scalar_subquery(),
+    deferred=True
+)
+
+class Payment(SerializerMixin, db.Model):
     """Payment model for transactions"""
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Covering indexes: dashboard sums never touch the table
+        db.Index('ix_payments_employer_status_amount', 'employer_id', 'status', 'amount'),
+        db.Index('ix_payments_freelancer_status_amount', 'freelancer_id', 'status', 'amount'),
+        db.Index('ix_payments_job_status', 'job_id', 'status'),
+        # History pages walk (created_at, id), the history summary reads
+        # status and amount from the same index
+        db.Index('ix_payments_employer_created_cover', 'employer_id', 'created_at', 'id', 'status', 'amount'),
+        db.Index('ix_payments_freelancer_created_cover', 'freelancer_id', 'created_at', 'id', 'status', 'amount'),
+        # Reconciliation scans the payments of a settlement window
+        db.Index('ix_payments_created_at', 'created_at'),
+        # Escrow auto-release loads held payments coming due
+        db.Index('ix_payments_status_completed', 'status', 'completed_at'),
+        # Payout runs stream completed, unpaid payments per freelancer
+        db.Index('ix_payments_status_payout_freelancer', 'status', 'payout_id', 'freelancer_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False)
     employer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     freelancer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Paise, nullable=False)  # in INR, stored as paise
     currency = db.Column(db.String(10), default='INR')
     payment_method = db.Column(db.String(50))  # 'upi', 'netbanking', 'card', 'wallet'
     transaction_id = db.Column(db.String(100), unique=True)
@@ -169,20 +344,217 @@ class Payment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
     released_at = db.Column(db.DateTime)  # When payment released to freelancer
+    disputed_at = db.Column(db.DateTime)  # Disputed by the employer, never auto-released
+    payout_id = db.Column(db.Integer, db.ForeignKey('payouts.id'))  # Set once paid out to the freelancer's bank
+    
+    # Every UPDATE is conditional on the status it was read with, so two
+    # concurrent transitions of one payment cannot both succeed
+    __mapper_args__ = {'version_id_col': status, 'version_id_generator': False}
     
-    def to_dict(self):
+    _serializers = {
+        'id': _attr('id'),
+        'job_id': _attr('job_id'),
+        'employer_id': _attr('employer_id'),
+        'freelancer_id': _attr('freelancer_id'),
+        'amount': _attr('amount'),
+        'currency': _attr('currency'),
+        'payment_method': _attr('payment_method'),
+        'transaction_id': _attr('transaction_id'),
+        'status': _attr('status'),
+        'payment_gateway': _attr('payment_gateway'),
+        'created_at': _iso('created_at'),
+        'completed_at': _iso('completed_at'),
+        'released_at': _iso('released_at'),
+        'disputed_at': _iso('disputed_at'),
+        'payout_id': _attr('payout_id')
+    }
+    _expandable = ('job', 'employer', 'freelancer')
+
+class PaymentTask(db.Model):
+    """Durable queue entry for processing a payment outside the request"""
+    __tablename__ = 'payment_tasks'
+    __table_args__ = (
+        # Workers claim the oldest due task
+        db.Index('ix_payment_tasks_state_run_at', 'state', 'run_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), nullable=False, unique=True)
+    state = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'done', 'dead'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not claimed before this
+    locked_until = db.Column(db.DateTime)  # Lease of the worker running it, reclaimed after this
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    payment = db.relationship('Payment', backref=db.backref('task', uselist=False))
+    
+    def to_status(self) -> dict:
         return {
-            'id': self.id,
-            'job_id': self.job_id,
-            'employer_id': self.employer_id,
-            'freelancer_id': self.freelancer_id,
-            'amount': self.amount,
-            'currency': self.currency,
-            'payment_method': self.payment_method,
-            'transaction_id': self.transaction_id,
-            'status': self.status,
-            'payment_gateway': self.payment_gateway,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'released_at': self.released_at.isoformat() if self.released_at else None
+            'state': self.state,
+            'attempts': self.attempts,
+            'next_attempt_at': self.run_at.isoformat() if self.state == 'queued' and self.run_at else None,
+            'last_error': self.last_error
         }
+
+class PayoutRun(db.Model):
+    """Batch settlement of released payments to freelancers' bank accounts"""
+    __tablename__ = 'payout_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # 'running', 'completed'
+    cutoff_at = db.Column(db.DateTime, nullable=False)  # Pays payments released before this
+    checkpoint_freelancer_id = db.Column(db.Integer, nullable=False, default=0)  # Last freelancer paid out
+    payouts_count = db.Column(db.Integer, nullable=False, default=0)
+    payments_count = db.Column(db.Integer, nullable=False, default=0)
+    gross_amount = db.Column(db.BigInteger, nullable=False, default=0)  # Paise
+    fee_amount = db.Column(db.BigInteger, nullable=False, default=0)  # Paise
+    net_amount = db.Column(db.BigInteger, nullable=False, default=0)  # Paise
+    bank_file = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class Payout(db.Model):
+    """One freelancer's share of a payout run"""
+    __tablename__ = 'payouts'
+    __table_args__ = (
+        db.UniqueConstraint('run_id', 'freelancer_id', name='uq_payouts_run_freelancer'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('payout_runs.id'), nullable=False)
+    freelancer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    reference = db.Column(db.String(50), unique=True, nullable=False)  # Sent to the bank
+    payments_count = db.Column(db.Integer, nullable=False)
+    gross_amount = db.Column(db.BigInteger, nullable=False)  # Paise
+    fee_amount = db.Column(db.BigInteger, nullable=False)  # Paise, platform fee
+    net_amount = db.Column(db.BigInteger, nullable=False)  # Paise
+    status = db.Column(db.String(20), nullable=False, default='processing')  # 'processing', 'paid', 'failed'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LedgerAccount(db.Model):
+    """Ledger account with its running balance in paise"""
+    __tablename__ = 'ledger_accounts'
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'kind', name='uq_ledger_accounts_owner_kind'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, nullable=False)  # User id, 0 for platform accounts
+    kind = db.Column(db.String(30), nullable=False)  # 'employer_escrow', 'employer_funding', 'employer_spent', 'freelancer_earnings', 'platform_payouts'
+    balance = db.Column(db.BigInteger, nullable=False, default=0)  # Sum of the account's journal lines
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class JournalEntry(db.Model):
+    """Balanced ledger posting for one payment state transition"""
+    __tablename__ = 'journal_entries'
+    __table_args__ = (
+        # A transition is posted once, however often it is retried
+        db.UniqueConstraint('payment_id', 'event', name='uq_journal_entries_payment_event'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), nullable=False)
+    event = db.Column(db.String(20), nullable=False)  # 'held', 'completed', 'refunded'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    lines = db.relationship('JournalLine', backref='entry', cascade='all, delete-orphan')
+
+class JournalLine(db.Model):
+    """One side of a journal entry, amounts of an entry sum to zero"""
+    __tablename__ = 'journal_lines'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=False, index=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('ledger_accounts.id'), nullable=False, index=True)
+    amount = db.Column(db.BigInteger, nullable=False)  # Paise, positive debit, negative credit
+
+class ReconciliationRun(db.Model):
+    """Comparison of one gateway settlement file against payments"""
+    __tablename__ = 'reconciliation_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(500), nullable=False)  # Settlement file path
+    gateway = db.Column(db.String(50))  # Only this gateway's payments are expected in the file
+    window_start = db.Column(db.DateTime)  # Payments created in [window_start, window_end) are expected
+    window_end = db.Column(db.DateTime)
+    status = db.Column(db.String(20), nullable=False, default='running')  # 'running', 'completed', 'failed'
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    matched = db.Column(db.Integer, nullable=False, default=0)
+    mismatches = db.Column(db.Integer, nullable=False, default=0)
+    mismatch_counts = db.Column(db.JSON)  # kind -> count
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class ReconciliationItem(db.Model):
+    """One mismatch found by a reconciliation run"""
+    __tablename__ = 'reconciliation_items'
+    __table_args__ = (
+        db.Index('ix_reconciliation_items_run_kind', 'run_id', 'kind'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('reconciliation_runs.id'), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)  # 'missing_payment', 'missing_settlement', 'amount_mismatch', 'status_mismatch', 'duplicate', 'invalid_row'
+    transaction_id = db.Column(db.String(100))
+    payment_id = db.Column(db.Integer)
+    line_number = db.Column(db.Integer)  # In the settlement file
+    settlement_amount = db.Column(db.BigInteger)  # Paise
+    payment_amount = db.Column(db.BigInteger)  # Paise
+    settlement_status = db.Column(db.String(50))
+    payment_status = db.Column(db.String(50))
+
+class IdempotencyKey(db.Model):
+    """Stored outcome of a request sent with an Idempotency-Key header"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # Hash of method, path and body
+    state = db.Column(db.String(20), nullable=False, default='in_progress')  # 'in_progress', 'done'
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.LargeBinary)
+    response_headers = db.Column(db.JSON)
+    locked_until = db.Column(db.DateTime)  # An in_progress claim older than this can be taken over
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class WebhookEvent(db.Model):
+    """Gateway webhook event, stored once per gateway and event id"""
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        db.UniqueConstraint('gateway', 'event_id', name='uq_webhook_events_gateway_event'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    gateway = db.Column(db.String(50), nullable=False)
+    event_id = db.Column(db.String(100), nullable=False)  # Assigned by the gateway
+    event_type = db.Column(db.String(50), nullable=False)  # 'payment.captured', 'payment.failed', 'payment.refunded'
+    transaction_id = db.Column(db.String(100))
+    payment_id = db.Column(db.Integer, index=True)
+    result = db.Column(db.String(30), nullable=False)  # 'applied', 'ignored', 'unknown_payment', 'amount_mismatch'
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class NodeLease(db.Model):
+    """Transaction ID node id leased by one live process"""
+    __tablename__ = 'node_leases'
+    
+    node_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0-1023, one holder at a time
+    owner = db.Column(db.String(200), nullable=False)  # host:pid:token of the holder
+    leased_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)  # Renewed by the holder's heartbeat, free after this
+
+class RevokedToken(db.Model):
+    """Access token revoked before it expired"""
+    __tablename__ = 'revoked_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Rows can be purged after this
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,95 @@
+"""
+Money in integer paise
+Amounts are stored as whole paise and converted at the edges, so sums and
+comparisons in SQL are exact. Percentages are applied in basis points with
+half-up rounding to the paisa, the same rule for a single amount and for a
+whole array of them. Batch helpers use NumPy when it is installed and fall
+back to plain Python otherwise
+"""
+
+from typing import Sequence
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from sqlalchemy import BigInteger, text
+from sqlalchemy.types import TypeDecorator
+
+PAISE_SCHEMA_VERSION = 1  # SQLite user_version once legacy amounts are converted
+
+try:
+    import numpy as np
+except ImportError:  # Optional, only speeds up batch fee calculation
+    np = None
+
+
+def to_paise(amount) -> int:
+    """Rupee amount to integer paise, half up, raises ValueError unless amount is a finite number"""
+    if isinstance(amount, bool):
+        raise ValueError(f'Not an amount: {amount!r}')
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError(f'Not an amount: {amount!r}') from None
+
+
+def to_rupees(paise: int) -> float:
+    return paise / 100
+
+
+def parse_amount(value) -> float:
+    """Rupee amount from user input, rounded to the paisa, raises ValueError when it is not a number"""
+    return to_rupees(to_paise(value))
+
+
+def to_basis_points(percent) -> int:
+    """Percentage to basis points, 1.99 -> 199"""
+    return int((Decimal(str(percent)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def percent_of(paise: int, percent) -> int:
+    """percent of a non-negative paise amount, rounded half up to the paisa"""
+    return (paise * to_basis_points(percent) + 5000) // 10000
+
+
+def percent_of_many(paise: Sequence[int], basis_points: Sequence[int]):
+    """
+    percent_of over arrays of amounts and basis points
+    Returns an int64 NumPy array, or a list without NumPy
+    """
+    if np is not None:
+        return (np.asarray(paise, dtype=np.int64) * np.asarray(basis_points, dtype=np.int64) + 5000) // 10000
+    return [(amount * bps + 5000) // 10000 for amount, bps in zip(paise, basis_points)]
+
+
+class Paise(TypeDecorator):
+    """
+    Column stored as BIGINT paise, read and written as rupees
+    Comparisons against the column bind rupee values through the same
+    conversion, so filters and aggregates keep working in rupees
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_paise(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else to_rupees(value)
+
+
+def convert_legacy_amounts(engine, columns: Sequence[tuple]):
+    """
+    Convert (table, column) pairs of a SQLite database created before the
+    move to paise, where the columns are still declared FLOAT and hold rupees
+    Values keep REAL storage there, so the conversion is recorded in
+    PRAGMA user_version and runs once. Other databases need an ALTER COLUMN
+    migration instead
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as connection:
+        if connection.execute(text('PRAGMA user_version')).scalar() >= PAISE_SCHEMA_VERSION:
+            return
+        for table, column in columns:
+            declared = {row[1]: row[2].upper() for row in connection.execute(text(f'PRAGMA table_info({table})'))}
+            if declared.get(column) in ('FLOAT', 'REAL', 'DOUBLE'):
+                connection.execute(text(f'UPDATE {table} SET {column} = ROUND({column} * 100)'))
+        connection.execute(text(f'PRAGMA user_version = {PAISE_SCHEMA_VERSION}'))
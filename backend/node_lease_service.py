@@ -0,0 +1,192 @@
+"""
+Transaction ID node leases
+Every process that issues transaction IDs needs a node id no other live
+process holds. Node ids are leased from the node_leases table, whose primary
+key makes a slot exclusive, and kept alive by a heartbeat thread. A lease
+that is not renewed expires and its slot can be taken over; the holder stops
+issuing ids halfway through the lease, well before that. A process leases
+a slot when it issues its first id or starts its workers, so processes that
+only serve reads never take one. A forked child never reuses its parent's
+lease, it leases a slot of its own on first use
+"""
+
+from typing import Dict
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update, delete
+from sqlalchemy.exc import IntegrityError
+import atexit
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+from models import db, NodeLease
+from id_generator import MAX_NODE_ID
+
+logger = logging.getLogger(__name__)
+
+
+class NodeIdUnavailable(RuntimeError):
+    """Every node id is leased by a live process"""
+
+
+class NodeLeaseService:
+    """Service to lease, renew and release this process's transaction ID node id"""
+
+    def __init__(self, ttl_seconds: float = 60):
+        self.ttl_seconds = ttl_seconds  # Lease length in the table, renewed every third of it
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._counts = {'acquired': 0, 'renewed': 0, 'lost': 0}
+        self._forget()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.release)
+
+    def init_app(self, app):
+        """Remember the app for the heartbeat and release, nothing is leased until node_id() is asked"""
+        self._app = app
+
+    def node_id(self) -> int:
+        """This process's node id, leased on first use, raises NodeIdUnavailable"""
+        with self._lock:
+            if self._pid == os.getpid():
+                if time.monotonic() < self._valid_until:
+                    return self._node_id
+                # The heartbeat fell behind, renew before issuing another id
+                if self._renew_held():
+                    return self._node_id
+            return self._acquire()
+
+    def acquire(self) -> int:
+        """Lease a node id now, at process start, raises NodeIdUnavailable when all are held"""
+        return self.node_id()
+
+    def release(self):
+        """Give the node id back, e.g. on shutdown"""
+        with self._lock:
+            if self._owner is None or self._pid != os.getpid() or self._app is None:
+                return
+            node_id, owner = self._node_id, self._owner
+            self._stopping.set()
+            self._forget()
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(delete(NodeLease).where(NodeLease.node_id == node_id, NodeLease.owner == owner))
+        except Exception:
+            logger.exception('Could not release transaction ID node id %s', node_id)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            held = self._pid == os.getpid() and time.monotonic() < self._valid_until
+            return dict(self._counts, node_id=self._node_id if held else None, ttl_seconds=self.ttl_seconds)
+
+    def _acquire(self) -> int:
+        """Lease a free or expired node id, the caller holds the lock"""
+        self._stopping.set()
+        self._forget()
+        owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+        with db.engine.begin() as conn:
+            leases = dict(conn.execute(select(NodeLease.node_id, NodeLease.expires_at)).all())
+        now = datetime.utcnow()
+        expired = [node_id for node_id, expires_at in leases.items() if expires_at < now]
+        free = [node_id for node_id in range(MAX_NODE_ID + 1) if node_id not in leases]
+        # Random order keeps processes starting together from racing for one slot
+        random.shuffle(expired)
+        random.shuffle(free)
+
+        for node_id in expired + free:
+            started = time.monotonic()
+            values = {'owner': owner, 'leased_at': now, 'expires_at': now + timedelta(seconds=self.ttl_seconds)}
+            try:
+                with db.engine.begin() as conn:
+                    if node_id in leases:
+                        # Only if nobody renewed or took it over since it was read
+                        taken = conn.execute(update(NodeLease).where(
+                            NodeLease.node_id == node_id, NodeLease.expires_at == leases[node_id]
+                        ).values(**values)).rowcount
+                    else:
+                        taken = conn.execute(insert(NodeLease).values(node_id=node_id, **values)).rowcount
+            except IntegrityError:
+                taken = 0  # Inserted by another process first
+            if taken:
+                break
+        else:
+            raise NodeIdUnavailable(f'All {MAX_NODE_ID + 1} transaction ID node ids are leased')
+
+        self._node_id, self._owner, self._pid = node_id, owner, os.getpid()
+        # Stop issuing ids halfway through the lease, the other half covers
+        # clock skew between this host and the next holder's
+        self._valid_until = started + self.ttl_seconds / 2
+        self._counts['acquired'] += 1
+        self._stopping = threading.Event()
+        thread = threading.Thread(target=self._heartbeat, args=(owner, self._stopping),
+                                  name='node-lease-heartbeat', daemon=True)
+        thread.start()
+        logger.info('Leased transaction ID node id %s as %s', node_id, owner)
+        return node_id
+
+    def _renew(self, node_id: int, owner: str) -> bool:
+        """Extend a lease in the table, False once another process has taken it over"""
+        with db.engine.begin() as conn:
+            return bool(conn.execute(update(NodeLease).where(
+                NodeLease.node_id == node_id, NodeLease.owner == owner
+            ).values(expires_at=datetime.utcnow() + timedelta(seconds=self.ttl_seconds))).rowcount)
+
+    def _renew_held(self) -> bool:
+        """Renew the lease this process holds, the caller holds the lock"""
+        started = time.monotonic()
+        if self._renew(self._node_id, self._owner):
+            self._valid_until = started + self.ttl_seconds / 2
+            self._counts['renewed'] += 1
+            return True
+        self._lost()
+        return False
+
+    def _heartbeat(self, owner: str, stopping: threading.Event):
+        while not stopping.wait(self.ttl_seconds / 3):
+            with self._lock:
+                if self._owner != owner:
+                    return
+                node_id = self._node_id
+            started = time.monotonic()
+            try:
+                # Outside the lock, ids keep being issued while the table is busy
+                with self._app.app_context():
+                    renewed = self._renew(node_id, owner)
+            except Exception:
+                # Ids stop once the lease runs out locally, node_id() renews then
+                logger.exception('Could not renew transaction ID node id %s', node_id)
+                continue
+            with self._lock:
+                if self._owner != owner:
+                    return
+                if not renewed:
+                    self._lost()
+                    return
+                self._valid_until = started + self.ttl_seconds / 2
+                self._counts['renewed'] += 1
+
+    def _lost(self):
+        logger.error('Lost the lease on transaction ID node id %s', self._node_id)
+        self._counts['lost'] += 1
+        self._stopping.set()
+        self._forget()
+
+    def _forget(self):
+        self._node_id = self._owner = self._pid = None
+        self._valid_until = 0.0  # time.monotonic() after which no more ids are issued
+        self._stopping = threading.Event()
+
+    def _after_fork(self):
+        # The parent's lease and heartbeat thread are not this process's,
+        # and its lock may have been held by a thread that no longer exists
+        self._lock = threading.Lock()
+        self._forget()
@@ -0,0 +1,80 @@
+"""
+Keyset (seek) pagination helpers
+Pages continue from the sort key of the last row returned instead of an
+OFFSET, so every page is one index range scan no matter how deep it is
+"""
+
+from typing import List, Optional
+from datetime import datetime
+from sqlalchemy import tuple_
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(values: List) -> str:
+    """Opaque URL-safe token for a sort key"""
+    encoded = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(encoded, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> List:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list):
+            raise ValueError('cursor is not a list')
+        return [
+            datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v
+            for v in values
+        ]
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(str(e))
+
+
+def keyset_page(query, columns: List, descending: bool = False, cursor: Optional[str] = None,
+                limit: Optional[int] = None, nulls_last: bool = False):
+    """
+    Fetch one page of query ordered by columns, all in the same direction
+    The last column must be unique (usually the primary key)
+    nulls_last pages through rows where the first column is NULL after all
+    the others, keeping both phases index range scans on every database
+    Returns (rows, next_cursor), next_cursor is None on the last page
+    """
+    values = decode_cursor(cursor) if cursor else None
+    if values is not None and len(values) != len(columns):
+        raise InvalidCursor('cursor does not match the sort order')
+
+    fetch = limit + 1 if limit else None
+
+    if not nulls_last:
+        rows = _seek(query, columns, values, descending).limit(fetch).all()
+    else:
+        first = columns[0]
+        rows = []
+        if values is None or values[0] is not None:
+            rows = _seek(query.filter(first.isnot(None)), columns, values, descending).limit(fetch).all()
+        if fetch is None or len(rows) < fetch:
+            null_values = values[1:] if values is not None and values[0] is None else None
+            remaining = fetch - len(rows) if fetch else None
+            rows += _seek(query.filter(first.is_(None)), columns[1:], null_values, descending).limit(remaining).all()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return rows, next_cursor
+
+
+def _seek(query, columns: List, values: Optional[List], descending: bool):
+    if values is not None:
+        if len(columns) == 1:
+            key, after = columns[0], values[0]
+        else:
+            key, after = tuple_(*columns), tuple_(*values)
+        query = query.filter(key < after if descending else key > after)
+    return query.order_by(*[c.desc() if descending else c.asc() for c in columns])
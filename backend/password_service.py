@@ -0,0 +1,111 @@
+"""
+Password hashing service
+Runs password hashing and verification on a small dedicated thread pool
+(scrypt and pbkdf2 release the GIL while they work) with a bounded queue,
+so a burst of logins cannot hold every request thread on CPU work
+"""
+
+from typing import Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import time
+
+
+class HashingUnavailable(Exception):
+    """Raised when the hashing pool is saturated or too slow to answer"""
+
+
+class PasswordService:
+    """Service to hash and verify passwords with admission control"""
+
+    def __init__(self, workers: int = 4, max_queue: int = 32, method: str = 'scrypt',
+                 timeout_seconds: float = 5.0, sample_size: int = 1024):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.method = method  # Werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+        self.timeout_seconds = timeout_seconds
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._queue_waits = deque(maxlen=sample_size)  # seconds
+        self._latencies = deque(maxlen=sample_size)  # seconds of hashing work
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._queue_waits)
+            latencies = sorted(self._latencies)
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'queue_wait_ms': self._summary(waits),
+                'hash_latency_ms': self._summary(latencies)
+            }
+
+    def _run(self, func, *args, **kwargs):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise HashingUnavailable('Password hashing queue is full')
+            self._in_flight += 1
+
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+                    self._queue_waits.append(started - submitted)
+                    self._latencies.append(finished - started)
+
+        try:
+            future = self._executor.submit(task)
+        except RuntimeError:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except TimeoutError:
+            # The work still finishes in the background and frees its slot
+            with self._lock:
+                self._timed_out += 1
+            raise HashingUnavailable('Password hashing timed out')
+
+    @staticmethod
+    def _summary(samples) -> Dict:
+        if not samples:
+            return {'count': 0, 'avg': None, 'p50': None, 'p95': None, 'max': None}
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {
+            'count': len(samples),
+            'avg': round(sum(samples) / len(samples) * 1000, 3),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': round(samples[-1] * 1000, 3)
+        }
@@ -0,0 +1,232 @@
+"""
+Durable payment processing queue
+Payments are enqueued as payment_tasks rows in the same transaction that
+creates them, and drained by a bounded pool of worker threads that call the
+gateway outside the request. Tasks are claimed with a lease, so several
+processes can drain the same table and a task held by a crashed worker is
+picked up again once its lease runs out. Transient gateway errors and
+results that could not be committed are retried with exponential backoff
+and jitter
+"""
+
+from typing import Callable, Dict, Optional
+from datetime import datetime, timedelta
+from sqlalchemy import and_, inspect, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+import logging
+import random
+import threading
+
+from models import db, Payment, PaymentTask
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentQueue:
+    """Queue of payments waiting for the gateway, backed by the database"""
+
+    def __init__(self, workers: int = 2, max_attempts: int = 5, backoff_seconds: float = 2.0,
+                 max_backoff_seconds: float = 300.0, lease_seconds: float = 60.0,
+                 poll_seconds: float = 1.0):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lease_seconds = lease_seconds  # Must exceed the gateway timeout
+        self.poll_seconds = poll_seconds  # Fallback for retries and tasks enqueued by other processes
+
+        self._app = None
+        self._handler = None
+        self._fail = None
+        self._retryable = ()
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._counts = {'processed': 0, 'succeeded': 0, 'declined': 0, 'retried': 0, 'dead': 0}
+
+    def init_app(self, app, handler: Callable, fail: Callable, retryable=(Exception,)):
+        """
+        Set up processing, start() runs the workers
+        handler(payment) updates the payment and returns a result dict with
+        a 'success' key, exceptions in retryable are retried with backoff
+        fail(payment) marks the payment failed once its task gives up, in
+        the task's transaction
+        """
+        self._app = app
+        self._handler = handler
+        self._fail = fail
+        self._retryable = retryable
+
+    def start(self):
+        """Start the worker threads"""
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'payment-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, payment) -> PaymentTask:
+        """Add a task for the payment to the current session, commit it with the payment"""
+        task = PaymentTask(payment=payment, state='queued', run_at=datetime.utcnow())
+        db.session.add(task)
+        return task
+
+    def notify(self):
+        """Wake an idle worker after a commit that enqueued tasks"""
+        self._wakeup.set()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return dict(self._counts, workers=self.workers, busy=self._busy)
+
+    def _run(self):
+        # Start idle, the first poll picks up whatever is due
+        worked = False
+        while not self._stopping.is_set():
+            if not worked:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+            try:
+                with self._app.app_context():
+                    worked = self._process_next()
+            except Exception:
+                logger.exception('Payment worker failed')
+                worked = False
+
+    def _process_next(self) -> bool:
+        task_id = self._claim()
+        if task_id is None:
+            return False
+
+        with self._lock:
+            self._busy += 1
+        try:
+            self._process(task_id)
+        finally:
+            db.session.remove()
+            with self._lock:
+                self._busy -= 1
+        return True
+
+    def _claim(self) -> Optional[int]:
+        """Lease the oldest due task, None when nothing is due"""
+        now = datetime.utcnow()
+        due = or_(
+            and_(PaymentTask.state == 'queued', PaymentTask.run_at <= now),
+            and_(PaymentTask.state == 'running', PaymentTask.locked_until <= now)
+        )
+        candidates = db.session.query(PaymentTask.id).filter(due).order_by(PaymentTask.run_at).limit(self.workers).all()
+        random.shuffle(candidates)  # Keep concurrent workers from racing for the same row
+
+        for (task_id,) in candidates:
+            claimed = PaymentTask.query.filter(PaymentTask.id == task_id, due).update({
+                PaymentTask.state: 'running',
+                PaymentTask.locked_until: now + timedelta(seconds=self.lease_seconds),
+                PaymentTask.attempts: PaymentTask.attempts + 1,
+                PaymentTask.updated_at: now
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return task_id
+        db.session.rollback()
+        return None
+
+    def _process(self, task_id: int):
+        task = db.session.get(PaymentTask, task_id)
+        payment = db.session.get(Payment, task.payment_id)
+
+        if payment.status != 'pending':
+            # Already processed by an earlier attempt whose worker died before finishing the task
+            task.state = 'done'
+            db.session.commit()
+            return
+
+        try:
+            result = self._handler(payment)
+        except (StaleDataError, IntegrityError) as e:
+            # Read without a load, the session needs a rollback first
+            self._retry_conflict(task_id, inspect(payment).dict.get('transaction_id'), e)
+            return
+        except self._retryable as e:
+            self._retry_or_fail(task, payment, str(e) or type(e).__name__)
+            return
+        except Exception as e:
+            logger.exception('Payment %s could not be processed', payment.id)
+            db.session.rollback()
+            task.attempts = self.max_attempts  # Not retryable
+            self._retry_or_fail(task, payment, str(e) or type(e).__name__)
+            return
+
+        task.state = 'done'
+        task.locked_until = None
+        task.last_error = None if result.get('success') else result.get('error') or result.get('message')
+        transaction_id = payment.transaction_id
+        try:
+            db.session.commit()
+        except (StaleDataError, IntegrityError) as e:
+            self._retry_conflict(task_id, transaction_id, e)
+            return
+
+        with self._lock:
+            self._counts['processed'] += 1
+            self._counts['succeeded' if result.get('success') else 'declined'] += 1
+
+    def _retry_conflict(self, task_id: int, transaction_id: Optional[str], error: Exception):
+        """
+        Retry a task whose result could not be written, e.g. because a webhook
+        moved the payment first, now rather than once its lease runs out
+        """
+        db.session.rollback()
+        logger.warning('Payment task %s could not be committed: %s', task_id, error)
+        task = db.session.get(PaymentTask, task_id)
+        payment = db.session.get(Payment, task.payment_id)
+        if payment.status == 'pending' and not payment.transaction_id:
+            # The gateway may have been charged with it, the retry must reuse it
+            payment.transaction_id = transaction_id
+        self._retry_or_fail(task, payment, f'Commit failed: {type(error).__name__}')
+
+    def _retry_or_fail(self, task, payment, error: str):
+        # The payment keeps its transaction ID, the retry is deduplicated by the gateway
+        task.last_error = error
+        task.locked_until = None
+        if task.attempts >= self.max_attempts:
+            task.state = 'dead'
+            if payment.status == 'pending':
+                self._fail(payment)
+            counter = 'dead'
+        else:
+            task.state = 'queued'
+            task.run_at = datetime.utcnow() + timedelta(seconds=self._backoff(task.attempts))
+            counter = 'retried'
+        task_id = task.id
+        try:
+            db.session.commit()
+        except (StaleDataError, IntegrityError):
+            # The payment changed meanwhile, the next attempt sees its new status
+            db.session.rollback()
+            PaymentTask.query.filter_by(id=task_id).update({
+                PaymentTask.state: 'queued',
+                PaymentTask.locked_until: None,
+                PaymentTask.last_error: error,
+                PaymentTask.run_at: datetime.utcnow() + timedelta(seconds=self._backoff(task.attempts))
+            }, synchronize_session=False)
+            db.session.commit()
+            counter = 'retried'
+
+        with self._lock:
+            self._counts[counter] += 1
+
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff, jittered over the upper half of the delay"""
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
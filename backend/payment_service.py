@@ -4,14 +4,30 @@ Supports UPI, Net Banking, Cards, and Wallets
 This is a mock implementation - integrate with actual payment gateways in production
 """
 
-import uuid
 from datetime import datetime
-import random
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from gateways import GatewayRouter, GatewaySimulator, GatewayUnavailable
+from id_generator import TransactionIdGenerator
+from money import to_paise, to_rupees, to_basis_points, percent_of, percent_of_many, np
+
+# Status -> statuses a payment may move to from there
+PAYMENT_TRANSITIONS = {
+    'pending': ('held', 'failed'),
+    'held': ('completed', 'refunded'),
+    'completed': ('refunded',),
+    'failed': (),
+    'refunded': ()
+}
+
+class InvalidTransition(ValueError):
+    """A payment status change the payment state machine does not allow"""
 
 class PaymentService:
     """Service to handle payment processing for Indian market"""
     
-    def __init__(self):
+    def __init__(self, gateways: dict = None, on_transition=None, id_generator=None, **router_options):
         # Supported payment methods in India
         self.payment_methods = {
             'upi': ['gpay', 'phonepe', 'paytm', 'bhim'],
@@ -28,29 +44,65 @@ class PaymentService:
             'cashfree': 1.95,
             'instamojo': 2.0
         }
+        
+        # Platform fees (in percentage) by who pays them
+        self.platform_fees = {
+            'freelancer': 10.0,
+            'employer': 5.0
+        }
+        
+        # Payment methods each gateway accepts
+        self.gateway_methods = {
+            'razorpay': ['upi', 'netbanking', 'card', 'wallet'],
+            'paytm': ['upi', 'netbanking', 'card', 'wallet'],
+            'phonepe': ['upi', 'card', 'wallet'],
+            'cashfree': ['upi', 'netbanking', 'card'],
+            'instamojo': ['upi', 'netbanking', 'card', 'wallet']
+        }
+        
+        # Gateway clients by name, local simulators unless given
+        gateways = gateways or {name: GatewaySimulator(name) for name in self.gateway_fees}
+        self.router = GatewayRouter(gateways, self.gateway_fees, self.gateway_methods, **router_options)
+        
+        # Time-ordered transaction IDs, give every process its own node id
+        self.id_generator = id_generator or TransactionIdGenerator()
+        
+        # on_transition(payment, old_status, new_status) runs on every status change,
+        # in the caller's transaction
+        self.on_transition = on_transition
     
     def process_payment(self, payment) -> dict:
         """
         Process a payment transaction
         In production, this would integrate with actual payment gateways
+        Raises GatewayUnavailable on transient errors, a retry reuses the
+        payment's transaction ID so the gateway can deduplicate it. A method
+        no gateway accepts fails the payment right away
         """
         try:
             # Generate transaction ID
-            transaction_id = self._generate_transaction_id()
-            payment.transaction_id = transaction_id
+            if not payment.transaction_id:
+                payment.transaction_id = self._generate_transaction_id()
+            transaction_id = payment.transaction_id
             
-            # Select payment gateway (mock)
+            # Select payment gateway, its breaker claim is given back unless
+            # the charge records an outcome
             gateway = self._select_gateway(payment.payment_method)
-            payment.payment_gateway = gateway
-            
-            # Calculate fees
-            fee_amount = self._calculate_fees(payment.amount, gateway)
-            
-            # Simulate payment processing
-            success = self._simulate_payment_processing(payment)
+            charging = False
+            try:
+                payment.payment_gateway = gateway
+                
+                # Calculate fees
+                fee_amount = self._calculate_fees(payment.amount, gateway)
+                
+                charging = True
+                success = self.router.charge(gateway, payment)
+            finally:
+                if not charging:
+                    self.router.release(gateway)
             
             if success:
-                payment.status = 'held'  # Hold payment in escrow
+                self._transition(payment, 'held')  # Hold payment in escrow
                 payment.completed_at = datetime.utcnow()
                 
                 return {
@@ -58,12 +110,12 @@ class PaymentService:
                     'transaction_id': transaction_id,
                     'gateway': gateway,
                     'fee_amount': fee_amount,
-                    'net_amount': payment.amount - fee_amount,
+                    'net_amount': to_rupees(to_paise(payment.amount) - to_paise(fee_amount)),
                     'status': 'held',
                     'message': 'Payment successful and held in escrow'
                 }
             else:
-                payment.status = 'failed'
+                self._transition(payment, 'failed')
                 
                 return {
                     'success': False,
@@ -73,8 +125,11 @@ class PaymentService:
                     'message': 'Payment failed. Please try again.'
                 }
         
+        except (GatewayUnavailable, StaleDataError, IntegrityError):
+            # Transient, or the payment changed concurrently: the caller retries
+            raise
         except Exception as e:
-            payment.status = 'failed'
+            self._transition(payment, 'failed')
             return {
                 'success': False,
                 'error': str(e),
@@ -84,61 +139,79 @@ class PaymentService:
     def release_payment_to_freelancer(self, payment) -> dict:
         """
         Release payment from escrow to freelancer
+        Errors from the transition (ledger, a concurrent change) propagate,
+        the caller rolls back
         """
-        try:
-            if payment.status != 'held':
-                return {
-                    'success': False,
-                    'message': 'Payment is not in held status'
-                }
-            
-            # In production, this would trigger actual fund transfer
-            payment.status = 'completed'
-            payment.released_at = datetime.utcnow()
-            
-            return {
-                'success': True,
-                'message': 'Payment released to freelancer',
-                'released_amount': payment.amount,
-                'released_at': payment.released_at.isoformat()
-            }
-        
-        except Exception as e:
+        if payment.status != 'held':
             return {
                 'success': False,
-                'error': str(e),
-                'message': 'Error releasing payment'
+                'message': 'Payment is not in held status'
             }
+        
+        # In production, this would trigger actual fund transfer
+        self._transition(payment, 'completed')
+        payment.released_at = datetime.utcnow()
+        
+        return {
+            'success': True,
+            'message': 'Payment released to freelancer',
+            'released_amount': payment.amount,
+            'released_at': payment.released_at.isoformat()
+        }
     
     def refund_payment(self, payment) -> dict:
         """
         Process refund for a payment
+        Payments already paid out to the freelancer's bank cannot be refunded
         """
-        try:
-            if payment.status not in ['held', 'completed']:
-                return {
-                    'success': False,
-                    'message': 'Payment cannot be refunded'
-                }
-            
-            # Generate refund transaction ID
-            refund_id = f"REFUND_{self._generate_transaction_id()}"
-            
-            payment.status = 'refunded'
-            
+        if payment.status not in ['held', 'completed'] or payment.payout_id is not None:
             return {
-                'success': True,
-                'refund_id': refund_id,
-                'refund_amount': payment.amount,
-                'message': 'Refund processed successfully'
+                'success': False,
+                'message': 'Payment cannot be refunded'
             }
         
+        try:
+            # Generate refund transaction ID
+            refund_id = f"REFUND_{self._generate_transaction_id()}"
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e),
                 'message': 'Error processing refund'
             }
+        
+        self._transition(payment, 'refunded')
+        
+        return {
+            'success': True,
+            'refund_id': refund_id,
+            'refund_amount': payment.amount,
+            'message': 'Refund processed successfully'
+        }
+    
+    def release_payments(self, payments) -> list:
+        """
+        Release many payments from escrow, one result per payment in order
+        The caller commits them together
+        """
+        return [dict(self.release_payment_to_freelancer(payment), payment_id=payment.id) for payment in payments]
+    
+    def refund_payments(self, payments) -> list:
+        """
+        Refund many payments, one result per payment in order
+        The caller commits them together
+        """
+        return [dict(self.refund_payment(payment), payment_id=payment.id) for payment in payments]
+    
+    def fail_payment(self, payment):
+        """Mark a pending payment that could not be processed as failed"""
+        self._transition(payment, 'failed')
+    
+    def apply_gateway_status(self, payment, status: str):
+        """Move a payment to the status a gateway reported through its webhook"""
+        self._transition(payment, status)
+        if status == 'held' and payment.completed_at is None:
+            payment.completed_at = datetime.utcnow()
     
     def validate_payment_method(self, method: str, details: dict = None) -> bool:
         """
@@ -174,57 +247,79 @@ class PaymentService:
     def calculate_platform_fee(self, amount: float, user_type: str = 'freelancer') -> dict:
         """
         Calculate platform commission/fee
+        Freelancers pay 10%, employers 5%, rounded half up to the paisa
         """
-        # Platform fees
-        if user_type == 'freelancer':
-            # Freelancer pays 10% platform fee
-            fee_percentage = 10.0
-        else:
-            # Employer pays 5% platform fee
-            fee_percentage = 5.0
-        
-        fee_amount = (amount * fee_percentage) / 100
-        net_amount = amount - fee_amount
+        fee_percentage = self._platform_fee_percentage(user_type)
+        gross = to_paise(amount)
+        fee = percent_of(gross, fee_percentage)
         
         return {
-            'gross_amount': amount,
+            'gross_amount': to_rupees(gross),
             'fee_percentage': fee_percentage,
-            'fee_amount': fee_amount,
-            'net_amount': net_amount
+            'fee_amount': to_rupees(fee),
+            'net_amount': to_rupees(gross - fee)
         }
     
+    def calculate_fees_batch(self, amounts_paise, gateways=None, user_types=None) -> dict:
+        """
+        Gateway fees, platform fees and net amounts for a whole statement run
+        amounts_paise, gateways and user_types are parallel sequences, gateways
+        or user_types may be None to skip that fee. Rounding matches
+        _calculate_fees and calculate_platform_fee exactly. Returns int64
+        NumPy arrays in paise, or lists when NumPy is not installed
+        """
+        count = len(amounts_paise)
+        gateway_bps = self._basis_points_for(gateways, count, self.gateway_fees, 2.0)
+        platform_bps = self._basis_points_for(
+            user_types, count, {t: self._platform_fee_percentage(t) for t in set(user_types or ())}, 0
+        )
+        
+        gateway_fee = percent_of_many(amounts_paise, gateway_bps)
+        platform_fee = percent_of_many(amounts_paise, platform_bps)
+        if np is not None:
+            net = np.asarray(amounts_paise, dtype=np.int64) - gateway_fee - platform_fee
+        else:
+            net = [a - g - p for a, g, p in zip(amounts_paise, gateway_fee, platform_fee)]
+        
+        return {'gateway_fee': gateway_fee, 'platform_fee': platform_fee, 'net_amount': net}
+    
+    def _platform_fee_percentage(self, user_type: str) -> float:
+        return self.platform_fees['freelancer' if user_type == 'freelancer' else 'employer']
+    
+    def _basis_points_for(self, keys, count: int, percentages: dict, default) -> list:
+        if keys is None:
+            return [0] * count
+        # One conversion per distinct key, not per payment
+        bps = {key: to_basis_points(percentages.get(key, default)) for key in set(keys)}
+        return [bps[key] for key in keys]
+    
+    def _transition(self, payment, status: str):
+        old_status = payment.status
+        if old_status != status and status not in PAYMENT_TRANSITIONS.get(old_status or 'pending', ()):
+            raise InvalidTransition(f'Payment {payment.id} cannot move from {old_status} to {status}')
+        payment.status = status
+        if self.on_transition and old_status != status:
+            self.on_transition(payment, old_status, status)
+    
     def _generate_transaction_id(self) -> str:
-        """Generate unique transaction ID"""
-        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-        random_suffix = str(uuid.uuid4())[:8].upper()
-        return f"TXN{timestamp}{random_suffix}"
+        """Generate unique transaction ID, sortable by issue time"""
+        return self.id_generator.next_id()
+    
+    def supports_method(self, payment_method: str) -> bool:
+        """Whether a payment with this method can be routed to a gateway"""
+        return self.router.supports(payment_method)
     
     def _select_gateway(self, payment_method: str) -> str:
         """
         Select appropriate payment gateway based on method
-        In production, this would consider gateway availability, fees, success rates
+        The cheapest healthy gateway wins, see GatewayRouter
         """
-        gateways = {
-            'upi': 'razorpay',
-            'netbanking': 'razorpay',
-            'card': 'razorpay',
-            'wallet': 'paytm'
-        }
-        
-        return gateways.get(payment_method.lower(), 'razorpay')
+        return self.router.select(payment_method)
     
     def _calculate_fees(self, amount: float, gateway: str) -> float:
-        """Calculate gateway fees"""
+        """Calculate gateway fees, rounded half up to the paisa"""
         fee_percentage = self.gateway_fees.get(gateway, 2.0)
-        return (amount * fee_percentage) / 100
-    
-    def _simulate_payment_processing(self, payment) -> bool:
-        """
-        Simulate payment processing
-        In production, this would call actual payment gateway APIs
-        """
-        # Simulate 95% success rate
-        return random.random() < 0.95
+        return to_rupees(percent_of(to_paise(amount), fee_percentage))
     
     def _validate_upi(self, details: dict) -> bool:
         """Validate UPI payment details"""
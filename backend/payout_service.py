@@ -0,0 +1,148 @@
+"""
+Batch payout engine
+A payout run streams completed payments that were not paid out yet, ordered
+by freelancer, takes the platform fee of each payment and sums payments and
+fees per freelancer in paise. Each chunk of freelancers is committed in one transaction together with
+the run's checkpoint, so a run that crashed resumes after the last committed
+freelancer. The bank upload file is written from the committed payouts once
+every chunk is done
+"""
+
+from datetime import datetime
+from sqlalchemy import or_
+import csv
+import os
+
+from models import db, User, Payment, Payout, PayoutRun
+from money import to_paise
+
+
+class PayoutService:
+    """Service to settle released payments to freelancers in batches"""
+
+    def __init__(self, payment_service, output_dir: str = 'payouts', chunk_size: int = 500,
+                 batch_size: int = 5000):
+        self.payment_service = payment_service
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size  # Freelancers per transaction
+        self.batch_size = batch_size  # Rows fetched per round trip
+
+    def run(self, resume: bool = True) -> PayoutRun:
+        """
+        Pay out every payment released before now
+        With resume, an unfinished run is continued from its checkpoint
+        instead of starting a new one
+        """
+        payout_run = None
+        if resume:
+            payout_run = PayoutRun.query.filter_by(status='running').order_by(PayoutRun.id.desc()).first()
+        if payout_run is None:
+            payout_run = PayoutRun(status='running', cutoff_at=datetime.utcnow(), checkpoint_freelancer_id=0)
+            db.session.add(payout_run)
+            db.session.commit()
+
+        while self._run_chunk(payout_run):
+            pass
+
+        payout_run.bank_file = self.write_bank_file(payout_run)
+        payout_run.status = 'completed'
+        payout_run.finished_at = datetime.utcnow()
+        db.session.commit()
+        return payout_run
+
+    def write_bank_file(self, payout_run) -> str:
+        """Write the run's payouts as a bank upload CSV, returns its path"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f'payout_run_{payout_run.id}.csv')
+        query = db.session.query(Payout.reference, Payout.freelancer_id, User.name, User.email, Payout.net_amount) \
+            .join(User, User.id == Payout.freelancer_id) \
+            .filter(Payout.run_id == payout_run.id) \
+            .order_by(Payout.id)
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['reference', 'beneficiary_id', 'beneficiary_name', 'beneficiary_email',
+                             'amount', 'currency', 'narration'])
+            for reference, freelancer_id, name, email, net_amount in query.yield_per(self.batch_size):
+                writer.writerow([reference, freelancer_id, name, email, f'{net_amount / 100:.2f}', 'INR',
+                                 f'Payout run {payout_run.id}'])
+        os.replace(tmp_path, path)
+        return path
+
+    def _run_chunk(self, payout_run) -> bool:
+        """Pay out the next chunk of freelancers, False once none are left"""
+        unpaid = db.session.query(Payment.freelancer_id, Payment.id, Payment.amount).filter(
+            Payment.status == 'completed',
+            Payment.payout_id.is_(None),
+            # Payments backfilled as completed have no released_at
+            or_(Payment.released_at <= payout_run.cutoff_at, Payment.released_at.is_(None)),
+            Payment.freelancer_id > payout_run.checkpoint_freelancer_id
+        )
+        freelancer_ids = [
+            freelancer_id for (freelancer_id,) in unpaid.with_entities(Payment.freelancer_id)
+            .distinct().order_by(Payment.freelancer_id).limit(self.chunk_size)
+        ]
+        if not freelancer_ids:
+            return False
+
+        payouts, amounts = [], []
+        rows = unpaid.filter(Payment.freelancer_id <= freelancer_ids[-1]).order_by(Payment.freelancer_id, Payment.id)
+        for freelancer_id, payment_id, amount in rows.yield_per(self.batch_size):
+            if not payouts or payouts[-1]['freelancer_id'] != freelancer_id:
+                payouts.append({'freelancer_id': freelancer_id, 'payment_ids': []})
+            payouts[-1]['payment_ids'].append(payment_id)
+            amounts.append(to_paise(amount))
+
+        if not payouts:
+            return False
+
+        # The fee of each payment, as calculate_platform_fee takes it, then
+        # summed: rounding the fee of a freelancer's total could differ by paise
+        fees = self.payment_service.calculate_fees_batch(
+            amounts, user_types=['freelancer'] * len(amounts)
+        )['platform_fee']
+        start = 0
+        for item in payouts:
+            end = start + len(item['payment_ids'])
+            item['gross'] = sum(amounts[start:end])
+            fee = int(sum(fees[start:end]))
+            start = end
+            payout = Payout(
+                run_id=payout_run.id,
+                freelancer_id=item['freelancer_id'],
+                reference=f"PAYOUT{payout_run.id:06d}{item['freelancer_id']:010d}",
+                payments_count=len(item['payment_ids']),
+                gross_amount=item['gross'],
+                fee_amount=fee,
+                net_amount=item['gross'] - fee,
+                status='processing'
+            )
+            db.session.add(payout)
+            db.session.flush()
+
+            linked = self._link_payments(payout, item['payment_ids'])
+            if linked != len(item['payment_ids']):
+                # A payment was refunded or paid out concurrently, retry the chunk
+                db.session.rollback()
+                return True
+
+            payout_run.payouts_count += 1
+            payout_run.payments_count += payout.payments_count
+            payout_run.gross_amount += payout.gross_amount
+            payout_run.fee_amount += payout.fee_amount
+            payout_run.net_amount += payout.net_amount
+
+        payout_run.checkpoint_freelancer_id = payouts[-1]['freelancer_id']
+        db.session.commit()
+        return True
+
+    def _link_payments(self, payout, payment_ids) -> int:
+        linked = 0
+        for start in range(0, len(payment_ids), 500):
+            linked += Payment.query.filter(
+                Payment.id.in_(payment_ids[start:start + 500]),
+                Payment.status == 'completed',
+                Payment.payout_id.is_(None)
+            ).update({Payment.payout_id: payout.id}, synchronize_session=False)
+        return linked
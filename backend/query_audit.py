@@ -0,0 +1,159 @@
+"""
+Query plan audit mode
+Captures the SQL statements issued while serving each route, runs
+EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (PostgreSQL) on them and reports
+full table scans and temporary sort structures per route
+Enable with QUERY_AUDIT=1, never in production - every new statement is explained
+"""
+
+from typing import Dict, List
+from flask import request, has_request_context
+from sqlalchemy import event
+import threading
+
+
+class QueryAuditService:
+    """Service to audit query plans of the statements each endpoint issues"""
+
+    EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+    def __init__(self):
+        self.enabled = False
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        """Hook the engine and the request cycle when QUERY_AUDIT is on"""
+        self.enabled = bool(app.config.get('QUERY_AUDIT'))
+        if not self.enabled:
+            return
+
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        @app.after_request
+        def _count_request(response):
+            route = self._route_key()
+            if route:
+                with self._lock:
+                    self._route(route)['requests'] += 1
+            return response
+
+    def report(self) -> Dict:
+        """Per-route summary of captured statements and their plan problems"""
+        with self._lock:
+            routes = {}
+            for route, data in sorted(self._routes.items()):
+                statements = sorted(data['statements'].values(), key=lambda s: -s['executions'])
+                routes[route] = {
+                    'requests': data['requests'],
+                    'statements': len(statements),
+                    'full_scans': sum(1 for s in statements if s['full_scans']),
+                    'temp_btrees': sum(1 for s in statements if s['temp_btrees']),
+                    'details': [dict(s) for s in statements]
+                }
+            return {'enabled': self.enabled, 'routes': routes}
+
+    def reset(self):
+        """Drop everything captured so far"""
+        with self._lock:
+            self._routes = {}
+
+    def _route(self, route: str) -> Dict:
+        return self._routes.setdefault(route, {'requests': 0, 'statements': {}})
+
+    def _route_key(self):
+        if not has_request_context():
+            return None
+        rule = request.url_rule.rule if request.url_rule else request.path
+        return f"{request.method} {rule}"
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        route = self._route_key()
+        if not route or executemany:
+            return
+
+        words = statement.lstrip().split(None, 1)
+        if not words or words[0].upper() not in self.EXPLAINABLE:
+            return
+
+        with self._lock:
+            captured = self._route(route)['statements'].get(statement)
+            if captured:
+                # Same SQL text, same plan - only count it
+                captured['executions'] += 1
+                return
+
+        plan = self._explain(conn, statement, parameters)
+        with self._lock:
+            statements = self._route(route)['statements']
+            if statement in statements:
+                statements[statement]['executions'] += 1
+            else:
+                statements[statement] = dict(plan, sql=statement, executions=1)
+
+    def _explain(self, conn, statement: str, parameters) -> Dict:
+        """
+        Run the dialect's EXPLAIN on a side cursor of the same connection
+        Outside SQLite it runs in a savepoint, a failed EXPLAIN would
+        otherwise abort the request's transaction on PostgreSQL
+        """
+        dialect = conn.dialect.name
+        prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+        savepoint = dialect != 'sqlite'
+
+        cursor = conn.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT query_audit')
+            try:
+                cursor.execute(prefix + statement, parameters or ())
+                rows = cursor.fetchall()
+            except Exception as e:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT query_audit')
+                return {'plan': [], 'full_scans': [], 'temp_btrees': False, 'error': str(e)}
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT query_audit')
+        finally:
+            cursor.close()
+
+        if dialect == 'sqlite':
+            lines = [row[-1] for row in rows]
+            return self._analyze_sqlite(lines)
+        lines = [row[0] for row in rows]
+        return self._analyze_postgresql(lines)
+
+    @staticmethod
+    def _analyze_sqlite(lines: List[str]) -> Dict:
+        full_scans = []
+        for line in lines:
+            # 'SCAN jobs' (or 'SCAN TABLE jobs' on older SQLite) without an index
+            if line.startswith('SCAN ') and ' USING ' not in line:
+                full_scans.append(line.replace('SCAN TABLE ', '').replace('SCAN ', '').strip())
+        return {
+            'plan': lines,
+            'full_scans': full_scans,
+            'temp_btrees': any('USE TEMP B-TREE' in line for line in lines)
+        }
+
+    @staticmethod
+    def _analyze_postgresql(lines: List[str]) -> Dict:
+        full_scans = []
+        for line in lines:
+            if 'Seq Scan on ' in line:
+                full_scans.append(line.split('Seq Scan on ', 1)[1].split()[0])
+        return {
+            'plan': lines,
+            'full_scans': full_scans,
+            'temp_btrees': any(line.strip().lstrip('->').strip().startswith('Sort') for line in lines)
+        }
+
+
+def ensure_indexes(engine, metadata):
+    """
+    Create any index declared on the models but missing from the database
+    create_all() skips tables that already exist, so new indexes need this
+    """
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,248 @@
+"""
+Settlement reconciliation
+Streams a gateway settlement file (CSV or JSONL) and compares it with the
+payments created in the settlement window, by transaction_id. Both sides are
+first split into hash partitions on disk, then joined one partition at a
+time, so memory is bounded by the partition size rather than by the file or
+the table, however large they are. Mismatches are written to
+reconciliation_items in batches
+"""
+
+from typing import Dict, Iterator, Optional, Tuple
+from contextlib import ExitStack
+from datetime import datetime
+from sqlalchemy import BigInteger, cast, func, insert
+import csv
+import json
+import os
+import tempfile
+
+from models import db, Payment, ReconciliationRun, ReconciliationItem
+from money import to_paise
+
+# Settlement status -> payment statuses that agree with it
+SETTLEMENT_STATUSES = {
+    'settled': ('held', 'completed'),
+    'captured': ('held', 'completed'),
+    'success': ('held', 'completed'),
+    'refunded': ('refunded',),
+    'failed': ('failed',)
+}
+CHARGED = ('held', 'completed', 'refunded')  # Payments the gateway has to report
+
+ITEM_FIELDS = ('transaction_id', 'payment_id', 'line_number', 'settlement_amount', 'payment_amount',
+               'settlement_status', 'payment_status')
+
+
+class SettlementFileError(ValueError):
+    """The settlement file is not in a format we can read"""
+
+
+class _Report:
+    """Mismatches of a run, buffered and inserted in batches"""
+
+    def __init__(self, run_id: int, batch_size: int):
+        self.run_id = run_id
+        self.batch_size = batch_size
+        self.rows_read = 0
+        self.matched = 0
+        self.counts = {}
+        self._items = []
+
+    def add(self, kind: str, **fields):
+        item = {name: fields.get(name) for name in ITEM_FIELDS}
+        item.update(run_id=self.run_id, kind=kind)
+        self._items.append(item)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self._items) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._items:
+            db.session.execute(insert(ReconciliationItem), self._items)
+            self._items = []
+
+
+class ReconciliationService:
+    """Service to reconcile payments with gateway settlement reports"""
+
+    def __init__(self, work_dir: str = None, partition_rows: int = 500000, batch_size: int = 5000):
+        self.work_dir = work_dir  # Partition files, the system temp dir by default
+        self.partition_rows = partition_rows  # Rows per partition on the larger side
+        self.batch_size = batch_size  # Payment rows per fetch and items per insert
+
+    def run(self, path: str, window_start: datetime, window_end: datetime, gateway: str = None,
+            file_format: str = None) -> ReconciliationRun:
+        """
+        Reconcile one settlement file against the payments created in
+        [window_start, window_end), the report is committed in one transaction
+        With gateway, only that gateway's payments count as missing from the file
+        """
+        if window_start >= window_end:
+            raise ValueError('The settlement window must end after it starts')
+        file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        reconciliation_run = ReconciliationRun(source=path, gateway=gateway, window_start=window_start,
+                                               window_end=window_end, status='running')
+        db.session.add(reconciliation_run)
+        db.session.commit()
+
+        report = _Report(reconciliation_run.id, self.batch_size)
+        in_window = (Payment.created_at >= window_start, Payment.created_at < window_end)
+        try:
+            # Sized for the larger side, so neither the file nor the table
+            # puts more than partition_rows rows in memory at once
+            payment_rows = db.session.query(db.func.count(Payment.id)).filter(*in_window).scalar()
+            partitions = max(self._count_lines(path), payment_rows) // self.partition_rows + 1
+            with tempfile.TemporaryDirectory(prefix='reconcile-', dir=self.work_dir) as work_dir:
+                self._partition_settlements(report, path, file_format, work_dir, partitions)
+                self._partition_payments(work_dir, partitions, in_window)
+                for index in range(partitions):
+                    self._join_partition(report, work_dir, index, gateway)
+            report.flush()
+        except Exception:
+            db.session.rollback()
+            reconciliation_run.status = 'failed'
+            reconciliation_run.finished_at = datetime.utcnow()
+            db.session.commit()
+            raise
+
+        reconciliation_run.rows_read = report.rows_read
+        reconciliation_run.matched = report.matched
+        reconciliation_run.mismatches = sum(report.counts.values())
+        reconciliation_run.mismatch_counts = report.counts
+        reconciliation_run.status = 'completed'
+        reconciliation_run.finished_at = datetime.utcnow()
+        db.session.commit()
+        return reconciliation_run
+
+    def _partition_settlements(self, report: _Report, path: str, file_format: str, work_dir: str,
+                               partitions: int):
+        """Split valid settlement rows by transaction_id"""
+        with ExitStack() as stack:
+            writers = [
+                csv.writer(stack.enter_context(open(os.path.join(work_dir, f's{index}.csv'), 'w', newline='')))
+                for index in range(partitions)
+            ]
+            for line_number, row in self._read_settlements(path, file_format):
+                report.rows_read += 1
+                try:
+                    transaction_id = str(row['transaction_id']).strip()
+                    amount = to_paise(row['amount'])
+                    status = str(row['status']).strip().lower()
+                except (TypeError, KeyError, ValueError):
+                    transaction_id = None
+                if not transaction_id:
+                    report.add('invalid_row', line_number=line_number)
+                    continue
+
+                writers[hash(transaction_id) % partitions].writerow((transaction_id, amount, status, line_number))
+
+    def _partition_payments(self, work_dir: str, partitions: int, in_window: tuple):
+        """Split the payments created in the settlement window, one range scan of the created_at index"""
+        query = self._payment_rows().filter(*in_window)
+
+        with ExitStack() as stack:
+            writers = [
+                csv.writer(stack.enter_context(open(os.path.join(work_dir, f'p{index}.csv'), 'w', newline='')))
+                for index in range(partitions)
+            ]
+            for row in query.yield_per(self.batch_size):
+                writers[hash(row[0]) % partitions].writerow(row)
+
+    def _join_partition(self, report: _Report, work_dir: str, index: int, gateway: Optional[str]):
+        payments = {}
+        with open(os.path.join(work_dir, f'p{index}.csv'), newline='') as f:
+            for transaction_id, payment_id, amount, status, payment_gateway in csv.reader(f):
+                payments[transaction_id] = (int(payment_id), int(amount), status, payment_gateway)
+
+        matched, unmatched = set(), []
+        with open(os.path.join(work_dir, f's{index}.csv'), newline='') as f:
+            for transaction_id, amount, status, line_number in csv.reader(f):
+                fields = {
+                    'transaction_id': transaction_id,
+                    'line_number': int(line_number),
+                    'settlement_amount': int(amount),
+                    'settlement_status': status
+                }
+                payment = payments.get(transaction_id)
+                if payment is None:
+                    unmatched.append(fields)
+                else:
+                    self._compare(report, fields, payment, matched)
+
+        # Settled in this file but created outside the window, e.g. just
+        # before it started, looked up by transaction_id in batches
+        for start in range(0, len(unmatched), self.batch_size):
+            chunk = unmatched[start:start + self.batch_size]
+            found = {
+                row[0]: (row[1], row[2], row[3], row[4]) for row in self._payment_rows().filter(
+                    Payment.transaction_id.in_({fields['transaction_id'] for fields in chunk})
+                )
+            }
+            for fields in chunk:
+                payment = found.get(fields['transaction_id'])
+                if payment is None:
+                    report.add('missing_payment', **fields)
+                else:
+                    self._compare(report, fields, payment, matched)
+
+        for transaction_id, (payment_id, payment_amount, payment_status, payment_gateway) in payments.items():
+            if transaction_id in matched or payment_status not in CHARGED:
+                continue
+            if gateway is None or payment_gateway == gateway:
+                report.add('missing_settlement', transaction_id=transaction_id, payment_id=payment_id,
+                           payment_amount=payment_amount, payment_status=payment_status)
+
+    def _compare(self, report: _Report, fields: Dict, payment: tuple, matched: set):
+        """Check one settlement row against its payment"""
+        payment_id, payment_amount, payment_status, _ = payment
+        fields.update(payment_id=payment_id, payment_amount=payment_amount, payment_status=payment_status)
+        if fields['transaction_id'] in matched:
+            report.add('duplicate', **fields)
+            return
+        matched.add(fields['transaction_id'])
+
+        agrees = True
+        if fields['settlement_amount'] != payment_amount:
+            report.add('amount_mismatch', **fields)
+            agrees = False
+        if payment_status not in SETTLEMENT_STATUSES.get(fields['settlement_status'], ()):
+            report.add('status_mismatch', **fields)
+            agrees = False
+        if agrees:
+            report.matched += 1
+
+    @staticmethod
+    def _payment_rows():
+        # Amounts in paise, cast in SQL: a SQLite database converted by
+        # convert_legacy_amounts keeps them as REAL, 99999.0
+        return db.session.query(
+            Payment.transaction_id, Payment.id, cast(func.round(Payment.amount), BigInteger),
+            Payment.status, Payment.payment_gateway
+        )
+
+    @staticmethod
+    def _count_lines(path: str) -> int:
+        with open(path, 'rb') as f:
+            return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+
+    def _read_settlements(self, path: str, file_format: str) -> Iterator[Tuple[int, dict]]:
+        """(line number, row) pairs, row is None for lines that do not parse"""
+        with open(path, newline='', encoding='utf-8') as f:
+            if file_format == 'jsonl':
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    yield line_number, row if isinstance(row, dict) else None
+                return
+
+            reader = csv.DictReader(f)
+            missing = {'transaction_id', 'amount', 'status'} - set(reader.fieldnames or ())
+            if missing:
+                raise SettlementFileError(f"Settlement file has no {', '.join(sorted(missing))} column")
+            for row in reader:
+                yield reader.line_num, row
@@ -0,0 +1,133 @@
+"""
+Token revocation service
+Revoked token ids (JTIs) are stored in the revoked_tokens table and fronted
+by an in-memory Bloom filter, so checking a token that was never revoked
+costs a few hash probes and the database is only asked on a filter hit
+The filter is rebuilt from the table periodically, which is also how other
+processes pick up revocations they did not make themselves
+"""
+
+from typing import Callable, Dict, Iterable
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """Fixed size Bloom filter over strings using double hashing"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.num_bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def fill_ratio(self) -> float:
+        return sum(bin(byte).count('1') for byte in self._bits) / self.num_bits
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+
+class RevocationService:
+    """Service to revoke tokens and check them without a query per request"""
+
+    def __init__(self, refresh_seconds: int = 300, capacity: int = 10000, error_rate: float = 0.001):
+        self.refresh_seconds = refresh_seconds
+        self.capacity = capacity  # Minimum number of JTIs the filter is sized for
+        self.error_rate = error_rate
+
+        self._filter = BloomFilter(capacity, error_rate)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._journal = None  # JTIs added while a rebuild is reading the table
+        self._checks = 0
+        self._filter_hits = 0
+        self._false_positives = 0
+
+    def needs_refresh(self) -> bool:
+        """Whether the filter was never loaded or is older than the refresh interval"""
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at >= self.refresh_seconds
+
+    def rebuild(self, jtis: Iterable[str]):
+        """
+        Rebuild the filter from every JTI that is still revoked and unexpired
+        Only one rebuild runs at a time, once the filter has been loaded
+        other callers keep using the current one instead of waiting
+        """
+        if not self._rebuild_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is not None and not self.needs_refresh():
+                return
+            with self._lock:
+                self._journal = []
+
+            items = list(jtis)
+            bloom = BloomFilter(max(self.capacity, 2 * len(items)), self.error_rate)
+            for jti in items:
+                bloom.add(jti)
+
+            with self._lock:
+                # Revocations made while we were reading the table
+                for jti in self._journal:
+                    bloom.add(jti)
+                self._journal = None
+                self._filter = bloom
+                self._loaded_at = time.monotonic()
+        finally:
+            self._rebuild_lock.release()
+
+    def add(self, jti: str):
+        """Record a revocation made by this process, the caller stores the row"""
+        with self._lock:
+            self._filter.add(jti)
+            if self._journal is not None:
+                self._journal.append(jti)
+
+    def is_revoked(self, jti: str, loader: Callable) -> bool:
+        """
+        Whether the token was revoked
+        loader(jti) checks the table and is only called when the filter matches
+        """
+        with self._lock:
+            self._checks += 1
+            if jti not in self._filter:
+                return False
+            self._filter_hits += 1
+
+        revoked = loader(jti)
+        if not revoked:
+            with self._lock:
+                self._false_positives += 1
+        return revoked
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            bloom = self._filter
+            return {
+                'entries': bloom.count,
+                'bits': bloom.num_bits,
+                'hashes': bloom.num_hashes,
+                'fill_ratio': round(bloom.fill_ratio(), 4),
+                'checks': self._checks,
+                'filter_hits': self._filter_hits,
+                'false_positives': self._false_positives,
+                'loaded_seconds_ago': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+            }
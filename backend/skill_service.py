@@ -0,0 +1,190 @@
+"""
+Skill vocabulary service for autocomplete suggestions
+Keeps an in-memory prefix trie of canonical skills weighted by how often
+they appear in job requirements and freelancer profiles
+"""
+
+from typing import Dict, List, Iterable, Optional
+from collections import Counter
+import hashlib
+import threading
+import time
+
+
+class _TrieNode:
+    """Trie node holding the best completions of its subtree"""
+
+    __slots__ = ('children', 'key', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.key = None  # Canonical skill ending at this node
+        self.top = []  # [(count, key)] sorted by count desc, then key
+
+
+class SkillService:
+    """Service to suggest canonical skills by prefix"""
+
+    def __init__(self, max_suggestions: int = 10, refresh_seconds: int = 300):
+        self.max_suggestions = max_suggestions
+        self.refresh_seconds = refresh_seconds
+
+        self._root = _TrieNode()
+        self._counts = Counter()  # canonical key -> usage count
+        self._labels = {}  # canonical key -> Counter of display variants
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self.version = 0
+
+    @staticmethod
+    def normalize(skill) -> str:
+        """Canonical form of a skill: lowercase with collapsed whitespace"""
+        if not isinstance(skill, str):
+            return ''
+        return ' '.join(skill.lower().split())
+
+    def rebuild(self, skill_lists: Iterable[Optional[List[str]]]):
+        """
+        Rebuild the whole index from an iterable of skill lists
+        Used for the initial load and the periodic cross-process refresh
+        """
+        counts = Counter()
+        labels = {}
+        for skills in skill_lists:
+            for skill in skills or []:
+                key = self.normalize(skill)
+                if key:
+                    counts[key] += 1
+                    labels.setdefault(key, Counter())[skill.strip()] += 1
+
+        root = _TrieNode()
+        for key in counts:
+            node = root
+            for char in key:
+                node = node.children.setdefault(char, _TrieNode())
+            node.key = key
+
+        self._fill_tops(root, counts)
+
+        with self._lock:
+            self._root = root
+            self._counts = counts
+            self._labels = labels
+            self._loaded_at = time.monotonic()
+            self.version += 1
+
+    def needs_refresh(self) -> bool:
+        """Whether the index was never loaded or is older than the refresh interval"""
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at >= self.refresh_seconds
+
+    def update(self, old_skills: Optional[List[str]], new_skills: Optional[List[str]]):
+        """
+        Apply the difference between two skill lists to the index
+        Call with old_skills=None for newly created records
+        """
+        if self._loaded_at is None:
+            return  # The next full load will pick the change up
+
+        delta = Counter()
+        for skill in old_skills or []:
+            key = self.normalize(skill)
+            if key:
+                delta[key] -= 1
+        for skill in new_skills or []:
+            key = self.normalize(skill)
+            if key:
+                delta[key] += 1
+
+        changed = [key for key, diff in delta.items() if diff]
+        if not changed:
+            return
+
+        with self._lock:
+            for skill in old_skills or []:
+                self._adjust_label(skill, -1)
+            for skill in new_skills or []:
+                self._adjust_label(skill, 1)
+
+            for key in changed:
+                self._counts[key] = max(0, self._counts[key] + delta[key])
+                if not self._counts[key]:
+                    del self._counts[key]
+                self._update_path(key)
+
+            self.version += 1
+
+    def suggest(self, prefix: str, limit: int = None) -> List[Dict]:
+        """
+        Get the most used skills starting with prefix
+        limit is clamped to 1..max_suggestions, a negative one would slice from the end
+        """
+        limit = self.max_suggestions if limit is None else max(1, min(limit, self.max_suggestions))
+        node = self._root
+        for char in self.normalize(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        return [
+            {'skill': self._label(key), 'count': count}
+            for count, key in node.top[:limit]
+        ]
+
+    def etag(self, suggestions: List[Dict]) -> str:
+        """Content-based ETag so unchanged results stay cacheable across index updates"""
+        digest = hashlib.sha1()
+        for item in suggestions:
+            digest.update(f"{item['skill']}\x00{item['count']}\x01".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _label(self, key: str) -> str:
+        variants = self._labels.get(key)
+        if not variants:
+            return key
+        # Most common spelling wins, ties broken alphabetically for stable output
+        return min(variants.items(), key=lambda item: (-item[1], item[0]))[0]
+
+    def _adjust_label(self, skill, diff: int):
+        key = self.normalize(skill)
+        if not key:
+            return
+        variants = self._labels.setdefault(key, Counter())
+        variants[skill.strip()] += diff
+        if variants[skill.strip()] <= 0:
+            del variants[skill.strip()]
+        if not variants:
+            del self._labels[key]
+
+    def _update_path(self, key: str):
+        """Recompute the cached completions along the path of one skill"""
+        path = [self._root]
+        node = self._root
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            path.append(node)
+        node.key = key
+
+        for node in reversed(path):
+            node.top = self._best_of(node, self._counts)
+
+    def _fill_tops(self, node: _TrieNode, counts: Counter):
+        # Iterative post-order walk, skill names can be long
+        stack = [(node, False)]
+        while stack:
+            current, visited = stack.pop()
+            if visited:
+                current.top = self._best_of(current, counts)
+            else:
+                stack.append((current, True))
+                stack.extend((child, False) for child in current.children.values())
+
+    def _best_of(self, node: _TrieNode, counts: Counter) -> list:
+        candidates = []
+        if node.key is not None and counts.get(node.key):
+            candidates.append((counts[node.key], node.key))
+        for child in node.children.values():
+            candidates.extend(child.top)
+        candidates.sort(key=lambda item: (-item[0], item[1]))
+        return candidates[:self.max_suggestions]
@@ -0,0 +1,50 @@
+"""
+Streaming JSON responses for large listings
+Rows are serialized one batch at a time from a yield_per query and sent as
+a chunked body, so memory and time to first byte do not grow with the result
+The body has the same shape as the buffered response, the count is written
+as a footer once every row has been sent
+"""
+
+from typing import Callable
+from flask import Response, request, current_app, stream_with_context
+import json
+
+STREAM_BATCH_SIZE = 500  # Rows fetched per round trip
+STREAM_CHUNK_BYTES = 64 * 1024  # Bytes buffered before a chunk is flushed
+
+
+def wants_stream() -> bool:
+    """Whether the client asked for a streamed body with ?stream=1"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_json_list(key: str, query, serialize: Callable, extra: dict = None) -> Response:
+    """
+    Stream {"<key>": [...], "count": n, **extra} from a query
+    serialize may return a dict or already encoded JSON bytes
+    The query is only executed once the response body is being sent
+    """
+    def generate():
+        encode = current_app.json.dumps
+        chunk = [f'{{{json.dumps(key)}: [']
+        chunk_bytes = 0
+        count = 0
+
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            piece = serialize(row)
+            piece = piece.decode('utf-8') if isinstance(piece, bytes) else encode(piece)
+            chunk.append(piece if count == 0 else ',' + piece)
+            chunk_bytes += len(piece) + 1
+            count += 1
+            if chunk_bytes >= STREAM_CHUNK_BYTES:
+                yield ''.join(chunk)
+                chunk = []
+                chunk_bytes = 0
+
+        footer = {'count': count}
+        footer.update(extra or {})
+        chunk.append('], ' + encode(footer)[1:])
+        yield ''.join(chunk)
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
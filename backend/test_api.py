@@ -176,12 +176,16 @@ def test_api():
     response = requests.post(f"{BASE_URL}/payments/create", json=payment_data, headers=headers)
     print_response("12. Create Payment (Escrow)", response)
     
-    if response.status_code == 201:
+    if response.status_code == 202:
         payment_id = response.json()['payment']['id']
     else:
         print("Failed to create payment")
         return
     
+    # Processed in the background, poll the status URL
+    response = requests.get(f"{BASE_URL}/payments/{payment_id}", headers=headers)
+    print_response("12b. Payment Processing Status", response)
+    
     # Test 13: Get Dashboard Stats (Employer)
     headers = {"Authorization": f"Bearer {employer_token}"}
     response = requests.get(f"{BASE_URL}/dashboard/stats", headers=headers)
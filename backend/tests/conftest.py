@@ -0,0 +1,116 @@
+"""
+Test fixtures
+The app runs against a throwaway SQLite database shared by the session.
+Tests register their own users, so they never see each other's rows, and no
+payment workers run: tests drain the queue themselves
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+from sqlalchemy import create_engine
+
+_DB_DIR = tempfile.mkdtemp(prefix='freelance-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['PAYMENT_GATEWAY_DECLINE_RATE'] = '0'
+os.environ['PAYOUT_OUTPUT_DIR'] = os.path.join(_DB_DIR, 'payouts')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, payment_queue  # noqa: E402
+from models import PaymentTask  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+        db.session.remove()
+
+
+@pytest.fixture
+def scratch_db(app_context, tmp_path, monkeypatch):
+    """Point the app at an empty SQLite database of its own, returns its engine"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'scratch.db'}")
+    db.session.remove()
+    monkeypatch.setitem(db.engines, None, engine)
+    yield engine
+    db.session.remove()
+    engine.dispose()
+
+
+@pytest.fixture
+def queue(app_context):
+    """The app's payment queue with nothing due, tests call _process_next() to run one task"""
+    # Tasks left queued by earlier tests would be claimed first
+    PaymentTask.query.filter(PaymentTask.state.in_(('queued', 'running'))).update(
+        {'state': 'dead'}, synchronize_session=False
+    )
+    db.session.commit()
+    return payment_queue
+
+
+@pytest.fixture
+def register(client):
+    """Register a fresh user, the function returns (auth headers, user id)"""
+    def register(user_type):
+        response = client.post('/api/register', json={
+            'email': f'{user_type}-{uuid.uuid4().hex[:12]}@example.com',
+            'password': 'password123',
+            'name': f'Test {user_type}',
+            'user_type': user_type
+        })
+        assert response.status_code == 201, response.get_json()
+        body = response.get_json()
+        return {'Authorization': f"Bearer {body['access_token']}"}, body['user']['id']
+    return register
+
+
+@pytest.fixture
+def hire(client):
+    """Post a job and accept the freelancer on it, the function returns the job id"""
+    def hire(employer, freelancer, budget=25000):
+        response = client.post('/api/jobs', headers=employer, json={
+            'title': 'Build a payments dashboard',
+            'description': 'Flask and React',
+            'budget': budget,
+            'required_skills': ['Python'],
+            'job_type': 'fixed'
+        })
+        job_id = response.get_json()['job']['id']
+        response = client.post(f'/api/jobs/{job_id}/apply', headers=freelancer, json={'proposed_rate': budget})
+        application_id = response.get_json()['application']['id']
+        response = client.put(f'/api/applications/{application_id}/status', headers=employer,
+                              json={'status': 'accepted'})
+        assert response.status_code == 200, response.get_json()
+        return job_id
+    return hire
+
+
+@pytest.fixture
+def pay(client, queue):
+    """Create a payment for a job and run its task, the function returns the held payment's id"""
+    def pay(employer, job_id, amount=None):
+        data = {'job_id': job_id} if amount is None else {'job_id': job_id, 'amount': amount}
+        response = client.post('/api/payments/create', headers=employer, json=data)
+        assert response.status_code == 202, response.get_json()
+        assert queue._process_next()
+        payment = client.get(f"/api/payments/{response.get_json()['payment']['id']}", headers=employer).get_json()
+        assert payment['payment']['status'] == 'held', payment
+        return payment['payment']['id']
+    return pay
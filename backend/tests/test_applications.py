@@ -0,0 +1,97 @@
+"""Applying to jobs, ranking applicants and bulk status changes"""
+
+import pytest
+
+
+@pytest.fixture
+def job(client, register):
+    """An open Python job, returns (employer headers, job id)"""
+    employer, _ = register('employer')
+    response = client.post('/api/jobs', headers=employer, json={
+        'title': 'Build an API', 'description': 'Flask and SQL', 'budget': 40000,
+        'required_skills': ['Python', 'Flask', 'SQL'], 'job_type': 'fixed', 'experience_level': 'expert'
+    })
+    return employer, response.get_json()['job']['id']
+
+
+@pytest.fixture
+def apply(client, register):
+    """Register a freelancer with the skills and apply, the function returns (headers, application id)"""
+    def apply(job_id, skills=None, rate=40000):
+        freelancer, _ = register('freelancer')
+        if skills is not None:
+            client.post('/api/freelancer/profile', headers=freelancer, json={
+                'title': 'Developer', 'skills': skills, 'experience_years': 6, 'hourly_rate': 1500
+            })
+        response = client.post(f'/api/jobs/{job_id}/apply', headers=freelancer, json={'proposed_rate': rate})
+        assert response.status_code == 201, response.get_json()
+        return freelancer, response.get_json()['application']['id']
+    return apply
+
+
+def test_applying_twice_is_a_conflict(client, job, apply):
+    _, job_id = job
+    freelancer, _ = apply(job_id)
+
+    response = client.post(f'/api/jobs/{job_id}/apply', headers=freelancer, json={'proposed_rate': 1})
+    assert response.status_code == 409
+    assert client.get(f'/api/jobs/{job_id}').get_json()['applications_count'] == 1
+
+
+def test_applications_rank_by_match_score(client, job, apply):
+    employer, job_id = job
+    _, weak = apply(job_id, skills=['Photoshop'])
+    _, strong = apply(job_id, skills=['Python', 'Flask', 'SQL'])
+    _, none = apply(job_id)  # No profile, scored 0
+
+    response = client.get(f'/api/jobs/{job_id}/applications', headers=employer,
+                          query_string={'sort': 'match', 'fields': 'id,match_score'})
+    applications = response.get_json()['applications']
+    assert [a['id'] for a in applications] == [strong, weak, none]
+    assert applications[0]['match_score'] > applications[1]['match_score'] > applications[2]['match_score'] == 0
+
+    # Paged through the same order
+    first = client.get(f'/api/jobs/{job_id}/applications', headers=employer,
+                       query_string={'sort': 'match', 'limit': 2}).get_json()
+    rest = client.get(f'/api/jobs/{job_id}/applications', headers=employer,
+                      query_string={'sort': 'match', 'limit': 2, 'cursor': first['next_cursor']}).get_json()
+    assert [a['id'] for a in first['applications'] + rest['applications']] == [strong, weak, none]
+    assert rest['next_cursor'] is None
+
+
+def test_accepting_one_rejects_the_rest(client, job, apply):
+    employer, job_id = job
+    application_ids = [apply(job_id)[1] for _ in range(3)]
+
+    response = client.put('/api/applications/status', headers=employer, json={
+        'application_ids': [application_ids[1]], 'status': 'accepted', 'reject_others': True
+    })
+    assert response.status_code == 200, response.get_json()
+    assert (response.get_json()['updated'], response.get_json()['auto_rejected']) == (1, 2)
+
+    statuses = {a['id']: a['status'] for a in client.get(
+        f'/api/jobs/{job_id}/applications', headers=employer, query_string={'fields': 'id,status'}
+    ).get_json()['applications']}
+    assert statuses == {application_ids[0]: 'rejected', application_ids[1]: 'accepted',
+                        application_ids[2]: 'rejected'}
+    assert client.get(f'/api/jobs/{job_id}').get_json()['status'] == 'in_progress'
+
+
+def test_bulk_status_checks_every_application(client, register, job, apply):
+    employer, job_id = job
+    _, application_id = apply(job_id)
+    other_employer, _ = register('employer')
+
+    response = client.put('/api/applications/status', headers=other_employer, json={
+        'application_ids': [application_id], 'status': 'rejected'
+    })
+    assert response.status_code == 403
+
+    response = client.put('/api/applications/status', headers=employer, json={
+        'application_ids': [application_id, 10 ** 9], 'status': 'rejected'
+    })
+    assert (response.status_code, response.get_json()['application_ids']) == (404, [10 ** 9])
+
+    # Nothing was changed by the refused requests
+    application = client.get(f'/api/jobs/{job_id}/applications', headers=employer).get_json()['applications'][0]
+    assert application['status'] == 'pending'
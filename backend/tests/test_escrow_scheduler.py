@@ -0,0 +1,74 @@
+"""Automatic release of undisputed escrow payments"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import payment_service
+from escrow_scheduler import EscrowScheduler
+from models import db, Payment
+
+
+@pytest.fixture
+def scheduler():
+    """A scheduler ticked by the test instead of its thread"""
+    scheduler = EscrowScheduler(release_after_days=14, batch_size=2)
+    scheduler._release = payment_service.release_payments
+    return scheduler
+
+
+@pytest.fixture
+def held(client, register, hire, pay):
+    """Four held payments of one employer, returns (employer headers, payment ids)"""
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    return employer, [pay(employer, hire(employer, freelancer)) for _ in range(4)]
+
+
+def _held_since(payment_ids, days):
+    Payment.query.filter(Payment.id.in_(payment_ids)).update(
+        {'completed_at': datetime.utcnow() - timedelta(days=days)}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _statuses(payment_ids):
+    db.session.expire_all()
+    return [db.session.get(Payment, payment_id).status for payment_id in payment_ids]
+
+
+def test_due_payments_are_released_in_batches(client, held, scheduler):
+    employer, payment_ids = held
+    _held_since(payment_ids[:3], days=15)
+    assert client.post(f'/api/payments/{payment_ids[2]}/dispute', headers=employer).status_code == 200
+
+    scheduler._tick()
+
+    assert _statuses(payment_ids) == ['completed', 'completed', 'held', 'held']
+    metrics = scheduler.metrics()
+    assert (metrics['released'], metrics['batches'], metrics['scheduled']) == (2, 1, 0)
+
+
+def test_payments_changed_after_loading_are_left_alone(client, held, scheduler):
+    employer, payment_ids = held
+    _held_since(payment_ids[:2], days=15)
+    scheduler._load()
+    assert scheduler.metrics()['scheduled'] == 2
+
+    # Refunded by hand while waiting in the heap
+    client.post('/api/payments/refund', headers=employer, json={'payment_ids': [payment_ids[0]]})
+    scheduler._tick()
+
+    assert _statuses(payment_ids[:2]) == ['refunded', 'completed']
+    assert scheduler.metrics()['released'] == 1
+
+
+def test_payments_due_soon_wait_in_the_heap(held, scheduler):
+    _, payment_ids = held
+    _held_since(payment_ids[:1], days=14 - 1 / 48)  # Due in half an hour
+
+    scheduler._tick()
+
+    assert _statuses(payment_ids[:1]) == ['held']
+    assert scheduler.metrics()['scheduled'] == 1
+    assert 1700 <= scheduler._seconds_until_next() <= 1800
@@ -0,0 +1,66 @@
+"""Serialized JSON fragment cache"""
+
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import db, fragment_cache
+from models import Application
+
+
+def _open_job(client, employer, freelancer):
+    """An open job with one application, returns the job and application ids"""
+    response = client.post('/api/jobs', headers=employer, json={
+        'title': 'Tune a Postgres database', 'description': 'Indexes and plans', 'budget': 18000,
+        'required_skills': ['SQL'], 'job_type': 'fixed'
+    })
+    job_id = response.get_json()['job']['id']
+    response = client.post(f'/api/jobs/{job_id}/apply', headers=freelancer, json={'proposed_rate': 18000})
+    return job_id, response.get_json()['application']['id']
+
+
+def _job(client, job_id):
+    jobs = client.get('/api/jobs').get_json()['jobs']
+    return next(job for job in jobs if job['id'] == job_id)
+
+
+def test_fragments_follow_writes_from_other_processes(app_context, client, register):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    job_id, _ = _open_job(client, employer, freelancer)
+    assert _job(client, job_id)['applications_count'] == 1
+
+    # Written on a connection of its own, no session event sees these
+    _, other_id = register('freelancer')
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            'INSERT INTO applications (job_id, freelancer_id, status, match_score, created_at, updated_at) '
+            "VALUES (:job_id, :freelancer_id, 'pending', 0, :now, :now)"
+        ), {'job_id': job_id, 'freelancer_id': other_id, 'now': datetime.utcnow()})
+        connection.execute(text("UPDATE users SET name = 'Renamed employer', updated_at = :now "
+                                'WHERE id = (SELECT employer_id FROM jobs WHERE id = :job_id)'),
+                           {'job_id': job_id, 'now': datetime.utcnow()})
+
+    job = _job(client, job_id)
+    assert job['applications_count'] == 2
+    assert job['employer']['name'] == 'Renamed employer'
+
+
+def test_bulk_update_evicts_only_the_matched_rows(app_context, client, register):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    job_id, application_id = _open_job(client, employer, freelancer)
+    _, other_application_id = _open_job(client, employer, freelancer)
+    application_ids = [application_id, other_application_id]
+    client.get('/api/jobs')
+    for application in Application.query.filter(Application.id.in_(application_ids)):
+        fragment_cache.fragment(application)
+
+    Application.query.filter(Application.id == application_ids[0]).update(
+        {'status': 'rejected'}, synchronize_session=False
+    )
+    db.session.commit()
+
+    assert ('Application', application_ids[0]) not in fragment_cache._dependents
+    assert ('Application', application_ids[1]) in fragment_cache._dependents
+    assert ('Job', job_id) in fragment_cache._dependents
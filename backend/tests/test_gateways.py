@@ -0,0 +1,152 @@
+"""Pooled HTTP gateway connections and routing across gateways"""
+
+import http.client
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import gateways
+from gateways import GatewayRouter, GatewayUnavailable, HttpGateway, UnsupportedPaymentMethod
+
+
+class FakeConnection:
+    """Answers every request with the next scripted response or exception"""
+
+    def __init__(self, script):
+        self.script = script
+        self.closed = False
+
+    def request(self, method, path, body, headers):
+        pass
+
+    def getresponse(self):
+        outcome = self.script.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        status, body = outcome
+        return SimpleNamespace(status=status, read=lambda: body)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def gateway():
+    gateway = HttpGateway('acme', 'http://gateway.test/v1')
+    gateway.script = []
+    gateway.opened = []
+
+    def connect(host, timeout):
+        connection = FakeConnection(gateway.script)
+        gateway.opened.append(connection)
+        return connection
+    gateway._connection_class = connect
+    return gateway
+
+
+def _payment():
+    return SimpleNamespace(transaction_id='TXN-1', amount=100.0, currency='INR', payment_method='upi')
+
+
+def test_connections_are_reused(gateway):
+    gateway.script += [(200, b'{"status": "approved"}'), (200, b'{"status": "declined"}')]
+
+    assert gateway.charge(_payment()) is True
+    assert gateway.charge(_payment()) is False
+    assert len(gateway.opened) == 1
+
+
+@pytest.mark.parametrize('error, raised', [
+    (http.client.RemoteDisconnected('closed'), GatewayUnavailable),
+    (ConnectionResetError(), GatewayUnavailable),
+    (ValueError('garbled'), ValueError),
+    (KeyboardInterrupt(), KeyboardInterrupt)
+])
+def test_a_failed_connection_is_never_pooled(gateway, error, raised):
+    gateway.script += [error, (200, b'{"status": "approved"}')]
+
+    with pytest.raises(raised):
+        gateway.charge(_payment())
+    assert gateway.opened[0].closed
+
+    assert gateway.charge(_payment()) is True
+    assert len(gateway.opened) == 2
+
+
+def test_server_errors_and_bad_bodies_keep_the_connection(gateway):
+    gateway.script += [(503, b''), (200, b'not json'), (402, b'')]
+
+    with pytest.raises(GatewayUnavailable):
+        gateway.charge(_payment())
+    with pytest.raises(GatewayUnavailable):
+        gateway.charge(_payment())
+    assert gateway.charge(_payment()) is False
+    assert len(gateway.opened) == 1
+
+
+class StubGateway:
+    """Approves every charge until told to fail"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def charge(self, payment):
+        if self.fail:
+            raise GatewayUnavailable('down')
+        return True
+
+
+@pytest.fixture
+def router(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(gateways, 'time', SimpleNamespace(monotonic=lambda: clock.now, perf_counter=time.perf_counter))
+    router = GatewayRouter(
+        {'cheap': StubGateway(), 'pricey': StubGateway(), 'cards': StubGateway()},
+        fees={'cheap': 1.5, 'pricey': 2.0, 'cards': 1.0},
+        methods={'cheap': ['upi', 'card'], 'pricey': ['upi', 'card'], 'cards': ['card']},
+        failure_threshold=2, cooldown_seconds=30
+    )
+    router.clock = clock
+    return router
+
+
+def _route(router, method='upi'):
+    gateway = router.select(method)
+    try:
+        router.charge(gateway, _payment())
+    except GatewayUnavailable:
+        pass
+    return gateway
+
+
+def test_router_picks_the_cheapest_gateway_for_the_method(router):
+    assert router.select('upi') == 'cheap'
+    assert router.select('CARD') == 'cards'
+    with pytest.raises(UnsupportedPaymentMethod):
+        router.select('crypto')
+
+
+def test_open_breaker_routes_around_a_failing_gateway(router):
+    router.gateways['cheap'].fail = True
+    assert [_route(router) for _ in range(3)] == ['cheap', 'cheap', 'pricey']
+    assert router.metrics()['cheap']['circuit'] == 'open'
+
+    # One probe after the cooldown, its success closes the breaker
+    router.clock.now += 30
+    router.gateways['cheap'].fail = False
+    assert router.select('upi') == 'cheap'
+    assert router.select('upi') == 'pricey'  # The probe is still in flight
+    router.charge('cheap', _payment())
+    assert router.metrics()['cheap']['circuit'] == 'closed'
+    assert router.select('upi') == 'cheap'
+
+
+def test_router_gives_up_when_every_gateway_is_open(router):
+    for gateway in router.gateways.values():
+        gateway.fail = True
+    for _ in range(4):
+        _route(router)
+
+    with pytest.raises(GatewayUnavailable):
+        router.select('upi')
@@ -0,0 +1,60 @@
+"""Idempotency keys on payment creation"""
+
+from datetime import datetime, timedelta
+
+from app import db, idempotency_service
+from models import IdempotencyKey, Payment
+
+
+def _create(client, employer, job_id, key):
+    return client.post('/api/payments/create', json={'job_id': job_id},
+                       headers=dict(employer, **{'Idempotency-Key': key}))
+
+
+def test_retry_replays_the_stored_response(app_context, client, register, hire):
+    employer, employer_id = register('employer')
+    freelancer, _ = register('freelancer')
+    job_id = hire(employer, freelancer)
+
+    first = _create(client, employer, job_id, 'create-1')
+    retry = _create(client, employer, job_id, 'create-1')
+
+    assert first.status_code == retry.status_code == 202
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert Payment.query.filter_by(employer_id=employer_id).count() == 1
+
+
+def test_key_reused_for_another_request_is_refused(app_context, client, register, hire):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+
+    assert _create(client, employer, hire(employer, freelancer), 'create-2').status_code == 202
+    assert _create(client, employer, hire(employer, freelancer), 'create-2').status_code == 422
+
+
+def test_retry_takes_over_a_key_whose_request_died(app_context, client, register, hire, monkeypatch):
+    employer, employer_id = register('employer')
+    freelancer, _ = register('freelancer')
+    job_id = hire(employer, freelancer)
+
+    # The process died after running the view, before storing its response
+    with monkeypatch.context() as patched:
+        patched.setattr(idempotency_service, '_complete', lambda record_id, response: None)
+        assert _create(client, employer, job_id, 'create-3').status_code == 202
+
+    claimed = _create(client, employer, job_id, 'create-3')
+    assert claimed.status_code == 409
+    assert claimed.headers['Retry-After'] == '1'
+
+    IdempotencyKey.query.filter_by(user_id=employer_id, key='create-3').update(
+        {'locked_until': datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.session.commit()
+    taken_over = _create(client, employer, job_id, 'create-3')
+    assert taken_over.status_code == 202
+    assert 'Idempotent-Replayed' not in taken_over.headers
+
+    replayed = _create(client, employer, job_id, 'create-3')
+    assert replayed.headers['Idempotent-Replayed'] == 'true'
+    assert replayed.get_json() == taken_over.get_json()
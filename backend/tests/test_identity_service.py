@@ -0,0 +1,33 @@
+"""Token versions and the identity cache"""
+
+from app import identity_service
+from models import db, User
+
+
+def _cached(user_id):
+    return identity_service._cache.get(user_id)
+
+
+def test_bump_invalidates_the_cache_after_commit(client, register, app_context):
+    headers, user_id = register('employer')
+    assert client.get('/api/profile', headers=headers).status_code == 200
+    assert _cached(user_id) is not None
+
+    user = db.session.get(User, user_id)
+    identity_service.bump(user)
+    db.session.flush()
+    # Not committed yet, other requests still see the old version
+    assert _cached(user_id) is not None
+
+    db.session.commit()
+    assert _cached(user_id) is None
+    assert client.get('/api/profile', headers=headers).status_code == 401
+
+
+def test_rolled_back_bump_keeps_tokens_valid(client, register, app_context):
+    headers, user_id = register('freelancer')
+
+    identity_service.bump(db.session.get(User, user_id))
+    db.session.rollback()
+
+    assert client.get('/api/profile', headers=headers).status_code == 200
@@ -0,0 +1,104 @@
+"""Job board reads: conditional GETs, sparse fieldsets, facets and streamed listings"""
+
+import json
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def board(client, register):
+    """Jobs posted at a location of their own, returns (location, employer headers, job ids)"""
+    employer, _ = register('employer')
+    location = f'Town {uuid.uuid4().hex[:8]}'
+    job_ids = []
+    for job_type, budget, skills in [('fixed', 5000, ['Python', 'Flask']),
+                                     ('fixed', 20000, ['Python']),
+                                     ('hourly', 75000, ['React'])]:
+        response = client.post('/api/jobs', headers=employer, json={
+            'title': f'{job_type} job', 'description': 'Details', 'budget': budget,
+            'required_skills': skills, 'job_type': job_type, 'location': location
+        })
+        assert response.status_code == 201, response.get_json()
+        job_ids.append(response.get_json()['job']['id'])
+    return location, employer, job_ids
+
+
+def test_job_is_not_sent_again_while_unchanged(client, register, board):
+    _, _, job_ids = board
+    first = client.get(f'/api/jobs/{job_ids[0]}')
+    assert first.status_code == 200
+    assert first.headers['ETag'] and first.headers['Last-Modified']
+
+    cached = client.get(f'/api/jobs/{job_ids[0]}', headers={'If-None-Match': first.headers['ETag']})
+    assert (cached.status_code, cached.data) == (304, b'')
+    cached = client.get(f'/api/jobs/{job_ids[0]}', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert cached.status_code == 304
+
+    # An application changes applications_count, so the ETag moves
+    freelancer, _ = register('freelancer')
+    client.post(f'/api/jobs/{job_ids[0]}/apply', headers=freelancer, json={'proposed_rate': 5000})
+    fresh = client.get(f'/api/jobs/{job_ids[0]}', headers={'If-None-Match': first.headers['ETag']})
+    assert fresh.status_code == 200
+    assert fresh.headers['ETag'] != first.headers['ETag']
+    assert fresh.get_json()['applications_count'] == 1
+
+
+def test_job_list_is_not_sent_again_while_unchanged(client, board):
+    location, employer, job_ids = board
+    first = client.get('/api/jobs', query_string={'location': location})
+    cached = client.get('/api/jobs', query_string={'location': location},
+                        headers={'If-None-Match': first.headers['ETag']})
+    assert cached.status_code == 304
+
+    client.put(f'/api/jobs/{job_ids[0]}', headers=employer, json={'title': 'Renamed'})
+    fresh = client.get('/api/jobs', query_string={'location': location},
+                       headers={'If-None-Match': first.headers['ETag']})
+    assert fresh.status_code == 200
+    assert 'Renamed' in [job['title'] for job in fresh.get_json()['jobs']]
+
+
+def test_sparse_fields_and_expansion(client, board):
+    _, _, job_ids = board
+
+    job = client.get(f'/api/jobs/{job_ids[0]}', query_string={'fields': 'id,title'}).get_json()
+    assert job == {'id': job_ids[0], 'title': 'fixed job'}
+
+    job = client.get(f'/api/jobs/{job_ids[0]}', query_string={'fields': 'id,employer.name'}).get_json()
+    assert job == {'id': job_ids[0], 'employer': {'name': 'Test employer'}}
+
+    job = client.get(f'/api/jobs/{job_ids[0]}', query_string={'expand': ''}).get_json()
+    assert 'employer' not in job and job['budget'] == 5000
+
+    jobs = client.get('/api/jobs', query_string={'location': board[0], 'fields': 'id,applications_count'})
+    assert jobs.get_json()['jobs'] == [{'id': i, 'applications_count': 0} for i in reversed(job_ids)]
+
+
+def test_facets_count_the_alternatives_to_each_filter(client, board):
+    location, employer, _ = board
+
+    facets = client.get('/api/jobs/facets', query_string={'location': location, 'job_type': 'fixed'}).get_json()
+    assert facets['total'] == 2
+    assert facets['facets']['job_type'] == [{'value': 'fixed', 'count': 2}, {'value': 'hourly', 'count': 1}]
+    assert {band['value']: band['count'] for band in facets['facets']['budget']} == {
+        'under_10k': 1, '10k_50k': 1, '50k_1l': 0, '1l_5l': 0, '5l_plus': 0
+    }
+    assert facets['facets']['skills'] == [{'value': 'Python', 'count': 2}, {'value': 'Flask', 'count': 1}]
+
+    # A new job is counted at once, never served from the cache
+    client.post('/api/jobs', headers=employer, json={
+        'title': 'Another', 'description': 'Details', 'budget': 9000,
+        'required_skills': ['Python'], 'job_type': 'fixed', 'location': location
+    })
+    facets = client.get('/api/jobs/facets', query_string={'location': location, 'job_type': 'fixed'}).get_json()
+    assert facets['total'] == 3
+
+
+def test_streamed_listing_matches_the_buffered_one(client, board):
+    location, _, _ = board
+    buffered = client.get('/api/jobs', query_string={'location': location}).get_json()
+
+    response = client.get('/api/jobs', query_string={'location': location, 'stream': '1'})
+    assert response.is_streamed
+    assert json.loads(response.get_data()) == buffered
+    assert buffered['count'] == 3
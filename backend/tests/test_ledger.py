@@ -0,0 +1,72 @@
+"""Payment lifecycle against the double-entry ledger"""
+
+from app import ledger_service
+from ledger_service import EMPLOYER_ESCROW, EMPLOYER_FUNDING, EMPLOYER_SPENT, FREELANCER_EARNINGS
+from models import db, JournalEntry
+from money import to_paise
+
+
+def test_lifecycle_keeps_the_ledger_balanced(client, register, hire, pay):
+    employer, employer_id = register('employer')
+    freelancer, freelancer_id = register('freelancer')
+
+    released = pay(employer, hire(employer, freelancer), 12500.55)
+    refunded = pay(employer, hire(employer, freelancer), 999.99)
+    clawed_back = pay(employer, hire(employer, freelancer), 300.10)
+
+    assert client.post(f'/api/payments/{released}/release', headers=employer).status_code == 200
+    assert client.post(f'/api/payments/{clawed_back}/release', headers=employer).status_code == 200
+    response = client.post('/api/payments/refund', headers=employer, json={'payment_ids': [refunded]})
+    assert response.get_json()['succeeded'] == 1
+    response = client.post('/api/payments/refund', headers=freelancer, json={'payment_ids': [clawed_back]})
+    assert response.get_json()['succeeded'] == 1
+
+    result = ledger_service.verify()
+    assert result['ok'], result
+
+    entries = {
+        payment_id: [event for (event,) in JournalEntry.query.with_entities(JournalEntry.event)
+                     .filter_by(payment_id=payment_id).order_by(JournalEntry.id)]
+        for payment_id in (released, refunded, clawed_back)
+    }
+    assert entries == {
+        released: ['held', 'completed'],
+        refunded: ['held', 'refunded'],
+        clawed_back: ['held', 'completed', 'refunded']
+    }
+
+    # Only the released payment is still spent, everything else went back
+    paid = to_paise(12500.55)
+    assert ledger_service.balance(employer_id, EMPLOYER_ESCROW) == 0
+    assert ledger_service.balance(employer_id, EMPLOYER_SPENT) == paid
+    assert ledger_service.balance(employer_id, EMPLOYER_FUNDING) == -paid
+    assert ledger_service.balance(freelancer_id, FREELANCER_EARNINGS) == paid
+
+
+def test_a_payment_cannot_be_released_twice(client, register, hire, pay):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    payment_id = pay(employer, hire(employer, freelancer), 500)
+
+    assert client.post(f'/api/payments/{payment_id}/release', headers=employer).status_code == 200
+    assert client.post(f'/api/payments/{payment_id}/release', headers=employer).status_code == 400
+
+    assert JournalEntry.query.filter_by(payment_id=payment_id, event='completed').count() == 1
+    assert ledger_service.verify()['ok']
+
+
+def test_release_already_in_the_ledger_is_a_conflict(client, register, hire, pay):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    payment_id = pay(employer, hire(employer, freelancer), 500)
+
+    # As if a concurrent release had posted first
+    db.session.add(JournalEntry(payment_id=payment_id, event='completed'))
+    db.session.commit()
+
+    response = client.post(f'/api/payments/{payment_id}/release', headers=employer)
+    assert response.status_code == 409
+    assert client.get(f'/api/payments/{payment_id}', headers=employer).get_json()['payment']['status'] == 'held'
+
+    db.session.query(JournalEntry).filter_by(payment_id=payment_id, event='completed').delete()
+    db.session.commit()
@@ -0,0 +1,20 @@
+"""Access to the runtime metrics"""
+
+import ipaddress
+
+
+def test_metrics_answer_loopback_clients(client):
+    response = client.get('/api/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert response.status_code == 200
+    assert 'payment_queue' in response.get_json()
+
+
+def test_metrics_refuse_other_clients(client):
+    response = client.get('/api/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'})
+    assert response.status_code == 403
+
+
+def test_metrics_allow_configured_networks(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ALLOWED_NETWORKS', [ipaddress.ip_network('10.0.0.0/8')])
+    assert client.get('/api/metrics', environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == 200
+    assert client.get('/api/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
@@ -0,0 +1,32 @@
+"""Schema upgrades of existing databases"""
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from app import db, upgrade_database
+
+
+def test_duplicate_applications_are_removed_before_the_unique_index(scratch_db):
+    db.create_all()
+    with scratch_db.begin() as connection:
+        connection.execute(text('DROP INDEX uq_applications_job_freelancer'))
+        connection.execute(text(
+            'INSERT INTO applications (id, job_id, freelancer_id, status, match_score, created_at) VALUES '
+            "(1, 10, 20, 'pending', 0, :now), (2, 10, 20, 'accepted', 0, :now), (3, 10, 21, 'pending', 0, :now), "
+            "(4, 11, 20, 'pending', 0, :now), (5, 10, 20, 'pending', 0, :now)"
+        ), {'now': datetime(2024, 3, 1)})
+
+    result = upgrade_database()
+
+    assert result['deleted_duplicates'] == {'uq_applications_job_freelancer': 2}
+    with scratch_db.connect() as connection:
+        assert connection.execute(text('SELECT id FROM applications ORDER BY id')).scalars().all() == [1, 3, 4]
+    indexes = {index['name']: index for index in inspect(scratch_db).get_indexes('applications')}
+    assert indexes['uq_applications_job_freelancer']['unique']
+
+
+def test_upgrade_is_a_no_op_on_a_current_database(scratch_db):
+    db.create_all()
+
+    assert upgrade_database() == {'added_columns': [], 'dropped_indexes': [], 'deleted_duplicates': {}}
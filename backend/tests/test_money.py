@@ -0,0 +1,75 @@
+"""Integer paise money and fee rounding"""
+
+import random
+
+import pytest
+
+import money
+from app import payment_service
+from money import percent_of, percent_of_many, to_basis_points, to_paise
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def batch_path(request, monkeypatch):
+    """Run a test once on the NumPy path and once on the plain Python fallback"""
+    if request.param == 'numpy':
+        if money.np is None:
+            pytest.skip('NumPy is not installed')
+    else:
+        monkeypatch.setattr(money, 'np', None)
+        monkeypatch.setattr('payment_service.np', None)
+    return request.param
+
+
+@pytest.mark.parametrize('amount, paise', [
+    ('0.005', 1), ('0.015', 2), (0.125, 13), ('1.004', 100), (999.995, 100000), ('-0.005', -1), (1250, 125000)
+])
+def test_to_paise_rounds_half_up(amount, paise):
+    assert to_paise(amount) == paise
+
+
+@pytest.mark.parametrize('amount', ['abc', None, True, float('nan'), ''])
+def test_to_paise_rejects_non_amounts(amount):
+    with pytest.raises(ValueError):
+        to_paise(amount)
+
+
+@pytest.mark.parametrize('paise, percent, fee', [
+    (5, 10, 1),         # 0.5 paise rounds up
+    (15, 10, 2),        # 1.5 paise rounds up
+    (14, 10, 1),        # 1.4 paise rounds down
+    (25, 2, 1),         # 0.5 paise at 2%
+    (12345, 1.99, 246),  # 245.6655 paise
+    (0, 10, 0),
+])
+def test_percent_of_rounds_half_up(paise, percent, fee):
+    assert percent_of(paise, percent) == fee
+
+
+def test_percent_of_many_matches_percent_of(batch_path):
+    rng = random.Random(45)
+    percents = [0, 1.99, 2, 2.5, 5, 10]
+    amounts = [rng.randrange(0, 10 ** 9) for _ in range(2000)] + [5, 15, 25, 50, 150]
+    chosen = [rng.choice(percents) for _ in amounts]
+
+    batch = percent_of_many(amounts, [to_basis_points(percent) for percent in chosen])
+
+    assert [int(fee) for fee in batch] == [percent_of(a, p) for a, p in zip(amounts, chosen)]
+    assert (batch_path == 'numpy') == (not isinstance(batch, list))
+
+
+def test_batch_fees_match_the_single_payment_helpers(batch_path):
+    amounts = [5, 15, 99999, 1250050, 1]
+    gateways = ['razorpay', 'paytm', 'unknown', 'phonepe', 'razorpay']
+    user_types = ['freelancer', 'employer', 'freelancer', 'employer', 'freelancer']
+
+    batch = payment_service.calculate_fees_batch(amounts, gateways, user_types)
+
+    for index, amount in enumerate(amounts):
+        rupees = amount / 100
+        platform = payment_service.calculate_platform_fee(rupees, user_types[index])
+        assert int(batch['platform_fee'][index]) == to_paise(platform['fee_amount'])
+        assert int(batch['gateway_fee'][index]) == to_paise(payment_service._calculate_fees(rupees, gateways[index]))
+        assert int(batch['net_amount'][index]) == (
+            amount - int(batch['gateway_fee'][index]) - int(batch['platform_fee'][index])
+        )
@@ -0,0 +1,108 @@
+"""Transaction ID node leases and ids"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import node_lease_service as node_leases
+from app import db, node_lease_service
+from id_generator import MAX_NODE_ID, MAX_SEQUENCE, ClockMovedBackwards, TransactionIdGenerator
+from models import NodeLease
+from node_lease_service import NodeIdUnavailable, NodeLeaseService
+
+
+def test_reads_take_no_node_id(app_context, client):
+    node_lease_service.release()
+    leases = NodeLease.query.count()
+
+    assert client.get('/api/jobs').status_code == 200
+    assert node_lease_service.metrics()['node_id'] is None
+    assert NodeLease.query.count() == leases
+
+
+def test_first_transaction_id_leases_a_node_id(queue, client, register, hire):
+    node_lease_service.release()
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    job_id = hire(employer, freelancer)
+    response = client.post('/api/payments/create', headers=employer, json={'job_id': job_id, 'amount': 25000})
+    assert response.status_code == 202, response.get_json()
+    assert node_lease_service.metrics()['node_id'] is None
+
+    # The worker issues the transaction ID
+    assert queue._process_next()
+    node_id = node_lease_service.metrics()['node_id']
+    assert node_id is not None
+    assert db.session.get(NodeLease, node_id) is not None
+
+
+@pytest.fixture
+def leases(app, scratch_db, monkeypatch):
+    """Fresh lease services over an empty node_leases table with two node ids"""
+    db.create_all()
+    monkeypatch.setattr(node_leases, 'MAX_NODE_ID', 1)
+    services = []
+
+    def lease_service(ttl_seconds=60):
+        service = NodeLeaseService(ttl_seconds=ttl_seconds)
+        service.init_app(app)
+        services.append(service)
+        return service
+    yield lease_service
+    for service in services:
+        service.release()
+
+
+def test_node_ids_run_out(leases):
+    first, second = leases().node_id(), leases().node_id()
+
+    assert {first, second} == {0, 1}
+    with pytest.raises(NodeIdUnavailable):
+        leases().node_id()
+
+
+def test_expired_lease_is_taken_over(leases):
+    holder = leases()
+    node_id = holder.node_id()
+    leases().node_id()
+    NodeLease.query.filter_by(node_id=node_id).update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    assert leases().node_id() == node_id
+    # The old holder finds out when it next renews and has nothing left to lease
+    holder._valid_until = 0.0
+    with pytest.raises(NodeIdUnavailable):
+        holder.node_id()
+    assert holder.metrics()['lost'] == 1
+
+
+def test_ids_increase_within_a_millisecond_and_across_the_sequence(monkeypatch):
+    generator = TransactionIdGenerator(node_id=7)
+    clock = iter([1704067200123] * (MAX_SEQUENCE + 2) + [1704067200124] * 2)
+    monkeypatch.setattr(generator, '_now_ms', lambda: next(clock))
+
+    ids = [generator.next_int() for _ in range(MAX_SEQUENCE + 2)]
+
+    assert ids == sorted(set(ids))
+    assert all((value >> 12) & MAX_NODE_ID == 7 for value in ids)
+    # The 4097th id of the millisecond moved on to the next one
+    assert ids[-1] >> 22 == 124
+
+
+def test_ids_sort_as_strings():
+    generator = TransactionIdGenerator(node_id=3)
+    ids = [generator.next_id() for _ in range(1000)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(len(transaction_id) == 16 for transaction_id in ids)
+
+
+def test_clock_stepping_back_is_refused(monkeypatch):
+    generator = TransactionIdGenerator()
+    clock = iter([1704067205000, 1704067200000])
+    monkeypatch.setattr(generator, '_now_ms', lambda: next(clock))
+
+    generator.next_int()
+    with pytest.raises(ClockMovedBackwards):
+        generator.next_int()
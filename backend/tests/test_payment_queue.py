@@ -0,0 +1,159 @@
+"""Retries, backoff and dead tasks of the payment queue"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from app import payment_service, ledger_service
+from gateways import GatewayUnavailable
+from models import db, Payment, PaymentTask, JournalEntry
+
+
+@pytest.fixture
+def gateway_down(monkeypatch):
+    """Every charge fails with a retryable gateway error"""
+    calls = []
+
+    def charge(gateway, payment):
+        calls.append(payment.transaction_id)
+        raise GatewayUnavailable(f'{gateway} returned a server error')
+
+    monkeypatch.setattr(payment_service.router, 'charge', charge)
+    return calls
+
+
+@pytest.fixture
+def queue(queue, monkeypatch):
+    monkeypatch.setattr(queue, 'max_attempts', 3)
+    monkeypatch.setattr(queue, 'backoff_seconds', 10.0)
+    return queue
+
+
+def _create_payment(client, register, hire):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    response = client.post('/api/payments/create', headers=employer, json={'job_id': hire(employer, freelancer)})
+    assert response.status_code == 202, response.get_json()
+    return response.get_json()['payment']['id']
+
+
+def _make_due(payment_id):
+    PaymentTask.query.filter_by(payment_id=payment_id).update({'run_at': datetime.utcnow()})
+    db.session.commit()
+
+
+def test_backoff_doubles_with_jitter_up_to_the_cap(queue, monkeypatch):
+    monkeypatch.setattr(queue, 'max_backoff_seconds', 60.0)
+    for attempts, delay in [(1, 10), (2, 20), (3, 40), (4, 60), (10, 60)]:
+        for _ in range(50):
+            assert delay / 2 <= queue._backoff(attempts) <= delay
+
+
+def test_gateway_errors_are_retried_with_backoff(client, register, hire, gateway_down, queue):
+    payment_id = _create_payment(client, register, hire)
+
+    started = datetime.utcnow()
+    assert queue._process_next()
+
+    task = PaymentTask.query.filter_by(payment_id=payment_id).one()
+    assert (task.state, task.attempts) == ('queued', 1)
+    assert 'server error' in task.last_error
+    assert 5 <= (task.run_at - started).total_seconds() <= 11
+    assert db.session.get(Payment, payment_id).status == 'pending'
+
+    # Not due yet, nothing to claim
+    assert not queue._process_next()
+
+
+def test_retries_reuse_the_transaction_id(client, register, hire, gateway_down, queue):
+    payment_id = _create_payment(client, register, hire)
+
+    for _ in range(2):
+        assert queue._process_next()
+        _make_due(payment_id)
+
+    assert len(gateway_down) == 2
+    assert gateway_down[0] == gateway_down[1] == db.session.get(Payment, payment_id).transaction_id
+
+
+def test_dead_task_fails_the_payment(client, register, hire, gateway_down, queue):
+    payment_id = _create_payment(client, register, hire)
+
+    for _ in range(queue.max_attempts):
+        assert queue._process_next()
+        _make_due(payment_id)
+
+    task = PaymentTask.query.filter_by(payment_id=payment_id).one()
+    assert (task.state, task.attempts) == ('dead', queue.max_attempts)
+    assert db.session.get(Payment, payment_id).status == 'failed'
+    assert not queue._process_next()
+
+    # A failed payment moved no money
+    assert JournalEntry.query.filter_by(payment_id=payment_id).count() == 0
+    assert ledger_service.verify()['ok']
+
+
+def test_recovered_gateway_completes_a_retried_payment(client, register, hire, gateway_down, queue, monkeypatch):
+    payment_id = _create_payment(client, register, hire)
+    assert queue._process_next()
+
+    monkeypatch.setattr(payment_service.router, 'charge', lambda gateway, payment: True)
+    _make_due(payment_id)
+    assert queue._process_next()
+
+    task = PaymentTask.query.filter_by(payment_id=payment_id).one()
+    assert (task.state, task.attempts, task.last_error) == ('done', 2, None)
+    assert db.session.get(Payment, payment_id).status == 'held'
+    assert JournalEntry.query.filter_by(payment_id=payment_id, event='held').count() == 1
+
+
+def test_conflicting_commit_is_retried_at_once(client, register, hire, queue, monkeypatch):
+    payment_id = _create_payment(client, register, hire)
+
+    def charge_while_webhook_arrives(gateway, payment):
+        # The gateway's webhook commits the outcome before the worker does
+        with db.engine.begin() as connection:
+            connection.execute(text("UPDATE payments SET status = 'held' WHERE id = :id"), {'id': payment.id})
+        return True
+    monkeypatch.setattr(payment_service.router, 'charge', charge_while_webhook_arrives)
+
+    started = datetime.utcnow()
+    assert queue._process_next()
+
+    task = PaymentTask.query.filter_by(payment_id=payment_id).one()
+    assert (task.state, task.locked_until) == ('queued', None)
+    assert task.last_error == 'Commit failed: StaleDataError'
+    assert (task.run_at - started).total_seconds() <= 11
+
+    _make_due(payment_id)
+    assert queue._process_next()
+    assert PaymentTask.query.filter_by(payment_id=payment_id).one().state == 'done'
+    assert db.session.get(Payment, payment_id).status == 'held'
+
+
+def test_retry_after_a_failed_commit_reuses_the_transaction_id(client, register, hire, queue, monkeypatch):
+    payment_id = _create_payment(client, register, hire)
+    charged = []
+
+    def charge(gateway, payment):
+        charged.append(payment.transaction_id)
+        if len(charged) == 1:
+            # Posted by another writer, the worker's ledger entry now collides
+            with db.engine.begin() as connection:
+                connection.execute(text("INSERT INTO journal_entries (payment_id, event) VALUES (:id, 'held')"),
+                                   {'id': payment.id})
+        return True
+    monkeypatch.setattr(payment_service.router, 'charge', charge)
+
+    assert queue._process_next()
+    task = PaymentTask.query.filter_by(payment_id=payment_id).one()
+    assert task.state == 'queued'
+    assert db.session.get(Payment, payment_id).transaction_id == charged[0]
+
+    with db.engine.begin() as connection:
+        connection.execute(text('DELETE FROM journal_entries WHERE payment_id = :id'), {'id': payment_id})
+    _make_due(payment_id)
+    assert queue._process_next()
+    assert charged[0] == charged[1]
+    assert db.session.get(Payment, payment_id).status == 'held'
@@ -0,0 +1,88 @@
+"""Payment history and bulk escrow operations"""
+
+import pytest
+
+
+@pytest.fixture
+def payments(client, register, hire, pay):
+    """Three held payments between a fresh employer and freelancer, the oldest one released"""
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    payment_ids = [pay(employer, hire(employer, freelancer), amount) for amount in (100, 200, 300.5)]
+    assert client.post(f'/api/payments/{payment_ids[0]}/release', headers=employer).status_code == 200
+    return employer, freelancer, payment_ids
+
+
+def test_history_pages_newest_first_with_a_summary(client, payments):
+    employer, freelancer, payment_ids = payments
+
+    first = client.get('/api/payments/history', headers=employer, query_string={'limit': 2}).get_json()
+    assert [p['id'] for p in first['payments']] == [payment_ids[2], payment_ids[1]]
+    assert first['summary']['by_status'] == {
+        'held': {'count': 2, 'amount': 500.5},
+        'completed': {'count': 1, 'amount': 100}
+    }
+    [month] = first['summary']['by_month']
+    assert (month['count'], month['amount']) == (3, 600.5)
+
+    rest = client.get('/api/payments/history', headers=employer,
+                      query_string={'limit': 2, 'cursor': first['next_cursor']}).get_json()
+    assert [p['id'] for p in rest['payments']] == [payment_ids[0]]
+    assert rest['next_cursor'] is None and 'summary' not in rest
+
+    # The freelancer sees the same payments from the other side
+    received = client.get('/api/payments/history', headers=freelancer).get_json()
+    assert [p['id'] for p in received['payments']] == payment_ids[::-1]
+
+
+def test_history_filters_by_status(client, payments):
+    employer, _, payment_ids = payments
+
+    response = client.get('/api/payments/history', headers=employer, query_string={'status': 'completed'})
+    history = response.get_json()
+    assert [p['id'] for p in history['payments']] == [payment_ids[0]]
+    assert list(history['summary']['by_status']) == ['completed']
+
+    response = client.get('/api/payments/history', headers=employer, query_string={'status': 'lost'})
+    assert response.status_code == 400
+
+
+def test_bulk_release_reports_every_payment(client, register, hire, pay, payments):
+    employer, _, payment_ids = payments
+    other_employer, _ = register('employer')
+    other_freelancer, _ = register('freelancer')
+    foreign = pay(other_employer, hire(other_employer, other_freelancer))
+
+    response = client.post('/api/payments/release', headers=employer,
+                           json={'payment_ids': payment_ids + [foreign, 10 ** 9]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['succeeded'], body['failed']) == (2, 3)
+    assert [(r['payment_id'], r['success']) for r in body['results']] == [
+        (payment_ids[0], False), (payment_ids[1], True), (payment_ids[2], True), (foreign, False), (10 ** 9, False)
+    ]
+    assert [r['message'] for r in body['results'] if not r['success']] == [
+        'Payment cannot be released', 'Unauthorized', 'Payment not found'
+    ]
+    assert body['results'][1]['status'] == 'completed'
+    assert client.get(f'/api/payments/{foreign}', headers=other_employer).get_json()['payment']['status'] == 'held'
+
+
+def test_bulk_refund_depends_on_who_asks(client, payments):
+    employer, freelancer, payment_ids = payments
+
+    # Employers refund from escrow only, freelancers can also give back released money
+    response = client.post('/api/payments/refund', headers=employer, json={'payment_ids': payment_ids[:2]})
+    assert [r['success'] for r in response.get_json()['results']] == [False, True]
+    response = client.post('/api/payments/refund', headers=freelancer, json={'payment_ids': [payment_ids[0]]})
+    assert response.get_json()['results'][0]['status'] == 'refunded'
+
+
+def test_bulk_release_replays_a_retried_request(client, payments):
+    employer, _, payment_ids = payments
+    headers = dict(employer, **{'Idempotency-Key': 'bulk-release-1'})
+
+    first = client.post('/api/payments/release', headers=headers, json={'payment_ids': payment_ids[1:]})
+    again = client.post('/api/payments/release', headers=headers, json={'payment_ids': payment_ids[1:]})
+    assert first.get_json()['succeeded'] == 2
+    assert again.get_json() == first.get_json()
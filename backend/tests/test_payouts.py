@@ -0,0 +1,104 @@
+"""Batch payouts"""
+
+import csv
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, payment_service
+from models import Payment, Payout, PayoutRun, User
+from payout_service import PayoutService
+
+
+@pytest.fixture
+def released(scratch_db):
+    """Freelancers with released payments in a database of their own, returns {freelancer id: amounts}"""
+    db.create_all()
+    employer = User(email='employer@example.com', password_hash='x', name='Employer', user_type='employer')
+    freelancers = [User(email=f'freelancer{n}@example.com', password_hash='x', name=f'Freelancer {n}',
+                        user_type='freelancer') for n in range(3)]
+    db.session.add_all([employer] + freelancers)
+    db.session.flush()
+
+    amounts = {
+        freelancers[0].id: [0.05, 0.05, 0.05],  # 0.5 paise of fee each
+        freelancers[1].id: [1000.0, 2499.95],
+        freelancers[2].id: [0.15],
+    }
+    released_at = datetime.utcnow() - timedelta(days=1)
+    for freelancer_id, payments in amounts.items():
+        for amount in payments:
+            db.session.add(Payment(job_id=1, employer_id=employer.id, freelancer_id=freelancer_id, amount=amount,
+                                   status='completed', completed_at=released_at, released_at=released_at))
+    # Backfilled as completed before released_at was recorded
+    db.session.add(Payment(job_id=1, employer_id=employer.id, freelancer_id=freelancers[2].id, amount=10.0,
+                           status='completed'))
+    amounts[freelancers[2].id].append(10.0)
+    # Not released, not paid out
+    db.session.add(Payment(job_id=1, employer_id=employer.id, freelancer_id=freelancers[2].id, amount=50.0,
+                           status='held'))
+    db.session.commit()
+    return amounts
+
+
+def _fee(amount):
+    return round(payment_service.calculate_platform_fee(amount)['fee_amount'] * 100)
+
+
+def test_payout_fees_are_taken_per_payment(released, tmp_path):
+    payout_run = PayoutService(payment_service, output_dir=str(tmp_path)).run()
+
+    payouts = {payout.freelancer_id: payout for payout in Payout.query.filter_by(run_id=payout_run.id)}
+    assert set(payouts) == set(released)
+    for freelancer_id, amounts in released.items():
+        payout = payouts[freelancer_id]
+        assert payout.payments_count == len(amounts)
+        assert payout.gross_amount == round(sum(amounts) * 100)
+        assert payout.fee_amount == sum(_fee(amount) for amount in amounts)
+        assert payout.net_amount == payout.gross_amount - payout.fee_amount
+    # Three 5 paise payments pay 1 paisa of fee each, not 2 paise on their 15 paise total
+    assert payouts[min(released)].fee_amount == 3
+    assert Payment.query.filter(Payment.payout_id.is_(None), Payment.status == 'completed').count() == 0
+
+
+def test_crashed_run_resumes_from_its_checkpoint(released, tmp_path, monkeypatch):
+    service = PayoutService(payment_service, output_dir=str(tmp_path), chunk_size=1)
+    run_chunk = service._run_chunk
+    calls = []
+
+    def crash_on_second_chunk(payout_run):
+        calls.append(payout_run.checkpoint_freelancer_id)
+        if len(calls) == 2:
+            raise RuntimeError('worker killed')
+        return run_chunk(payout_run)
+    monkeypatch.setattr(service, '_run_chunk', crash_on_second_chunk)
+
+    with pytest.raises(RuntimeError):
+        service.run()
+    db.session.rollback()
+    crashed = PayoutRun.query.one()
+    assert crashed.status == 'running'
+    assert crashed.checkpoint_freelancer_id == min(released)
+    assert crashed.payouts_count == 1
+
+    monkeypatch.setattr(service, '_run_chunk', run_chunk)
+    payout_run = service.run()
+
+    assert payout_run.id == crashed.id
+    assert payout_run.status == 'completed'
+    assert payout_run.payouts_count == len(released)
+    assert Payout.query.count() == len(released)
+    assert payout_run.payments_count == sum(len(amounts) for amounts in released.values())
+
+
+def test_bank_file_adds_up_to_the_run(released, tmp_path):
+    payout_run = PayoutService(payment_service, output_dir=str(tmp_path)).run()
+
+    with open(payout_run.bank_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    assert len(rows) == payout_run.payouts_count == len(released)
+    assert sum(round(float(row['amount']) * 100) for row in rows) == payout_run.net_amount
+    assert payout_run.gross_amount == payout_run.fee_amount + payout_run.net_amount
+    assert {int(row['beneficiary_id']) for row in rows} == set(released)
+    assert len({row['reference'] for row in rows}) == len(rows)
@@ -0,0 +1,82 @@
+"""Query plan audit mode and the indexes of the hot queries"""
+
+import pytest
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, event, text
+
+from app import db
+from query_audit import QueryAuditService
+
+
+@pytest.fixture
+def audited(tmp_path):
+    """A small app with QUERY_AUDIT on, one route scanning its table and one using an index"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}")
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE jobs (id INTEGER PRIMARY KEY, status TEXT, budget INTEGER)'))
+        connection.execute(text('CREATE INDEX ix_jobs_status_id ON jobs (status, id)'))
+
+    app = Flask(__name__)
+    app.config['QUERY_AUDIT'] = True
+    audit = QueryAuditService()
+    audit.init_app(app, engine)
+
+    @app.route('/by-budget')
+    def by_budget():
+        with engine.connect() as connection:
+            rows = connection.execute(text('SELECT id FROM jobs WHERE budget > :b ORDER BY budget'), {'b': 10})
+            return jsonify(list(rows.scalars()))
+
+    @app.route('/open')
+    def open_jobs():
+        with engine.connect() as connection:
+            rows = connection.execute(text("SELECT id FROM jobs WHERE status = 'open' ORDER BY id"))
+            return jsonify(list(rows.scalars()))
+
+    yield app.test_client(), audit
+    engine.dispose()
+
+
+def test_audit_reports_scans_and_sorts_per_route(audited):
+    client, audit = audited
+    for _ in range(3):
+        client.get('/by-budget')
+    client.get('/open')
+
+    routes = audit.report()['routes']
+    scan = routes['GET /by-budget']
+    assert (scan['requests'], scan['statements'], scan['full_scans'], scan['temp_btrees']) == (3, 1, 1, 1)
+    assert scan['details'][0]['executions'] == 3
+    assert scan['details'][0]['full_scans'] == ['jobs']
+    indexed = routes['GET /open']
+    assert (indexed['full_scans'], indexed['temp_btrees']) == (0, 0)
+
+    audit.reset()
+    assert audit.report()['routes'] == {}
+
+
+def test_hot_routes_use_their_indexes(app_context, client, register, hire, pay):
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    job_id = hire(employer, freelancer)
+    pay(employer, job_id)
+
+    audit = QueryAuditService()
+    event.listen(db.engine, 'after_cursor_execute', audit._after_cursor_execute)
+    try:
+        client.get(f'/api/jobs/{job_id}/applications', headers=employer, query_string={'sort': 'match'})
+        client.get('/api/payments/history', headers=employer)
+        client.get('/api/jobs')
+        client.get('/api/jobs/facets')
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', audit._after_cursor_execute)
+
+    routes = audit.report()['routes']
+    assert set(routes) == {'GET /api/jobs/<int:job_id>/applications', 'GET /api/payments/history',
+                           'GET /api/jobs', 'GET /api/jobs/facets'}
+    for route, data in routes.items():
+        assert data['full_scans'] == 0, (route, [d for d in data['details'] if d['full_scans']])
+
+
+def test_audit_endpoint_is_off_unless_enabled(client):
+    assert client.get('/api/debug/query-audit').status_code == 404
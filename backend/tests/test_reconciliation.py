@@ -0,0 +1,101 @@
+"""Settlement reconciliation"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable
+
+from app import db, reconciliation_service, upgrade_database
+from models import Payment, ReconciliationItem
+from reconciliation_service import ReconciliationService
+
+# Columns declared FLOAT, in rupees, before the move to paise
+LEGACY_COLUMNS = {'jobs': 'budget', 'payments': 'amount'}
+
+
+@pytest.fixture
+def legacy_db(scratch_db):
+    """A database created before the move to paise, upgraded by upgrade-db"""
+    with scratch_db.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            ddl = str(CreateTable(table).compile(scratch_db))
+            if table.name in LEGACY_COLUMNS:
+                column = LEGACY_COLUMNS[table.name]
+                ddl = ddl.replace(f'{column} BIGINT', f'{column} FLOAT')
+            connection.execute(text(ddl))
+        connection.execute(text(
+            "INSERT INTO payments (job_id, employer_id, freelancer_id, amount, currency, transaction_id, status, "
+            "payment_gateway, created_at) VALUES "
+            "(1, 1, 2, 999.99, 'INR', 'TXN-LEGACY-1', 'held', 'razorpay', :created_at), "
+            "(1, 1, 2, 1250.5, 'INR', 'TXN-LEGACY-2', 'held', 'razorpay', :created_at)"
+        ), {'created_at': datetime(2024, 1, 10, 12)})
+    upgrade_database()
+    return scratch_db
+
+
+@pytest.fixture
+def window_payments(scratch_db):
+    """Payments of a settlement window on 2024-03-01, and one created just before it"""
+    db.create_all()
+    created_at = datetime(2024, 3, 1, 12)
+    for transaction_id, amount, status, gateway in [
+        ('TXN-OK', 100.0, 'held', 'razorpay'),
+        ('TXN-AMOUNT', 200.0, 'completed', 'razorpay'),
+        ('TXN-STATUS', 300.0, 'failed', 'razorpay'),
+        ('TXN-UNSETTLED', 400.0, 'held', 'razorpay'),
+        ('TXN-OTHER-GATEWAY', 500.0, 'held', 'paytm'),
+        ('TXN-NEVER-CHARGED', 600.0, 'failed', 'razorpay')
+    ]:
+        db.session.add(Payment(job_id=1, employer_id=1, freelancer_id=2, amount=amount, status=status,
+                               transaction_id=transaction_id, payment_gateway=gateway, created_at=created_at))
+    db.session.add(Payment(job_id=1, employer_id=1, freelancer_id=2, amount=700.0, status='held',
+                           transaction_id='TXN-EARLIER', payment_gateway='razorpay',
+                           created_at=datetime(2024, 2, 29, 23, 59)))
+    db.session.commit()
+
+
+def _settlements(tmp_path, rows):
+    path = tmp_path / 'settlements.csv'
+    path.write_text('transaction_id,amount,status\n' + ''.join(f'{row}\n' for row in rows))
+    return str(path)
+
+
+def test_reconcile_converted_legacy_database(legacy_db, tmp_path):
+    stored = legacy_db.connect().execute(text('SELECT typeof(amount) FROM payments')).scalars().all()
+    assert stored == ['real', 'real']
+
+    path = _settlements(tmp_path, ['TXN-LEGACY-1,999.99,settled', 'TXN-LEGACY-2,1250.00,settled'])
+    run = reconciliation_service.run(path, datetime(2024, 1, 10), datetime(2024, 1, 11))
+
+    assert run.status == 'completed'
+    assert run.matched == 1
+    assert run.mismatch_counts == {'amount_mismatch': 1}
+    item = ReconciliationItem.query.filter_by(run_id=run.id).one()
+    assert (item.transaction_id, item.settlement_amount, item.payment_amount) == ('TXN-LEGACY-2', 125000, 125050)
+
+
+def test_reconcile_reports_every_kind_of_mismatch(window_payments, tmp_path):
+    path = _settlements(tmp_path, [
+        'TXN-OK,100.00,settled',
+        'TXN-OK,100.00,settled',
+        'TXN-AMOUNT,250.00,settled',
+        'TXN-STATUS,300.00,captured',
+        'TXN-EARLIER,700.00,settled',
+        'TXN-UNKNOWN,50.00,settled',
+        ',10.00,settled',
+        'TXN-BAD,ten,settled'
+    ])
+    # Partitions of two rows, so the join runs over several of them
+    service = ReconciliationService(work_dir=str(tmp_path), partition_rows=2)
+    run = service.run(path, datetime(2024, 3, 1), datetime(2024, 3, 2), gateway='razorpay')
+
+    assert (run.status, run.rows_read, run.matched) == ('completed', 8, 2)
+    assert run.mismatch_counts == {'duplicate': 1, 'amount_mismatch': 1, 'status_mismatch': 1,
+                                   'missing_payment': 1, 'missing_settlement': 1, 'invalid_row': 2}
+    items = ReconciliationItem.query.filter_by(run_id=run.id)
+    assert sorted((item.kind, item.transaction_id or '', item.line_number or 0) for item in items) == [
+        ('amount_mismatch', 'TXN-AMOUNT', 4), ('duplicate', 'TXN-OK', 3), ('invalid_row', '', 8),
+        ('invalid_row', '', 9), ('missing_payment', 'TXN-UNKNOWN', 7), ('missing_settlement', 'TXN-UNSETTLED', 0),
+        ('status_mismatch', 'TXN-STATUS', 5)
+    ]
@@ -0,0 +1,45 @@
+"""Token revocation behind the Bloom filter"""
+
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import decode_token
+
+from app import revocation_service
+from models import db, RevokedToken
+from revocation_service import BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    added = [f'jti-{n}' for n in range(1000)]
+    for jti in added:
+        bloom.add(jti)
+
+    assert all(jti in bloom for jti in added)
+    false_positives = sum(f'other-{n}' in bloom for n in range(10000))
+    assert false_positives < 300  # 1% target, with room for chance
+
+
+def test_logout_revokes_only_that_token(client, register):
+    headers, _ = register('freelancer')
+    email = client.get('/api/profile', headers=headers).get_json()['email']
+    response = client.post('/api/login', json={'email': email, 'password': 'password123'})
+    other = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    assert client.post('/api/logout', headers=headers).status_code == 200
+    assert client.get('/api/profile', headers=headers).status_code == 401
+    assert client.get('/api/profile', headers=other).status_code == 200
+
+
+def test_revocations_by_other_processes_are_picked_up(app_context, client, register, monkeypatch):
+    headers, user_id = register('freelancer')
+    assert client.get('/api/profile', headers=headers).status_code == 200
+
+    # Stored by another process, this one's filter has never seen it
+    jti = decode_token(headers['Authorization'].split()[1])['jti']
+    db.session.add(RevokedToken(jti=jti, user_id=user_id, expires_at=datetime.utcnow() + timedelta(days=1)))
+    db.session.commit()
+    assert client.get('/api/profile', headers=headers).status_code == 200
+
+    monkeypatch.setattr(revocation_service, 'refresh_seconds', 0)
+    assert client.get('/api/profile', headers=headers).status_code == 401
@@ -0,0 +1,18 @@
+"""Skill suggestion limits"""
+
+import pytest
+
+from skill_service import SkillService
+
+
+@pytest.fixture
+def skills():
+    service = SkillService(max_suggestions=3)
+    service.rebuild([['Python', 'PyTorch', 'Pyramid', 'Pygame'], ['Python', 'PyTorch'], ['Python']])
+    return service
+
+
+@pytest.mark.parametrize('limit, expected', [(None, 3), (2, 2), (50, 3), (0, 1), (-2, 1)])
+def test_suggest_clamps_limit(skills, limit, expected):
+    assert len(skills.suggest('py', limit)) == expected
+
@@ -0,0 +1,90 @@
+"""Signed gateway webhooks"""
+
+import json
+import time
+import uuid
+
+import pytest
+
+from app import payment_service, webhook_service
+from gateways import GatewayUnavailable
+from models import db, Payment, WebhookEvent
+from webhook_service import SIGNATURE_HEADER, TIMESTAMP_HEADER, sign_payload
+
+SECRET = 'whsec_test'
+
+
+@pytest.fixture
+def webhooks(client, monkeypatch):
+    """Post signed events as razorpay, the function returns the response"""
+    monkeypatch.setitem(webhook_service.secrets, 'razorpay', SECRET)
+
+    def post(events, secret=SECRET, timestamp=None):
+        body = json.dumps({'events': events}).encode('utf-8')
+        timestamp = str(timestamp or int(time.time()))
+        return client.post('/api/webhooks/razorpay', data=body, content_type='application/json', headers={
+            TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign_payload(secret, timestamp, body)
+        })
+    return post
+
+
+@pytest.fixture
+def charging(client, register, hire, queue, monkeypatch):
+    """A payment whose charge timed out, pending with its transaction ID, returns the Payment"""
+    employer, _ = register('employer')
+    freelancer, _ = register('freelancer')
+    response = client.post('/api/payments/create', headers=employer,
+                           json={'job_id': hire(employer, freelancer), 'amount': 1500})
+
+    def charge(gateway, payment):
+        raise GatewayUnavailable(f'{gateway} timed out')
+    monkeypatch.setattr(payment_service.router, 'charge', charge)
+    assert queue._process_next()
+    return db.session.get(Payment, response.get_json()['payment']['id'])
+
+
+def _event(payment, event_type='payment.captured', **fields):
+    return dict({'id': f'evt_{uuid.uuid4().hex}', 'type': event_type,
+                 'transaction_id': payment.transaction_id, 'amount': 1500}, **fields)
+
+
+def test_captured_event_holds_the_payment_once(webhooks, charging):
+    event = _event(charging)
+
+    response = webhooks([event, event])
+    assert response.status_code == 200
+    assert response.get_json() == {'received': 2, 'applied': 1, 'ignored': 0, 'duplicates': 1}
+    db.session.expire_all()
+    assert (charging.status, charging.completed_at is not None) == ('held', True)
+
+    # Redelivered later, and after this process forgot it
+    assert webhooks([event]).get_json()['duplicates'] == 1
+    webhook_service._seen.clear()
+    assert webhooks([event]).get_json()['duplicates'] == 1
+    assert WebhookEvent.query.filter_by(event_id=event['id']).count() == 1
+
+
+def test_events_that_do_not_fit_are_recorded_not_applied(webhooks, charging):
+    wrong_amount = _event(charging, amount=15)
+    unknown = _event(charging, transaction_id='TXN-NOBODY')
+    refund_too_early = _event(charging, 'payment.refunded')
+
+    response = webhooks([wrong_amount, unknown, refund_too_early])
+    assert response.get_json()['ignored'] == 3
+    results = {row.event_id: row.result for row in WebhookEvent.query.filter(
+        WebhookEvent.event_id.in_([wrong_amount['id'], unknown['id'], refund_too_early['id']])
+    )}
+    assert results == {wrong_amount['id']: 'amount_mismatch', unknown['id']: 'unknown_payment',
+                       refund_too_early['id']: 'ignored'}
+    db.session.expire_all()
+    assert charging.status == 'pending'
+
+
+def test_unsigned_and_stale_requests_are_refused(client, webhooks, charging):
+    assert webhooks([_event(charging)], secret='guessed').status_code == 401
+    assert webhooks([_event(charging)], timestamp=int(time.time()) - 3600).status_code == 401
+    assert client.post('/api/webhooks/unknown-gateway', json={'events': []}).status_code == 404
+    assert webhooks([{'id': 'evt_1', 'type': 'payment.lost', 'transaction_id': 'x'}]).status_code == 400
+    db.session.expire_all()
+    assert charging.status == 'pending'
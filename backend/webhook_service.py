@@ -0,0 +1,185 @@
+"""
+Gateway webhooks
+Gateways post batches of payment events, signed with HMAC-SHA256 over the
+timestamp and the raw body. Events are deduplicated by (gateway, event id):
+a bounded in-process seen-set answers redeliveries without a query, and the
+unique constraint on webhook_events catches the rest, including duplicates
+delivered to other processes. Events are applied in groups, with one query
+for known ids, one for the payments and one transaction per group
+"""
+
+from typing import Callable, Dict, List
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+from models import db, Payment, WebhookEvent
+from money import to_paise
+
+SIGNATURE_HEADER = 'X-Webhook-Signature'
+TIMESTAMP_HEADER = 'X-Webhook-Timestamp'
+
+# Event type -> (payment statuses it applies to, new status)
+EVENT_TRANSITIONS = {
+    'payment.captured': (('pending',), 'held'),
+    'payment.failed': (('pending',), 'failed'),
+    'payment.refunded': (('held', 'completed'), 'refunded')
+}
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    """Signature a gateway sends for body, as 'sha256=<hex>'"""
+    digest = hmac.new(secret.encode('utf-8'), timestamp.encode('utf-8') + b'.' + body, hashlib.sha256)
+    return 'sha256=' + digest.hexdigest()
+
+
+class WebhookService:
+    """Service to verify, deduplicate and apply gateway webhook events"""
+
+    def __init__(self, secrets: Dict[str, str], apply: Callable, batch: Callable = nullcontext,
+                 tolerance_seconds: int = 300, group_size: int = 500, max_events: int = 1000,
+                 seen_capacity: int = 100000):
+        self.secrets = secrets  # gateway -> webhook secret, gateways without one are refused
+        self._apply = apply  # apply(payment, status) moves the payment to status
+        self._batch = batch  # Context the transitions of a group run in, e.g. a ledger batch
+        self.tolerance_seconds = tolerance_seconds  # Oldest timestamp accepted, bounds replays
+        self.group_size = group_size  # Events per transaction
+        self.max_events = max_events  # Per request
+        self.seen_capacity = seen_capacity
+
+        self._seen = OrderedDict()  # (gateway, event_id), least recently seen first
+        self._lock = threading.Lock()
+        self._counts = {'received': 0, 'applied': 0, 'ignored': 0, 'duplicates': 0, 'rejected': 0}
+
+    def accepts(self, gateway: str) -> bool:
+        return bool(self.secrets.get(gateway))
+
+    def verify(self, gateway: str, body: bytes, timestamp: str, signature: str) -> bool:
+        """Whether the request was signed with the gateway's secret within the tolerance"""
+        try:
+            fresh = abs(time.time() - int(timestamp)) <= self.tolerance_seconds
+        except (TypeError, ValueError):
+            fresh = False
+        if fresh and hmac.compare_digest(sign_payload(self.secrets[gateway], timestamp, body), signature or ''):
+            return True
+        with self._lock:
+            self._counts['rejected'] += 1
+        return False
+
+    def parse(self, body: bytes) -> List[Dict]:
+        """Events of a request body, raises ValueError when it is malformed"""
+        payload = json.loads(body)
+        events = payload.get('events') if isinstance(payload, dict) else None
+        if not isinstance(events, list) or not events or len(events) > self.max_events:
+            raise ValueError(f'events must be a list of 1 to {self.max_events} events')
+        for event in events:
+            if not isinstance(event, dict) or not isinstance(event.get('id'), str) or not event['id'] \
+                    or len(event['id']) > 100:
+                raise ValueError('Every event needs a string id')
+            if event.get('type') not in EVENT_TRANSITIONS:
+                raise ValueError(f"Unknown event type {event.get('type')!r}")
+            if not isinstance(event.get('transaction_id'), str):
+                raise ValueError('Every event needs a transaction_id')
+        return events
+
+    def ingest(self, gateway: str, events: List[Dict]) -> Dict:
+        """Apply new events in order, returns counts for the response"""
+        counts = {'received': len(events), 'applied': 0, 'ignored': 0, 'duplicates': 0}
+        fresh, batch_ids = [], set()
+        with self._lock:
+            for event in events:
+                key = (gateway, event['id'])
+                if key in batch_ids or key in self._seen:
+                    counts['duplicates'] += 1
+                    if key in self._seen:
+                        self._seen.move_to_end(key)
+                    continue
+                batch_ids.add(key)
+                fresh.append(event)
+
+        for start in range(0, len(fresh), self.group_size):
+            self._ingest_group(gateway, fresh[start:start + self.group_size], counts)
+
+        with self._lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+        return counts
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return dict(self._counts, seen=len(self._seen))
+
+    def _ingest_group(self, gateway: str, events: List[Dict], counts: Dict):
+        event_ids = [event['id'] for event in events]
+        for attempt in range(3):
+            try:
+                known = {
+                    event_id for (event_id,) in db.session.query(WebhookEvent.event_id).filter(
+                        WebhookEvent.gateway == gateway, WebhookEvent.event_id.in_(event_ids)
+                    )
+                }
+                group = [event for event in events if event['id'] not in known]
+                payments = {
+                    payment.transaction_id: payment for payment in Payment.query.filter(
+                        Payment.transaction_id.in_({event['transaction_id'] for event in group})
+                    ).order_by(Payment.id).with_for_update()
+                }
+
+                now = datetime.utcnow()
+                rows = []
+                with self._batch():
+                    for event in group:
+                        payment = payments.get(event['transaction_id'])
+                        rows.append({
+                            'gateway': gateway,
+                            'event_id': event['id'],
+                            'event_type': event['type'],
+                            'transaction_id': event['transaction_id'],
+                            'payment_id': payment.id if payment is not None else None,
+                            'result': self._apply_event(payment, event),
+                            'received_at': now
+                        })
+                if rows:
+                    db.session.execute(insert(WebhookEvent), rows)
+                db.session.commit()
+                break
+            except (IntegrityError, StaleDataError):
+                # Delivered to another process too, or the payment changed underneath, start over
+                db.session.rollback()
+                if attempt == 2:
+                    raise
+
+        counts['duplicates'] += len(known)
+        for row in rows:
+            counts['applied' if row['result'] == 'applied' else 'ignored'] += 1
+
+        with self._lock:
+            for event_id in event_ids:
+                self._seen[(gateway, event_id)] = None
+            while len(self._seen) > self.seen_capacity:
+                self._seen.popitem(last=False)
+
+    def _apply_event(self, payment, event: Dict) -> str:
+        """Apply one event to its payment, returns what happened"""
+        if payment is None:
+            return 'unknown_payment'
+        if event.get('amount') is not None:
+            try:
+                if to_paise(event['amount']) != to_paise(payment.amount):
+                    return 'amount_mismatch'
+            except ValueError:
+                return 'amount_mismatch'
+
+        from_statuses, status = EVENT_TRANSITIONS[event['type']]
+        if payment.status not in from_statuses:
+            return 'ignored'  # Already there, or overtaken by a later transition
+        self._apply(payment, status)
+        return 'applied'
@@ -69,9 +69,13 @@ const API = {
         },
         
         logout: () => {
-            localStorage.removeItem(CONFIG.STORAGE_KEYS.TOKEN);
-            localStorage.removeItem(CONFIG.STORAGE_KEYS.USER);
-            window.location.href = '/';
+            const clear = () => {
+                localStorage.removeItem(CONFIG.STORAGE_KEYS.TOKEN);
+                localStorage.removeItem(CONFIG.STORAGE_KEYS.USER);
+                window.location.href = '/';
+            };
+            // Revoke the token server side, log out locally either way
+            return API.request('/logout', { method: 'POST' }).catch(() => {}).finally(clear);
         }
     },
     
@@ -114,6 +118,11 @@ const API = {
             return API.request(`/jobs?${params}`);
         },
         
+        getFacets: (filters = {}) => {
+            const params = new URLSearchParams(filters);
+            return API.request(`/jobs/facets?${params}`);
+        },
+        
         getById: (jobId) => {
             return API.request(`/jobs/${jobId}`);
         },
@@ -136,8 +145,9 @@ const API = {
             });
         },
         
-        getApplications: (jobId) => {
-            return API.request(`/jobs/${jobId}/applications`);
+        getApplications: (jobId, options = {}) => {
+            const params = new URLSearchParams(options);
+            return API.request(`/jobs/${jobId}/applications?${params}`);
         }
     },
     
@@ -148,26 +158,65 @@ const API = {
                 method: 'PUT',
                 body: JSON.stringify({ status })
             });
+        },
+        
+        bulkUpdateStatus: (applicationIds, status, rejectOthers = false) => {
+            return API.request('/applications/status', {
+                method: 'PUT',
+                body: JSON.stringify({
+                    status,
+                    application_ids: applicationIds,
+                    reject_others: rejectOthers
+                })
+            });
         }
     },
     
     // Payments
     payments: {
-        create: (paymentData) => {
+        // Reuse the same idempotencyKey when retrying, the server then replays the first response
+        create: (paymentData, idempotencyKey) => {
             return API.request('/payments/create', {
                 method: 'POST',
-                body: JSON.stringify(paymentData)
+                body: JSON.stringify(paymentData),
+                headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}
             });
         },
         
-        release: (paymentId) => {
+        get: (paymentId) => {
+            return API.request(`/payments/${paymentId}`);
+        },
+        
+        release: (paymentId, idempotencyKey) => {
             return API.request(`/payments/${paymentId}/release`, {
-                method: 'POST'
+                method: 'POST',
+                headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}
             });
         },
         
-        getHistory: () => {
-            return API.request('/payments/history');
+        dispute: (paymentId) => {
+            return API.request(`/payments/${paymentId}/dispute`, { method: 'POST' });
+        },
+        
+        releaseMany: (paymentIds, idempotencyKey) => {
+            return API.request('/payments/release', {
+                method: 'POST',
+                headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+                body: JSON.stringify({ payment_ids: paymentIds })
+            });
+        },
+        
+        refundMany: (paymentIds, idempotencyKey) => {
+            return API.request('/payments/refund', {
+                method: 'POST',
+                headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+                body: JSON.stringify({ payment_ids: paymentIds })
+            });
+        },
+        
+        getHistory: (options = {}) => {
+            const params = new URLSearchParams(options);
+            return API.request(`/payments/history?${params}`);
         }
     },
     
@@ -178,6 +227,14 @@ const API = {
         }
     },
     
+    // Skills
+    skills: {
+        suggest: (prefix, limit = 10) => {
+            const params = new URLSearchParams({ prefix, limit });
+            return API.request(`/skills/suggest?${params}`, { auth: false });
+        }
+    },
+    
     // Search
     search: {
         freelancers: (filters = {}) => {